@@ -0,0 +1,102 @@
+import time
+from collections import OrderedDict
+
+class AlertAggregator:
+    """
+    Collapses alert storms into windows keyed by (ip, reason).
+
+    The first alert for a key opens a window and is emitted as usual. Further
+    alerts for the key only update the window's counters, which are emitted as
+    a rolled-up update at most every update_interval_s. A window closes after
+    idle_timeout_s without alerts, emitting a final summary if anything was
+    rolled up. At most max_windows windows are kept; when the limit is reached
+    the least recently active window is closed early.
+
+    Updates and summaries say in aggregate["rolled_up"] and ["rolled_up_risk_sum"]
+    how many alerts (and how much risk) were folded in since the window's previous
+    event, so counts kept from the events add up to every alert observed.
+    """
+    def __init__(self, update_interval_s: float = 5.0, idle_timeout_s: float = 30.0, max_windows: int = 10000):
+        self.update_interval_s = update_interval_s
+        self.idle_timeout_s = idle_timeout_s
+        self.max_windows = max_windows
+        self.windows = OrderedDict()  # (ip, reason) -> window dict, least recently active first
+        self.suppressed_alerts = 0
+        self._evicted = []  # Summaries of windows closed early, emitted on the next tick
+
+    def observe(self, payload: dict, now: float = None):
+        """
+        Records a malicious flow. Returns the payload to store and broadcast if it
+        opens a new window, or None if it was folded into an open one.
+        """
+        now = time.monotonic() if now is None else now
+        key = (payload['ip'], payload['reason'])
+        window = self.windows.get(key)
+        if window is not None:
+            window["count"] += 1
+            window["risk_sum"] += payload['risk_score']
+            window["max_risk_score"] = max(window["max_risk_score"], payload['risk_score'])
+            window["last_seen"] = payload['timestamp']
+            window["last_activity"] = now
+            self.windows.move_to_end(key)
+            self.suppressed_alerts += 1
+            return None
+
+        if len(self.windows) >= self.max_windows:
+            _, oldest = self.windows.popitem(last=False)
+            if oldest["count"] > 1:
+                self._evicted.append(self._summary(oldest, "closed"))
+
+        self.windows[key] = {
+            # Summaries reuse the opening alert without its feature vector, to keep windows small
+            "alert": {field: value for field, value in payload.items() if field != 'features'},
+            "count": 1,
+            "risk_sum": payload['risk_score'],
+            "max_risk_score": payload['risk_score'],
+            "first_seen": payload['timestamp'],
+            "last_seen": payload['timestamp'],
+            "last_activity": now,
+            "last_update": now,
+            "emitted_count": 1,
+            "emitted_risk_sum": payload['risk_score'],
+        }
+        payload['aggregate'] = {"state": "open", "count": 1}
+        return payload
+
+    def tick(self, now: float = None) -> list:
+        """Returns the rolled-up updates and closing summaries that are due."""
+        now = time.monotonic() if now is None else now
+        events, self._evicted = self._evicted, []
+        for key, window in list(self.windows.items()):
+            if now - window["last_activity"] >= self.idle_timeout_s:
+                del self.windows[key]
+                if window["count"] > 1:
+                    events.append(self._summary(window, "closed"))
+            elif window["count"] > window["emitted_count"] and now - window["last_update"] >= self.update_interval_s:
+                window["last_update"] = now
+                events.append(self._summary(window, "update"))
+        return events
+
+    @staticmethod
+    def _summary(window: dict, state: str) -> dict:
+        """The window's opening alert with its risk score and counters rolled up. Marks them as emitted."""
+        rolled_up = window["count"] - window["emitted_count"]
+        rolled_up_risk_sum = window["risk_sum"] - window["emitted_risk_sum"]
+        window["emitted_count"], window["emitted_risk_sum"] = window["count"], window["risk_sum"]
+        summary = dict(window["alert"])
+        summary['risk_score'] = window["max_risk_score"]
+        summary['timestamp'] = window["last_seen"]
+        summary['aggregate'] = {
+            "state": state,
+            "count": window["count"],
+            "max_risk_score": window["max_risk_score"],
+            "mean_risk_score": window["risk_sum"] / window["count"],
+            "first_seen": window["first_seen"],
+            "last_seen": window["last_seen"],
+            "rolled_up": rolled_up,
+            "rolled_up_risk_sum": rolled_up_risk_sum,
+        }
+        return summary
+
+    def stats(self) -> dict:
+        return {"open_windows": len(self.windows), "suppressed_alerts": self.suppressed_alerts}
@@ -0,0 +1,170 @@
+import ipaddress
+from collections import OrderedDict
+from datetime import datetime
+
+import database
+
+def _record(row) -> dict:
+    return {field: row[field] for field in ("owner", "purpose", "criticality")}
+
+class PrefixIndex:
+    """
+    Longest-prefix match over CIDR ranges.
+    Keeps one hash table per prefix length, so a lookup costs at most one probe
+    per distinct prefix length in use (<= 33 for IPv4), however many ranges there are.
+    """
+    def __init__(self):
+        self._tables = {4: {}, 6: {}}  # IP version -> {prefix length: {network address int: value}}
+        self._lengths = {4: [], 6: []}  # Prefix lengths in use, longest first
+
+    def add(self, cidr: str, value):
+        network = ipaddress.ip_network(cidr, strict=False)
+        tables = self._tables[network.version]
+        tables.setdefault(network.prefixlen, {})[int(network.network_address)] = value
+        self._lengths[network.version] = sorted(tables, reverse=True)
+
+    def lookup(self, ip: str):
+        """Returns the value of the most specific range containing ip, or None."""
+        try:
+            address = ipaddress.ip_address(ip)
+        except ValueError:
+            return None
+        tables = self._tables[address.version]
+        host_bits = address.max_prefixlen
+        address_int = int(address)
+        for prefix_length in self._lengths[address.version]:
+            shift = host_bits - prefix_length
+            value = tables[prefix_length].get((address_int >> shift) << shift)
+            if value is not None:
+                return value
+        return None
+
+    def __len__(self):
+        return sum(len(table) for tables in self._tables.values() for table in tables.values())
+
+
+class AssetStore:
+    """
+    Asset inventory with bounded memory.
+    - Configured assets: exact IPs, always kept in memory.
+    - Ranges: CIDR blocks with owner/purpose/criticality, matched by longest prefix.
+    - Auto-discovered hosts: written to SQLite when first seen, and kept in an LRU of
+      at most max_discovered entries for fast lookups. Their last_seen reaches SQLite
+      when flush() is called (periodically) or when they are evicted. get() falls back
+      to SQLite for hosts that are not in the LRU; on the event loop, read them back in
+      batches instead (missing() + database.get_assets_by_ip() in a thread + remember())
+      and call get(ip, load=False).
+    persist(ip, record, first_seen, last_seen) stores a discovered host; it defaults to
+    database.save_asset, and shard workers pass one that hands the rows to the merge stage.
+    When persist returns False (the writer is behind), the host is retried on the next flush().
+    """
+    def __init__(self, assets: dict, ranges: dict = None, max_discovered: int = 50000, persist=None):
+        self.assets = dict(assets)
+        self.ranges = PrefixIndex()
+        for cidr, record in (ranges or {}).items():
+            self.ranges.add(cidr, record)
+        self.max_discovered = max_discovered
+        self.persist = persist or database.save_asset
+        self.discovered = OrderedDict()  # ip -> [record, first_seen, last_seen], least recently seen first
+        self._dirty = set()  # Discovered hosts whose last_seen changed since it was persisted
+        self.evicted = 0
+
+    def get(self, ip: str, load: bool = True):
+        """
+        The asset record for ip: exact match first, then the enclosing range, else None.
+        load=False skips the SQLite read for hosts not in the LRU.
+        """
+        record = self.assets.get(ip)
+        if record is not None:
+            return record
+        entry = self.discovered.get(ip)
+        if entry is not None:
+            return entry[0]
+        # Discovered earlier but evicted, or by a previous run
+        row = database.get_asset(ip) if load else None
+        if row is not None:
+            return _record(row)
+        return self.ranges.lookup(ip)
+
+    def criticality(self, ip: str, load: bool = True) -> str:
+        record = self.get(ip, load)
+        return record['criticality'] if record else 'Unknown'
+
+    def missing(self, ips) -> list:
+        """The distinct IPs among ips that get() would have to read from SQLite."""
+        return list({ip for ip in ips if ip not in self.assets and ip not in self.discovered})
+
+    def remember(self, rows: dict):
+        """Puts persisted hosts (ip -> assets row) back in the LRU, so they are not read again."""
+        for ip, row in rows.items():
+            if ip in self.assets or ip in self.discovered:
+                continue
+            self.discovered[ip] = [_record(row), row['first_seen'], row['last_seen']]
+            self._evict()
+
+    def discover(self, ip: str, timestamp: str = None) -> bool:
+        """Records a host seen in traffic. Returns True if it was not known before."""
+        if ip in self.assets:
+            return False
+        timestamp = timestamp or datetime.now().isoformat()
+        entry = self.discovered.get(ip)
+        if entry is not None:
+            entry[2] = timestamp
+            self.discovered.move_to_end(ip)
+            self._dirty.add(ip)
+            return False
+
+        # Hosts inside a configured range inherit its criticality
+        enclosing = self.ranges.lookup(ip)
+        record = {
+            "owner": "Unassigned",
+            "purpose": "Auto-Discovered Host",
+            "criticality": enclosing['criticality'] if enclosing else "Low"
+        }
+        self.discovered[ip] = [record, timestamp, timestamp]
+        if self.persist(ip, record, timestamp, timestamp) is False:
+            self._dirty.add(ip)
+
+        self._evict()
+        return True
+
+    def _evict(self):
+        if len(self.discovered) > self.max_discovered:
+            old_ip, (old_record, first_seen, last_seen) = self.discovered.popitem(last=False)
+            self.persist(old_ip, old_record, first_seen, last_seen)
+            self._dirty.discard(old_ip)
+            self.evicted += 1
+
+    def flush(self) -> int:
+        """Persists the last_seen of every host seen again since the previous flush. Returns how many."""
+        dirty, self._dirty = self._dirty, set()
+        for ip in dirty:
+            record, first_seen, last_seen = self.discovered[ip]
+            if self.persist(ip, record, first_seen, last_seen) is False:
+                self._dirty.add(ip)
+        return len(dirty)
+
+    def total(self) -> int:
+        return len(self.assets) + database.count_assets()
+
+    def page(self, offset: int = 0, limit: int = 1000) -> dict:
+        """
+        One page of the inventory as {ip: record}: configured assets first, then
+        discovered hosts from SQLite, most recently seen first.
+        """
+        configured = list(self.assets.items())[offset:offset + limit]
+        result = dict(configured)
+        remaining = limit - len(configured)
+        if remaining > 0:
+            db_offset = max(0, offset - len(self.assets))
+            for row in database.get_assets(db_offset, remaining):
+                result[row.pop('ip')] = row
+        return result
+
+    def stats(self) -> dict:
+        return {
+            "configured": len(self.assets),
+            "ranges": len(self.ranges),
+            "discovered_in_memory": len(self.discovered),
+            "evicted": self.evicted,
+        }
@@ -0,0 +1,322 @@
+"""
+Benchmarks the backend's hot paths in isolation.
+
+Each benchmark reports throughput, p50/p99 latency and peak traced memory. The results
+are written as JSON and compared against a stored baseline. The exit status is 1 when a
+benchmark regressed by more than --tolerance, or when there is no baseline to compare
+with (create one on the reference machine with --save-baseline).
+
+    python benchmark.py                                 # run everything, compare with benchmark_baseline.json
+    python benchmark.py --only detectors --only kpis    # run some suites
+    python benchmark.py --db-sizes 10000 --save-baseline
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import shutil
+import tempfile
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+import numpy as np
+
+import database
+from features import vector_to_dict
+from log_generator import generate_batch, generate_log
+
+# --- Measurement helpers ---
+
+def peak_memory_kb(fn, *args) -> float:
+    """Peak memory traced while running fn once, above what was allocated before the call."""
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        fn(*args)
+        return (tracemalloc.get_traced_memory()[1] - before) / 1024
+    finally:
+        tracemalloc.stop()
+
+def summarize(latencies: list, elapsed: float, items: int, peak_kb: float) -> dict:
+    latencies_ms = np.asarray(latencies) * 1000
+    return {
+        "iterations": len(latencies),
+        "throughput_per_s": items / elapsed if elapsed > 0 else 0.0,
+        "p50_ms": float(np.percentile(latencies_ms, 50)),
+        "p99_ms": float(np.percentile(latencies_ms, 99)),
+        "peak_memory_kb": round(peak_kb, 1),
+    }
+
+def measure(fn, inputs, items_per_call: int = 1, finish=None, memory_input=None) -> dict:
+    """
+    Times fn(x) for every x in inputs. Throughput counts only the time spent in fn, so
+    lazily produced inputs do not skew it, plus finish(), which runs once at the end to
+    wait for background work (e.g. database commits).
+    Memory is traced in a separate call with memory_input, because tracing skews timings.
+    """
+    latencies = []
+    for x in inputs:
+        t0 = time.perf_counter()
+        fn(x)
+        latencies.append(time.perf_counter() - t0)
+    elapsed = sum(latencies)
+    if finish:
+        t0 = time.perf_counter()
+        finish()
+        elapsed += time.perf_counter() - t0
+    peak_kb = peak_memory_kb(fn, memory_input) if memory_input is not None else 0.0
+    return summarize(latencies, elapsed, len(latencies) * items_per_call, peak_kb)
+
+def report(results: dict, name: str, result: dict):
+    results[name] = result
+    print(f"  {name:<48} {result['throughput_per_s']:>12,.1f}/s  p50 {result['p50_ms']:>9.3f} ms  "
+          f"p99 {result['p99_ms']:>9.3f} ms  peak {result['peak_memory_kb']:>10,.1f} KiB")
+
+# --- Test data ---
+
+def make_alerts(n: int, days: int = 30, seed: int = 0, chunk_size: int = 10000):
+    """Yields n alert payloads with timestamps spread over the past number of days."""
+    rng = random.Random(seed)
+    now = datetime.now()
+    produced = 0
+    while produced < n:
+        count = min(chunk_size, n - produced)
+        logs, features = generate_batch(count, malicious_ratio=1.0, seed=seed + produced)
+        for log, vector in zip(logs, features):
+            log['timestamp'] = (now - timedelta(seconds=rng.uniform(0, days * 86400))).isoformat()
+            log['risk_score'] = rng.choice((40, 70, 100))
+            log['reason'] = log.get('attack_type_simulated', "Anomalous Behavior")
+            log['playbook'] = ["Isolate the host", "Block the source IP"]
+            log['features'] = vector_to_dict(vector)
+            yield log
+        produced += count
+
+@contextmanager
+def temporary_database():
+    """Points the database module at a fresh database in a temporary directory."""
+    directory = tempfile.mkdtemp(prefix="benchmark-")
+    original = database.DB_NAME
+    database.close()
+    database.DB_NAME = os.path.join(directory, "benchmark.db")
+    try:
+        database.init_db()
+        yield
+    finally:
+        database.close()
+        database.DB_NAME = original
+        shutil.rmtree(directory, ignore_errors=True)
+
+def populate(n: int, criticalities=("High", "Medium", "Low", "Unknown")) -> dict:
+    """Adds n alerts through database.add_alert and waits for them to be committed."""
+    return measure(lambda alert: database.add_alert(alert, random.choice(criticalities)), make_alerts(n),
+                   finish=database.flush)
+
+# --- Benchmark suites ---
+
+def bench_generate_log(args, results: dict):
+    for _ in range(100):
+        generate_log()  # Warm-up
+    report(results, "generate_log", measure(lambda _: generate_log(), range(args.iterations), memory_input=0))
+    report(results, "generate_batch[256]",
+           measure(lambda _: generate_batch(256), range(max(1, args.iterations // 50)), items_per_call=256,
+                   memory_input=0))
+
+def bench_detectors(args, results: dict):
+    from ml_model import DETECTORS, model_instance
+
+    if not model_instance.is_ready():
+        model_instance.load()
+    _, X = generate_batch(max(args.iterations, 256), malicious_ratio=0.05, seed=1)
+    X_scaled = model_instance._scale(X)
+    rows = [X_scaled[i:i + 1] for i in range(len(X_scaled))]
+
+    # Each detector on one row at a time, as is_malicious would call it
+    for name in DETECTORS:
+        if not model_instance._detector_ready(name):
+            print(f"  {name}: not loaded, skipped")
+            continue
+        flag = getattr(model_instance, f"_flag_{name}")
+        for row in rows[:20]:
+            flag(row)
+        report(results, f"detector[{name}]", measure(flag, rows[:args.iterations], memory_input=rows[0]))
+
+    report(results, "is_malicious", measure(model_instance.is_malicious, X[:args.iterations], memory_input=X[0]))
+    batches = [X[i:i + 256] for i in range(0, len(X) - 255, 256)]
+    report(results, "is_malicious_batch[256]",
+           measure(model_instance.is_malicious_batch, batches, items_per_call=256, memory_input=batches[0]))
+
+def bench_database(args, results: dict):
+    with temporary_database():
+        stored = 0
+        for size in sorted(args.db_sizes):
+            # add_alert latency is the enqueue cost; throughput includes the commits
+            result = populate(size - stored)
+            result["peak_memory_kb"] = round(peak_memory_kb(database.add_alert, next(make_alerts(1, seed=size))), 1)
+            database.flush()
+            stored = size + 1
+            report(results, f"add_alert[rows={size}]", result)
+
+            iterations = max(3, args.query_iterations)
+            report(results, f"get_alerts_in_range[rows={size},days=1]",
+                   measure(database.get_alerts_in_range, [1] * iterations, memory_input=1))
+            report(results, f"get_alerts_in_range[rows={size},days=1,raw_features]",
+                   measure(lambda days: database.get_alerts_in_range(days, raw_features=True), [1] * iterations,
+                           memory_input=1))
+
+def bench_kpis(args, results: dict):
+    from fastapi.testclient import TestClient
+    import main
+
+    with temporary_database():
+        populate(args.kpi_rows)
+        client = TestClient(main.app)  # Not entered as a context manager, so no background tasks start
+
+        def uncached(range_days):
+            main.kpi_cache.invalidate()
+            client.get("/api/kpis", params={"range_days": range_days}).raise_for_status()
+
+        def cached(range_days):
+            client.get("/api/kpis", params={"range_days": range_days}).raise_for_status()
+
+        for range_days in (1, 7, 30):
+            report(results, f"kpis[range_days={range_days},uncached]",
+                   measure(uncached, [range_days] * args.query_iterations, memory_input=range_days))
+            report(results, f"kpis[range_days={range_days},cached]",
+                   measure(cached, [range_days] * args.iterations, memory_input=range_days))
+        main.kpi_cache.invalidate()
+
+class FakeWebSocket:
+    """Stands in for a WebSocket; counts what it is sent."""
+    def __init__(self):
+        self.received = 0
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, message: str):
+        self.received += 1
+
+    async def close(self, code: int = 1000):
+        pass
+
+async def _broadcast_run(clients: int, iterations: int, payload: dict) -> dict:
+    from main import ConnectionManager
+
+    manager = ConnectionManager(queue_size=256, overflow_policy="drop_oldest")
+    sockets = [FakeWebSocket() for _ in range(clients)]
+    for socket in sockets:
+        await manager.connect(socket)
+
+    async def deliver(expected: int):
+        # Time until every client's writer task has sent the message
+        await manager.broadcast(payload)
+        while any(socket.received < expected for socket in sockets):
+            await asyncio.sleep(0)
+
+    latencies = []
+    start = time.perf_counter()
+    for i in range(iterations):
+        t0 = time.perf_counter()
+        await deliver(i + 1)
+        latencies.append(time.perf_counter() - t0)
+    elapsed = time.perf_counter() - start
+
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    await deliver(iterations + 1)
+    peak_kb = (tracemalloc.get_traced_memory()[1] - before) / 1024
+    tracemalloc.stop()
+
+    for socket in sockets:
+        manager.disconnect(socket)
+    return summarize(latencies, elapsed, iterations, peak_kb)
+
+def bench_broadcast(args, results: dict):
+    payload = next(make_alerts(1))
+    for clients in args.clients:
+        iterations = max(10, args.iterations // max(1, clients // 10))
+        report(results, f"broadcast[clients={clients}]", asyncio.run(_broadcast_run(clients, iterations, payload)))
+
+SUITES = {
+    "generate_log": bench_generate_log,
+    "detectors": bench_detectors,
+    "database": bench_database,
+    "kpis": bench_kpis,
+    "broadcast": bench_broadcast,
+}
+
+# --- Baseline comparison ---
+
+# Metric -> True if higher is better. p99 is reported but too noisy on shared machines to fail on.
+COMPARED_METRICS = {"throughput_per_s": True, "p50_ms": False, "peak_memory_kb": False}
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    """Returns a description of every metric that is worse than the baseline by more than tolerance."""
+    regressions = []
+    for name, current in results.items():
+        previous = baseline.get(name)
+        if previous is None:
+            continue
+        for metric, higher_is_better in COMPARED_METRICS.items():
+            old, new = previous.get(metric), current.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            if (higher_is_better and change < -tolerance) or (not higher_is_better and change > tolerance):
+                regressions.append(f"{name} {metric}: {old:,.3f} -> {new:,.3f} ({change:+.0%})")
+    return regressions
+
+def parse_sizes(value: str) -> list:
+    return [int(size) for size in value.split(",") if size]
+
+if __name__ == "__main__":
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--only", action="append", choices=list(SUITES), help="Suite to run (repeatable)")
+    parser.add_argument("--output", default=os.path.join(base_dir, "benchmark_results.json"))
+    parser.add_argument("--baseline", default=os.path.join(base_dir, "benchmark_baseline.json"))
+    parser.add_argument("--save-baseline", action="store_true", help="Store these results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed relative slowdown before failing")
+    parser.add_argument("--iterations", type=int, default=2000)
+    parser.add_argument("--query-iterations", type=int, default=20)
+    parser.add_argument("--db-sizes", type=parse_sizes, default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--kpi-rows", type=int, default=100_000)
+    parser.add_argument("--clients", type=parse_sizes, default=[10, 100, 1000])
+    args = parser.parse_args()
+
+    results = {}
+    for suite in args.only or SUITES:
+        print(f"[{suite}]")
+        SUITES[suite](args, results)
+
+    output = {
+        "created": datetime.now().isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(output, f, indent=2)
+    print(f"Results written to {args.output}")
+
+    if args.save_baseline:
+        shutil.copyfile(args.output, args.baseline)
+        print(f"Baseline saved to {args.baseline}")
+    elif os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+        if not baseline.keys() & results.keys():
+            raise SystemExit(f"None of these benchmarks are in {args.baseline}; nothing was compared")
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print(f"{len(regressions)} regression(s) beyond {args.tolerance:.0%}:")
+            for line in regressions:
+                print(f"  {line}")
+            raise SystemExit(1)
+        print(f"No regressions beyond {args.tolerance:.0%} against {args.baseline}")
+    else:
+        raise SystemExit(f"No baseline at {args.baseline}; run with --save-baseline to create one")
@@ -0,0 +1,213 @@
+"""
+Compiles the LightGBM and IsolationForest models into flat NumPy arrays.
+
+This is the only step that needs LightGBM and scikit-learn's ensembles for the tree
+models: each pickle is flattened once into a <name>.trees directory of .npy files,
+which the backend evaluates with CompiledTreeEnsemble (memory-mapped, so scoring
+worker processes share one copy). The compiled model is checked against the
+library's predict() before it is written.
+
+    python compile_trees.py
+    python compile_trees.py --model lgb_main_smote_weighted.pkl --check-rows 5000
+
+Run it again whenever a pickle is retrained; the backend falls back to the pickle
+while its compiled copy is missing or was compiled from a different file.
+"""
+import argparse
+import os
+import time
+
+import joblib
+import numpy as np
+
+from features import FEATURE_NAMES
+from tree_ensemble import MISSING_NAN, MISSING_NONE, MISSING_ZERO, CompiledTreeEnsemble, file_sha256
+
+TREE_MODELS = ("lgb_main_smote_weighted.pkl", "lgb_specialist_Web_Attack_-_XSS.pkl", "isolation_forest.pkl")
+
+LIGHTGBM_MISSING_TYPES = {"None": MISSING_NONE, "Zero": MISSING_ZERO, "NaN": MISSING_NAN}
+
+class _NodeArrays:
+    """Collects the nodes of all trees; leaves point back to themselves."""
+    def __init__(self):
+        self.feature, self.threshold, self.children, self.value = [], [], [], []
+        self.missing_type, self.default_left, self.roots, self.tree_depth = [], [], [], []
+        self._depth = 0  # Deepest leaf of the tree being added
+
+    def add(self, feature=0, threshold=0.0, value=0.0, missing_type=MISSING_NONE, default_left=False) -> int:
+        node = len(self.feature)
+        self.feature.append(feature)
+        self.threshold.append(threshold)
+        self.children.extend((node, node))
+        self.value.append(value)
+        self.missing_type.append(missing_type)
+        self.default_left.append(default_left)
+        return node
+
+    def add_leaf(self, value: float, depth: int) -> int:
+        self._depth = max(self._depth, depth)
+        return self.add(value=value)
+
+    def link(self, node: int, left: int, right: int):
+        self.children[2 * node] = left
+        self.children[2 * node + 1] = right
+
+    def finish_tree(self, root: int):
+        self.roots.append(root)
+        self.tree_depth.append(self._depth)
+        self._depth = 0
+
+    def ensemble(self, meta: dict) -> CompiledTreeEnsemble:
+        arrays = {
+            "feature": np.array(self.feature, dtype=np.int32),
+            "threshold": np.array(self.threshold, dtype=np.float64),
+            "children": np.array(self.children, dtype=np.int32),
+            "value": np.array(self.value, dtype=np.float64),
+            "roots": np.array(self.roots, dtype=np.int32),
+            "tree_depth": np.array(self.tree_depth, dtype=np.int32),
+            "missing_type": np.array(self.missing_type, dtype=np.int8),
+            "default_left": np.array(self.default_left, dtype=bool),
+        }
+        return CompiledTreeEnsemble(arrays, {**meta, "n_trees": len(self.roots), "n_nodes": len(self.feature)})
+
+# --- LightGBM ---
+
+LIGHTGBM_OUTPUTS = {"multiclass": "multiclass", "binary": "binary", "regression": "regression"}
+
+def compile_lightgbm(booster) -> CompiledTreeEnsemble:
+    """Flattens a Booster's trees (up to its best iteration, like predict()) via dump_model()."""
+    model = booster.dump_model()
+    objective, *objective_params = model["objective"].split()
+    if objective not in LIGHTGBM_OUTPUTS:
+        raise ValueError(f"Unsupported LightGBM objective: {model['objective']}")
+    params = dict(param.split(":") for param in objective_params)
+
+    nodes = _NodeArrays()
+
+    def add(tree: dict, depth: int) -> int:
+        if "leaf_value" in tree:
+            return nodes.add_leaf(tree["leaf_value"], depth)
+        if tree["decision_type"] != "<=":
+            raise ValueError(f"Unsupported LightGBM split: {tree['decision_type']} (categorical features?)")
+        node = nodes.add(tree["split_feature"], tree["threshold"],
+                         missing_type=LIGHTGBM_MISSING_TYPES[tree["missing_type"]],
+                         default_left=tree["default_left"])
+        nodes.link(node, add(tree["left_child"], depth + 1), add(tree["right_child"], depth + 1))
+        return node
+
+    for tree in model["tree_info"]:
+        if tree.get("is_linear"):
+            raise ValueError("Linear trees are not supported")
+        nodes.finish_tree(add(tree["tree_structure"], 0))
+
+    return nodes.ensemble({
+        "source": "lightgbm",
+        "output": LIGHTGBM_OUTPUTS[objective],
+        "n_classes": model["num_class"],
+        "sigmoid": float(params.get("sigmoid", 1.0)),
+        "n_features": model["max_feature_idx"] + 1,
+        "input_dtype": "float64",
+        "nan_as_zero": True,
+    })
+
+# --- IsolationForest ---
+
+def compile_isolation_forest(forest) -> CompiledTreeEnsemble:
+    """
+        Flattens an IsolationForest. Each leaf holds the path length its rows add up:
+        its depth plus the average path length c(n) of the n training samples it holds.
+    """
+    from sklearn.ensemble._iforest import _average_path_length
+
+    # Like sklearn, only index features per tree when the trees were fit on a subset
+    subsample_features = forest._max_features != forest.n_features_in_
+    nodes = _NodeArrays()
+    for estimator, features in zip(forest.estimators_, forest.estimators_features_):
+        tree = estimator.tree_
+        depths = np.zeros(tree.node_count, dtype=np.int64)
+        offset = len(nodes.feature)
+        for node in range(tree.node_count):  # Parents come before their children
+            left, right = tree.children_left[node], tree.children_right[node]
+            if left == -1:
+                # Same arithmetic as sklearn, which counts the nodes on the decision path (depth + 1)
+                path_length = (depths[node] + 1) + _average_path_length([tree.n_node_samples[node]])[0] - 1.0
+                nodes.add_leaf(float(path_length), int(depths[node]))
+                continue
+            depths[left] = depths[right] = depths[node] + 1
+            feature = features[tree.feature[node]] if subsample_features else tree.feature[node]
+            nodes.add(int(feature), float(tree.threshold[node]))
+            nodes.link(offset + node, offset + left, offset + right)
+        nodes.finish_tree(offset)
+
+    return nodes.ensemble({
+        "source": "isolation_forest",
+        "output": "isolation_forest",
+        "n_classes": 1,
+        "n_features": forest.n_features_in_,
+        "input_dtype": "float32",  # sklearn trees compare float32 inputs
+        "nan_as_zero": False,
+        "offset": float(forest.offset_),
+        "denominator": float(len(forest.estimators_) * _average_path_length([forest.max_samples_])[0]),
+    })
+
+# --- Compile and check ---
+
+def check_rows(ensemble: CompiledTreeEnsemble, n_rows: int) -> np.ndarray:
+    """Random scaled rows, plus rows made of split thresholds to exercise the x <= threshold boundary."""
+    rng = np.random.default_rng(0)
+    X = rng.random((n_rows, ensemble.n_features))
+    splits = ensemble.children[0::2] != np.arange(len(ensemble.feature))
+    boundary = X.copy()
+    for feature in range(ensemble.n_features):
+        thresholds = ensemble.threshold[splits & (ensemble.feature == feature)]
+        if len(thresholds):
+            boundary[:, feature] = rng.choice(thresholds, size=n_rows)
+    return np.vstack([X, boundary])
+
+def compile_model(model_path: str, n_check_rows: int = 2000, tolerance: float = 1e-9):
+    model = joblib.load(model_path)
+    if hasattr(model, "dump_model"):
+        ensemble = compile_lightgbm(model)
+    elif hasattr(model, "estimators_features_"):
+        ensemble = compile_isolation_forest(model)
+    else:
+        raise SystemExit(f"{model_path}: not a LightGBM Booster or an IsolationForest ({type(model).__name__})")
+    if ensemble.n_features != len(FEATURE_NAMES):
+        raise SystemExit(f"{model_path}: expected {len(FEATURE_NAMES)} features, the model has {ensemble.n_features}")
+    ensemble.meta["source_sha256"] = file_sha256(model_path)
+
+    X = check_rows(ensemble, n_check_rows)
+    expected, actual = np.asarray(model.predict(X)), ensemble.predict(X)
+    max_diff = float(np.max(np.abs(expected - actual)))
+    if ensemble.meta["output"] == "multiclass":
+        decisions_match = np.array_equal(np.argmax(expected, axis=1), np.argmax(actual, axis=1))
+    elif ensemble.meta["output"] == "binary":
+        decisions_match = np.array_equal(expected > 0.5, actual > 0.5)
+    else:
+        decisions_match = np.array_equal(expected, actual)
+
+    timings = []
+    for rows in (1, 256):
+        for predict in (model.predict, ensemble.predict):
+            started = time.perf_counter()
+            for _ in range(20):
+                predict(X[:rows])
+            timings.append((time.perf_counter() - started) / 20 * 1e3)
+
+    output_path = CompiledTreeEnsemble.path_for(model_path)
+    print(f"{os.path.basename(model_path)}: {ensemble.meta['n_trees']} trees, {ensemble.meta['n_nodes']} nodes, "
+          f"depth {int(ensemble.tree_depth.max())}; max difference {max_diff:.2e} over {len(X)} rows; "
+          f"1 row {timings[0]:.2f} -> {timings[1]:.2f} ms, 256 rows {timings[2]:.2f} -> {timings[3]:.2f} ms")
+    if max_diff > tolerance or not decisions_match:
+        raise SystemExit(f"Compiled model differs from {model_path} by more than {tolerance}")
+    ensemble.save(output_path)
+    print(f"Wrote {output_path}")
+
+if __name__ == "__main__":
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--model", action="append", help="Pickled model to compile (repeatable; default: all three)")
+    parser.add_argument("--check-rows", type=int, default=2000)
+    args = parser.parse_args()
+    for path in args.model or [os.path.join(base_dir, name) for name in TREE_MODELS]:
+        compile_model(path, args.check_rows)
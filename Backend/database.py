@@ -1,24 +1,410 @@
 import sqlite3
 from datetime import datetime, timedelta
 import json
+import os
+import queue
+import threading
+import time
+from contextlib import closing, contextmanager
+
+import metrics
+from features import FEATURE_NAMES, pack_features, unpack_features
 
 DB_NAME = "security_dashboard.db"
 
+# Bumped whenever init_db() needs to migrate existing databases (stored in PRAGMA user_version)
+# 1: features as packed float32 BLOBs, playbooks deduplicated into the playbooks table
+# 2: alerts split into one table per day (alerts_YYYYMMDD)
+# 3: keyset/covering indexes on every partition
+SCHEMA_VERSION = 3
+
+# --- Alert retention ---
+# Alerts live in one table per day, so expired days are dropped whole instead of DELETEd.
+# With ALERT_ARCHIVE_DIR set, a day is first exported there as a compressed columnar .npz file.
+# Pruning is off (alerts are kept forever) until ALERT_RETENTION_DAYS is set.
+ALERT_RETENTION_DAYS = int(os.getenv("ALERT_RETENTION_DAYS", "0"))
+ALERT_ARCHIVE_DIR = os.getenv("ALERT_ARCHIVE_DIR", "")
+PARTITION_PREFIX = "alerts_"
+
+# --- Alert writer settings ---
+# Alerts are queued and group-committed by a single writer thread every
+# WRITER_BATCH_SIZE rows or WRITER_FLUSH_INTERVAL_MS, whichever comes first.
+WRITER_BATCH_SIZE = int(os.getenv("DB_WRITER_BATCH_SIZE", "500"))
+WRITER_FLUSH_INTERVAL_MS = int(os.getenv("DB_WRITER_FLUSH_INTERVAL_MS", "200"))
+WRITER_QUEUE_SIZE = int(os.getenv("DB_WRITER_QUEUE_SIZE", "50000"))
+READ_POOL_SIZE = int(os.getenv("DB_READ_POOL_SIZE", "4"))
+
+DB_WRITE_SECONDS = metrics.Histogram("db_write_seconds", "Time to write and commit one batch of alerts and assets")
+DB_WRITE_ERRORS = metrics.Counter("db_write_errors_total", "Batches the alert writer failed to commit")
+DB_WRITER_QUEUE = metrics.Gauge("db_writer_queue_depth", "Alerts and assets waiting for the writer")
+DB_WRITER_QUEUE.set_function(lambda: _writer.pending() if _writer else 0)
+DB_WRITER_DROPPED = metrics.Counter("db_writer_dropped_total", "Asset upserts dropped because the writer queue was full")
+
+def _connect() -> sqlite3.Connection:
+    """Opens a connection in WAL mode so readers never block the writer (and vice versa)."""
+    conn = sqlite3.connect(DB_NAME, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")  # WAL stays consistent; fsync happens at checkpoints
+    return conn
+
+class AlertWriter:
+    """
+    Owns one long-lived connection and writes queued alerts (and asset records)
+    on a background thread, committing them in groups instead of once per row.
+    """
+    def __init__(self, batch_size: int = WRITER_BATCH_SIZE, flush_interval_ms: int = WRITER_FLUSH_INTERVAL_MS,
+                 queue_size: int = WRITER_QUEUE_SIZE):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval_ms / 1000
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._thread = None
+        self._playbook_ids = {}  # Playbook JSON -> playbooks.id, only used on the writer thread
+        self._partitions = set()  # Partition tables known to exist
+        self._next_id = None  # Alert ids are unique across partitions, so the writer assigns them
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="alert-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, alert_data: dict, criticality: str = "Unknown", block: bool = True) -> bool:
+        """
+        Queues an alert. When the queue is full it blocks, to push back on producers,
+        or with block=False returns False instead.
+        """
+        return self._put(("alert", alert_data, criticality), block)
+
+    def submit_prune(self, retention_days: int):
+        """Queues dropping the partitions older than retention_days."""
+        self._put(("prune", retention_days))
+
+    def submit_rolled_up(self, timestamp: str, ip: str, reason: str, criticality: str, count: int, risk_sum: int,
+                         block: bool = True) -> bool:
+        """Queues alerts that were counted but not stored, for the rollups only. Blocks like submit()."""
+        return self._put(("rolled_up", timestamp, ip, reason, criticality, count, risk_sum), block)
+
+    def submit_asset(self, asset_row: tuple) -> bool:
+        """
+        Queues an (ip, owner, purpose, criticality, first_seen, last_seen) asset upsert.
+        Never blocks: returns False (and counts the drop) when the queue is full.
+        """
+        if self._put(("asset", asset_row), block=False):
+            return True
+        DB_WRITER_DROPPED.inc()
+        return False
+
+    def _put(self, item, block: bool = True) -> bool:
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            if not block:
+                return False
+            self._queue.put(item)
+        return True
+
+    def flush(self, timeout: float = None) -> bool:
+        """Blocks until everything queued before this call is committed."""
+        done = threading.Event()
+        self._queue.put(done)
+        return done.wait(timeout)
+
+    def close(self, timeout: float = None):
+        """Flushes pending alerts and stops the writer thread."""
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join(timeout)
+        self._thread = None
+
+    def pending(self) -> int:
+        return self._queue.qsize()
+
+    def _run(self):
+        global _data_version
+        conn = _connect()
+        self._partitions = set(_partitions(conn))
+        self._next_id = _max_alert_id(conn, self._partitions) + 1
+        try:
+            while True:
+                batch, markers, stop = self._collect()
+                prunes = [item[1] for item in batch if item[0] == "prune"]
+                if prunes:
+                    try:
+                        self._prune(conn, min(prunes))
+                        _data_version += 1
+                    except Exception as e:
+                        print(f"Error pruning alert partitions: {e}")
+                if batch:
+                    alerts = [item[1:] for item in batch if item[0] == "alert"]
+                    assets = [item[1] for item in batch if item[0] == "asset"]
+                    rolled_up = [item[1:] for item in batch if item[0] == "rolled_up"]
+                    started = time.perf_counter()
+                    try:
+                        self._write(conn, alerts, assets, rolled_up)
+                        if alerts or rolled_up:
+                            _data_version += 1
+                    except Exception as e:
+                        print(f"Error writing {len(alerts)} alerts and {len(assets)} assets: {e}")
+                        DB_WRITE_ERRORS.inc()
+                    DB_WRITE_SECONDS.observe(time.perf_counter() - started)
+                for marker in markers:
+                    marker.set()
+                if stop:
+                    break
+        finally:
+            conn.close()
+
+    def _collect(self):
+        """Waits for one item, then gathers more until the batch is full or the interval passes."""
+        batch, markers = [], []
+        item = self._queue.get()
+        deadline = time.monotonic() + self.flush_interval
+        while True:
+            if item is None:
+                return batch, markers, True
+            if isinstance(item, threading.Event):
+                # Flush requested: commit what we have right away
+                markers.append(item)
+                return batch, markers, False
+            batch.append(item)
+            remaining = deadline - time.monotonic()
+            if len(batch) >= self.batch_size or remaining <= 0:
+                return batch, markers, False
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                return batch, markers, False
+
+    def _write(self, conn: sqlite3.Connection, alerts: list, assets: list, rolled_up: list = ()):
+        rows = {}  # Partition table -> rows
+        hourly, daily, by_ip = {}, {}, {}
+
+        def count(timestamp, ip, reason, criticality, alert_count, risk_sum):
+            # Pre-aggregate the batch so each rollup row is upserted once per commit
+            for totals, key in ((hourly, (timestamp[:13], reason, criticality)),
+                                (daily, (timestamp[:10], reason)),
+                                (by_ip, (timestamp[:10], ip))):
+                previous_count, previous_risk_sum = totals.get(key, (0, 0))
+                totals[key] = (previous_count + alert_count, previous_risk_sum + risk_sum)
+
+        for alert_data, criticality in alerts:
+            timestamp, ip, reason, risk_score = (alert_data['timestamp'], alert_data['ip'],
+                                                 alert_data['reason'], alert_data['risk_score'])
+            try:
+                table = _partition_table(timestamp)
+            except ValueError:
+                print(f"Skipping alert with malformed timestamp: {timestamp!r}")
+                continue
+            rows.setdefault(table, []).append((
+                self._next_id,
+                timestamp,
+                ip,
+                reason,
+                risk_score,
+                self._playbook_id(conn, json.dumps(alert_data['playbook'])),
+                pack_features(alert_data['features'])
+            ))
+            self._next_id += 1
+            count(timestamp, ip, reason, criticality, 1, risk_score)
+        for timestamp, ip, reason, criticality, alert_count, risk_sum in rolled_up:
+            count(timestamp, ip, reason, criticality, alert_count, risk_sum)
+
+        with conn:  # One transaction (and one commit) for the whole batch
+            for table, table_rows in rows.items():
+                if table not in self._partitions:
+                    _create_alerts_table(conn, table)
+                    self._partitions.add(table)
+                conn.executemany(f'''
+                    INSERT INTO {table} (id, timestamp, ip, reason, risk_score, playbook_id, features)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                ''', table_rows)
+            conn.executemany('''
+                INSERT INTO alert_rollup_hourly (hour, reason, criticality, alert_count, risk_sum)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT(hour, reason, criticality) DO UPDATE SET
+                    alert_count = alert_count + excluded.alert_count,
+                    risk_sum = risk_sum + excluded.risk_sum
+            ''', [key + totals for key, totals in hourly.items()])
+            conn.executemany('''
+                INSERT INTO alert_rollup_daily (day, reason, alert_count, risk_sum)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT(day, reason) DO UPDATE SET
+                    alert_count = alert_count + excluded.alert_count,
+                    risk_sum = risk_sum + excluded.risk_sum
+            ''', [key + totals for key, totals in daily.items()])
+            conn.executemany('''
+                INSERT INTO alert_ip_rollup_daily (day, ip, alert_count, risk_sum)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT(day, ip) DO UPDATE SET
+                    alert_count = alert_count + excluded.alert_count,
+                    risk_sum = risk_sum + excluded.risk_sum
+            ''', [key + totals for key, totals in by_ip.items()])
+            conn.executemany('''
+                INSERT INTO assets (ip, owner, purpose, criticality, first_seen, last_seen)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT(ip) DO UPDATE SET last_seen = MAX(last_seen, excluded.last_seen)
+            ''', assets)
+
+    def _playbook_id(self, conn: sqlite3.Connection, steps: str) -> int:
+        playbook_id = self._playbook_ids.get(steps)
+        if playbook_id is None:
+            playbook_id = _playbook_id(conn, steps)
+            self._playbook_ids[steps] = playbook_id
+        return playbook_id
+
+    def _prune(self, conn: sqlite3.Connection, retention_days: int):
+        """Drops (after archiving, if configured) every partition older than retention_days."""
+        cutoff = (datetime.now() - timedelta(days=retention_days)).strftime("%Y-%m-%d")
+        expired = [table for table in sorted(self._partitions) if _partition_day(table) < cutoff]
+        for table in expired:
+            if ALERT_ARCHIVE_DIR:
+                _archive_partition(conn, table, ALERT_ARCHIVE_DIR)
+            else:
+                rows = conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+                print(f"WARNING: deleting {rows} alerts of {_partition_day(table)} for good "
+                      f"(older than {retention_days} days and ALERT_ARCHIVE_DIR is not set)")
+            with conn:
+                conn.execute(f"DROP TABLE {table}")
+            self._partitions.discard(table)
+        if expired:
+            print(f"Dropped {len(expired)} expired alert partitions ({expired[0]} to {expired[-1]})")
+        # The rollups are small, but should not report alerts that no longer exist
+        with conn:
+            conn.execute("DELETE FROM alert_rollup_hourly WHERE hour < ?", (cutoff,))
+            conn.execute("DELETE FROM alert_rollup_daily WHERE day < ?", (cutoff,))
+            conn.execute("DELETE FROM alert_ip_rollup_daily WHERE day < ?", (cutoff,))
+
+# --- Day partitions ---
+
+def _partition_table(timestamp: str) -> str:
+    """The partition for an ISO timestamp, e.g. '2024-05-01T10:00:00' -> 'alerts_20240501'."""
+    day = datetime.strptime(timestamp[:10], "%Y-%m-%d")
+    return PARTITION_PREFIX + day.strftime("%Y%m%d")
+
+def _partition_day(table: str) -> str:
+    """'alerts_20240501' -> '2024-05-01'"""
+    digits = table[len(PARTITION_PREFIX):]
+    return f"{digits[:4]}-{digits[4:6]}-{digits[6:]}"
+
+def _partitions(conn: sqlite3.Connection, first_day: str = None) -> list:
+    """Existing partition tables in day order, optionally only those from first_day on."""
+    names = [row[0] for row in conn.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table' AND name GLOB 'alerts_[0-9][0-9][0-9][0-9][0-9][0-9][0-9][0-9]'")]
+    if first_day:
+        names = [name for name in names if _partition_day(name) >= first_day]
+    return sorted(names)
+
+def _max_alert_id(conn: sqlite3.Connection, partitions) -> int:
+    return max((conn.execute(f"SELECT MAX(id) FROM {table}").fetchone()[0] or 0 for table in partitions), default=0)
+
+def _archive_partition(conn: sqlite3.Connection, table: str, directory: str):
+    """Writes a partition to <directory>/<table>.npz, one array per column (features as an (n, 77) float32 matrix)."""
+    import numpy as np
+    rows = conn.execute(f'''
+        SELECT a.id, a.timestamp, a.ip, a.reason, a.risk_score, p.steps, a.features
+        FROM {table} a JOIN playbooks p ON p.id = a.playbook_id ORDER BY a.id
+    ''').fetchall()
+    ids, timestamps, ips, reasons, risk_scores, playbooks, features = zip(*rows) if rows else ([],) * 7
+    os.makedirs(directory, exist_ok=True)
+    np.savez_compressed(
+        os.path.join(directory, f"{table}.npz"),
+        id=np.array(ids, dtype=np.int64),
+        timestamp=np.array(timestamps, dtype=str),
+        ip=np.array(ips, dtype=str),
+        reason=np.array(reasons, dtype=str),
+        risk_score=np.array(risk_scores, dtype=np.int32),
+        playbook=np.array(playbooks, dtype=str),
+        features=np.vstack([unpack_features(blob) for blob in features]) if features else np.empty((0, len(FEATURE_NAMES)), np.float32),
+        feature_names=np.array(FEATURE_NAMES),
+    )
+
+def _playbook_id(conn: sqlite3.Connection, steps: str) -> int:
+    """Returns the id of a playbook (its JSON step list), storing it on first use."""
+    conn.execute("INSERT OR IGNORE INTO playbooks (steps) VALUES (?)", (steps,))
+    return conn.execute("SELECT id FROM playbooks WHERE steps = ?", (steps,)).fetchone()[0]
+
+class ReadPool:
+    """A small pool of read-only connections shared by the query functions."""
+    def __init__(self, size: int = READ_POOL_SIZE):
+        self._idle = queue.Queue()
+        self._slots = threading.BoundedSemaphore(size)
+
+    @contextmanager
+    def connection(self):
+        self._slots.acquire()
+        try:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                conn = _connect()
+                conn.row_factory = sqlite3.Row
+            try:
+                yield conn
+            finally:
+                self._idle.put(conn)
+        finally:
+            self._slots.release()
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+# Bumped after every alert commit; lets caches tell whether stored alerts changed
+_data_version = 0
+
+def data_version() -> int:
+    """Number of alert batches committed since startup."""
+    return _data_version
+
+_writer: AlertWriter = None
+_read_pool: ReadPool = None
+_lock = threading.Lock()
+
+def _get_writer() -> AlertWriter:
+    global _writer
+    with _lock:
+        if _writer is None:
+            _writer = AlertWriter()
+            _writer.start()
+        return _writer
+
+def _get_read_pool() -> ReadPool:
+    global _read_pool
+    with _lock:
+        if _read_pool is None:
+            _read_pool = ReadPool()
+        return _read_pool
+
+def flush(timeout: float = None):
+    """Waits until all queued alerts are committed."""
+    if _writer is not None:
+        _writer.flush(timeout)
+
+def close():
+    """Flushes queued alerts and closes all pooled connections. Call on shutdown."""
+    global _writer, _read_pool
+    with _lock:
+        if _writer is not None:
+            _writer.close()
+            _writer = None
+        if _read_pool is not None:
+            _read_pool.close()
+            _read_pool = None
+
 def init_db():
-    """Initializes the database and creates the alerts table if it doesn't exist."""
-    with sqlite3.connect(DB_NAME) as conn:
+    """Initializes the database, creates the tables if they don't exist and starts the alert writer."""
+    with closing(_connect()) as conn:
         cursor = conn.cursor()
+        # Each distinct playbook (JSON list of steps) is stored once and referenced by alerts
         cursor.execute('''
-            CREATE TABLE IF NOT EXISTS alerts (
+            CREATE TABLE IF NOT EXISTS playbooks (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
-                timestamp TEXT NOT NULL,
-                ip TEXT NOT NULL,
-                reason TEXT NOT NULL,
-                risk_score INTEGER NOT NULL,
-                playbook TEXT NOT NULL,
-                features TEXT NOT NULL
+                steps TEXT NOT NULL UNIQUE
             )
         ''')
+        migrated = _migrate(conn)
         # --- UPDATED: User Reported IPs Table ---
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS reported_ips (
@@ -30,24 +416,200 @@ def init_db():
                 categories TEXT 
             )
         ''')
-        conn.commit()
-
-def add_alert(alert_data: dict):
-    """Adds a new alert to the database."""
-    with sqlite3.connect(DB_NAME) as conn:
-        cursor = conn.cursor()
+        # --- Rollups maintained by the alert writer, so KPIs never scan the alerts table ---
+        # Hour buckets are 'YYYY-MM-DDTHH' and day buckets 'YYYY-MM-DD' (prefixes of the ISO timestamp).
         cursor.execute('''
-            INSERT INTO alerts (timestamp, ip, reason, risk_score, playbook, features)
-            VALUES (?, ?, ?, ?, ?, ?)
-        ''', (
-            alert_data['timestamp'],
-            alert_data['ip'],
-            alert_data['reason'],
-            alert_data['risk_score'],
-            json.dumps(alert_data['playbook']),
-            json.dumps(alert_data['features'])
-        ))
+            CREATE TABLE IF NOT EXISTS alert_rollup_hourly (
+                hour TEXT NOT NULL,
+                reason TEXT NOT NULL,
+                criticality TEXT NOT NULL,
+                alert_count INTEGER NOT NULL,
+                risk_sum INTEGER NOT NULL,
+                PRIMARY KEY (hour, reason, criticality)
+            )
+        ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS alert_rollup_daily (
+                day TEXT NOT NULL,
+                reason TEXT NOT NULL,
+                alert_count INTEGER NOT NULL,
+                risk_sum INTEGER NOT NULL,
+                PRIMARY KEY (day, reason)
+            )
+        ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS alert_ip_rollup_daily (
+                day TEXT NOT NULL,
+                ip TEXT NOT NULL,
+                alert_count INTEGER NOT NULL,
+                risk_sum INTEGER NOT NULL,
+                PRIMARY KEY (day, ip)
+            )
+        ''')
+        # --- Auto-discovered hosts, persisted by the asset store ---
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS assets (
+                ip TEXT PRIMARY KEY,
+                owner TEXT NOT NULL,
+                purpose TEXT NOT NULL,
+                criticality TEXT NOT NULL,
+                first_seen TEXT NOT NULL,
+                last_seen TEXT NOT NULL
+            )
+        ''')
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_assets_last_seen ON assets (last_seen)")
+        _backfill_rollups(cursor)
         conn.commit()
+    _get_writer()
+    if migrated:
+        # Migrated alerts may be older than the retention period; let the operator see them first
+        print("Alerts were migrated on this start; not pruning expired partitions until the next one.")
+    else:
+        prune_alerts()
+
+def _create_alerts_table(cursor, name: str):
+    # features: float32 BLOB in FEATURE_NAMES order (see features.pack_features).
+    # Ids are assigned by the writer, unique across all partitions.
+    cursor.execute(f'''
+        CREATE TABLE IF NOT EXISTS {name} (
+            id INTEGER PRIMARY KEY,
+            timestamp TEXT NOT NULL,
+            ip TEXT NOT NULL,
+            reason TEXT NOT NULL,
+            risk_score INTEGER NOT NULL,
+            playbook_id INTEGER NOT NULL REFERENCES playbooks (id),
+            features BLOB NOT NULL
+        )
+    ''')
+    # Newest-first keyset pages on (timestamp, id); covers every column but the features
+    cursor.execute(f'''
+        CREATE INDEX IF NOT EXISTS idx_{name}_keyset
+        ON {name} (timestamp, id, ip, reason, risk_score, playbook_id)
+    ''')
+    cursor.execute(f"CREATE INDEX IF NOT EXISTS idx_{name}_ip ON {name} (ip, timestamp, id)")
+
+def _migrate(conn: sqlite3.Connection) -> bool:
+    """Brings a database created by an older version up to SCHEMA_VERSION. Returns True if alerts were moved."""
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    if version >= SCHEMA_VERSION:
+        return False
+    # A single alerts table means a database from before day partitions
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(alerts)")]
+    if columns:
+        if "playbook" in columns:
+            _migrate_compact_alerts(conn)
+        _migrate_partition_alerts(conn)
+        conn.execute("VACUUM")  # Give the space back to the file system
+    for table in _partitions(conn):
+        # Partitions created before the keyset indexes existed
+        _create_alerts_table(conn.cursor(), table)
+        conn.execute(f"DROP INDEX IF EXISTS idx_{table}_timestamp")
+    conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+    conn.commit()
+    return bool(columns)
+
+def _migrate_compact_alerts(conn: sqlite3.Connection, chunk_size: int = 10000):
+    """Rewrites alerts with JSON features and inline playbooks into the compact layout, keeping ids."""
+    total = conn.execute("SELECT COUNT(*) FROM alerts").fetchone()[0]
+    print(f"Migrating {total} alerts to compact feature storage...")
+    cursor = conn.cursor()
+    cursor.execute("DROP TABLE IF EXISTS alerts_compact")
+    _create_alerts_table(cursor, "alerts_compact")
+    playbook_ids = {}
+    last_id = -1
+    while True:
+        rows = conn.execute('''
+            SELECT id, timestamp, ip, reason, risk_score, playbook, features FROM alerts
+            WHERE id > ? ORDER BY id LIMIT ?
+        ''', (last_id, chunk_size)).fetchall()
+        if not rows:
+            break
+        compact = []
+        for alert_id, timestamp, ip, reason, risk_score, playbook, features in rows:
+            if playbook not in playbook_ids:
+                playbook_ids[playbook] = _playbook_id(conn, playbook)
+            compact.append((alert_id, timestamp, ip, reason, risk_score, playbook_ids[playbook],
+                            pack_features(json.loads(features))))
+        conn.executemany('''
+            INSERT INTO alerts_compact (id, timestamp, ip, reason, risk_score, playbook_id, features)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', compact)
+        last_id = rows[-1][0]
+    cursor.execute("DROP TABLE alerts")
+    cursor.execute("ALTER TABLE alerts_compact RENAME TO alerts")
+    conn.commit()
+    print("Alert migration complete.")
+
+def _migrate_partition_alerts(conn: sqlite3.Connection):
+    """Moves the single alerts table into day partitions, keeping ids."""
+    days = [row[0] for row in conn.execute("SELECT DISTINCT substr(timestamp, 1, 10) FROM alerts ORDER BY 1")]
+    print(f"Splitting alerts into {len(days)} day partitions...")
+    cursor = conn.cursor()
+    for day in days:
+        table = _partition_table(day)
+        _create_alerts_table(cursor, table)
+        cursor.execute(f'''
+            INSERT INTO {table} (id, timestamp, ip, reason, risk_score, playbook_id, features)
+            SELECT id, timestamp, ip, reason, risk_score, playbook_id, features FROM alerts
+            WHERE timestamp >= ? AND timestamp < ?
+        ''', (day, day + "~"))  # Every timestamp of the day sorts between these (idx_alerts_timestamp, if the old table has it)
+    cursor.execute("DROP TABLE alerts")
+    conn.commit()
+
+def _backfill_rollups(cursor: sqlite3.Cursor):
+    """Builds the rollups from existing alerts the first time a database is opened with them."""
+    if cursor.execute("SELECT 1 FROM alert_rollup_hourly LIMIT 1").fetchone():
+        return
+    partitions = _partitions(cursor.connection)
+    if not partitions:
+        return
+    print("Building alert rollups from existing alerts...")
+    # Each partition holds a single day, so the rollup keys never overlap between partitions.
+    # Asset criticality was not recorded with older alerts.
+    for table in partitions:
+        cursor.execute(f'''
+            INSERT INTO alert_rollup_hourly (hour, reason, criticality, alert_count, risk_sum)
+            SELECT substr(timestamp, 1, 13), reason, 'Unknown', COUNT(*), SUM(risk_score)
+            FROM {table} GROUP BY 1, 2
+        ''')
+        cursor.execute(f'''
+            INSERT INTO alert_rollup_daily (day, reason, alert_count, risk_sum)
+            SELECT substr(timestamp, 1, 10), reason, COUNT(*), SUM(risk_score)
+            FROM {table} GROUP BY 1, 2
+        ''')
+        cursor.execute(f'''
+            INSERT INTO alert_ip_rollup_daily (day, ip, alert_count, risk_sum)
+            SELECT substr(timestamp, 1, 10), ip, COUNT(*), SUM(risk_score)
+            FROM {table} GROUP BY 1, 2
+        ''')
+
+def add_alert(alert_data: dict, criticality: str = "Unknown", block: bool = True) -> bool:
+    """
+    Queues a new alert for the background writer; it is committed within WRITER_FLUSH_INTERVAL_MS.
+    criticality is the asset criticality of the alert's IP at detection time, kept in the KPI rollups.
+    While the writer queue is full this waits for room, or with block=False returns False
+    (on the event loop, retry with block=True on a thread).
+    """
+    return _get_writer().submit(alert_data, criticality, block)
+
+def add_rolled_up_alerts(alert_data: dict, count: int, risk_sum: int, criticality: str = "Unknown",
+                         block: bool = True) -> bool:
+    """
+    Counts alerts that alert aggregation folded into a window (see alert_aggregator.py)
+    in the KPI rollups, under the hour of alert_data's timestamp. They get no alert rows.
+    block works as for add_alert().
+    """
+    return _get_writer().submit_rolled_up(alert_data['timestamp'], alert_data['ip'], alert_data['reason'],
+                                          criticality, count, risk_sum, block)
+
+def prune_alerts(retention_days: int = None):
+    """
+    Queues dropping the day partitions older than the retention period (ALERT_RETENTION_DAYS by default).
+    Does nothing while the retention period is 0, i.e. not configured.
+    """
+    retention_days = ALERT_RETENTION_DAYS if retention_days is None else retention_days
+    if retention_days > 0:
+        _get_writer().submit_prune(retention_days)
 
 # --- NEW: Function to handle user-reported IPs ---
 def report_suspicious_ip(ip: str, categories: list[str]):
@@ -68,8 +630,7 @@ def report_suspicious_ip(ip: str, categories: list[str]):
 # --- NEW: Function to get all reported IPs for the SOC team ---
 def get_reported_ips(limit: int = 10) -> list:
     """Fetches user-reported IPs, limited to the most recent entries."""
-    with sqlite3.connect(DB_NAME) as conn:
-        conn.row_factory = sqlite3.Row
+    with _get_read_pool().connection() as conn:
         cursor = conn.cursor()
         cursor.execute("SELECT * FROM reported_ips ORDER BY last_reported_at DESC LIMIT ?", (limit,))
         rows = cursor.fetchall()
@@ -85,15 +646,212 @@ def get_reported_ips(limit: int = 10) -> list:
             results.append(row_dict)
         return results
     
-def get_alerts_in_range(days: int) -> list:
+# Alert rows from one partition with the playbook resolved; features stay a BLOB until decoded
+ALERT_SELECT = '''
+    SELECT a.id, a.timestamp, a.ip, a.reason, a.risk_score, p.steps AS playbook, a.features
+    FROM {table} a JOIN playbooks p ON p.id = a.playbook_id
+'''
+
+def _alert_from_row(row: sqlite3.Row, raw_features: bool = False) -> dict:
+    """
+    Same shape as the original JSON columns: playbook and features as JSON text.
+    With raw_features, features is instead a zero-copy float32 array in FEATURE_NAMES order.
+    """
+    alert = dict(row)
+    features = unpack_features(alert['features'])
+    alert['features'] = features if raw_features else json.dumps(dict(zip(FEATURE_NAMES, features.tolist())))
+    return alert
+
+def get_alerts_in_range(days: int, raw_features: bool = False) -> list:
     """Fetches alerts from the database within a given number of past days."""
     start_date = datetime.now() - timedelta(days=days)
     start_date_iso = start_date.isoformat()
     
-    with sqlite3.connect(DB_NAME) as conn:
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        cursor.execute("SELECT * FROM alerts WHERE timestamp >= ?", (start_date_iso,))
-        rows = cursor.fetchall()
+    with _get_read_pool().connection() as conn:
+        # Only the partitions from the window's first day on are read
+        rows = []
+        for table in _partitions(conn, first_day=start_date_iso[:10]):
+            rows.extend(conn.execute(ALERT_SELECT.format(table=table) + " WHERE a.timestamp >= ?",
+                                     (start_date_iso,)).fetchall())
         # Convert rows to dictionaries
-        return [dict(row) for row in rows]
\ No newline at end of file
+        return [_alert_from_row(row, raw_features) for row in rows]
+
+# --- Alert history: keyset pagination over the partitions ---
+
+ALERT_FIELDS = ("id", "timestamp", "ip", "reason", "risk_score", "playbook", "features")
+DEFAULT_ALERT_FIELDS = ("id", "timestamp", "ip", "reason", "risk_score", "playbook")
+_ALERT_COLUMNS = {"ip": "ip", "reason": "reason", "risk_score": "risk_score",
+                  "playbook": "playbook_id", "features": "features"}
+
+_playbook_steps = {}  # playbooks.id -> parsed step list; playbooks are never changed once stored
+
+def _playbook(conn: sqlite3.Connection, playbook_id: int) -> list:
+    steps = _playbook_steps.get(playbook_id)
+    if steps is None:
+        row = conn.execute("SELECT steps FROM playbooks WHERE id = ?", (playbook_id,)).fetchone()
+        steps = _playbook_steps[playbook_id] = json.loads(row[0]) if row else []
+    return steps
+
+def query_alerts(limit: int = 100, cursor: tuple = None, ip: str = None, reason: str = None,
+                 min_risk: int = None, start: str = None, end: str = None,
+                 fields=DEFAULT_ALERT_FIELDS) -> tuple:
+    """
+    One page of alerts, newest first, ordered by (timestamp, id).
+    cursor is the (timestamp, id) of the last alert of the previous page.
+    start/end bound the ISO timestamp (inclusive/exclusive), reason matches a substring,
+    and fields picks the returned keys ("features" is only read when asked for).
+    Returns (alerts, next cursor or None).
+    """
+    unknown = set(fields) - set(ALERT_FIELDS)
+    if unknown:
+        raise ValueError(f"Unknown alert fields: {', '.join(sorted(unknown))}")
+    extra = [field for field in fields if field in _ALERT_COLUMNS]
+    select = ", ".join(["id", "timestamp"] + [_ALERT_COLUMNS[field] for field in extra])
+
+    conditions, params = [], []
+    if cursor:
+        conditions.append("(timestamp, id) < (?, ?)")
+        params.extend(cursor)
+    if start:
+        conditions.append("timestamp >= ?")
+        params.append(start)
+    if end:
+        conditions.append("timestamp < ?")
+        params.append(end)
+    if ip:
+        conditions.append("ip = ?")
+        params.append(ip)
+    if reason:
+        conditions.append("instr(reason, ?) > 0")
+        params.append(reason)
+    if min_risk is not None:
+        conditions.append("risk_score >= ?")
+        params.append(min_risk)
+    where = " WHERE " + " AND ".join(conditions) if conditions else ""
+
+    # Newest partition first; skip the days outside [start, end] and after the cursor
+    last_day = min(day for day in (end and end[:10], cursor and cursor[0][:10], "9999-99-99") if day)
+    alerts = []
+    with _get_read_pool().connection() as conn:
+        for table in reversed(_partitions(conn, first_day=start[:10] if start else None)):
+            if _partition_day(table) > last_day:
+                continue
+            # Walks idx_{table}_keyset, the covering (timestamp, id, ip, reason, risk_score, playbook_id)
+            # index, backwards: no table lookups unless features are asked for. With ip set, idx_{table}_ip.
+            rows = conn.execute(f"SELECT {select} FROM {table}{where} ORDER BY timestamp DESC, id DESC LIMIT ?",
+                                params + [limit - len(alerts)]).fetchall()
+            for row in rows:
+                alert = {"id": row[0], "timestamp": row[1]}
+                for field, value in zip(extra, row[2:]):
+                    if field == "playbook":
+                        value = _playbook(conn, value)
+                    elif field == "features":
+                        value = dict(zip(FEATURE_NAMES, unpack_features(value).tolist()))
+                    alert[field] = value
+                alerts.append(alert)
+            if len(alerts) >= limit:
+                break
+
+    next_cursor = (alerts[-1]["timestamp"], alerts[-1]["id"]) if len(alerts) >= limit else None
+    for alert in alerts:
+        if "id" not in fields:
+            del alert["id"]
+        if "timestamp" not in fields:
+            del alert["timestamp"]
+    return alerts, next_cursor
+
+def iter_alerts(chunk_size: int = 1000, **filters):
+    """Yields every matching alert, newest first, reading chunk_size rows per query."""
+    cursor = filters.pop("cursor", None)
+    while True:
+        alerts, cursor = query_alerts(limit=chunk_size, cursor=cursor, **filters)
+        yield from alerts
+        if cursor is None:
+            return
+
+# --- KPI aggregates, answered from the rollup tables ---
+
+def _range_start(days: int) -> datetime:
+    return datetime.now() - timedelta(days=days)
+
+def _range_start_hour(days: int) -> str:
+    """First hour bucket of the past number of days: days * 24 buckets, the current hour included."""
+    return (_range_start(days) + timedelta(hours=1)).isoformat()[:13]
+
+def get_alert_summary(days: int) -> dict:
+    """Totals for the past number of days: alert count, risk score sum, and counts by reason and criticality."""
+    start_hour = _range_start_hour(days)
+    with _get_read_pool().connection() as conn:
+        rows = conn.execute('''
+            SELECT reason, criticality, SUM(alert_count), SUM(risk_sum)
+            FROM alert_rollup_hourly WHERE hour >= ?
+            GROUP BY reason, criticality
+        ''', (start_hour,)).fetchall()
+    summary = {"total_alerts": 0, "risk_sum": 0, "by_reason": {}, "by_criticality": {}}
+    for reason, criticality, count, risk_sum in rows:
+        summary["total_alerts"] += count
+        summary["risk_sum"] += risk_sum
+        summary["by_reason"][reason] = summary["by_reason"].get(reason, 0) + count
+        summary["by_criticality"][criticality] = summary["by_criticality"].get(criticality, 0) + count
+    return summary
+
+def get_alert_timeline(days: int, bucket: str = "day") -> dict:
+    """Alert counts per hour ('YYYY-MM-DDTHH') or per day ('YYYY-MM-DD') over the past number of days."""
+    if bucket == "hour":
+        query = "SELECT hour, SUM(alert_count) FROM alert_rollup_hourly WHERE hour >= ? GROUP BY hour"
+        start = _range_start_hour(days)
+    else:
+        query = "SELECT day, SUM(alert_count) FROM alert_rollup_daily WHERE day >= ? GROUP BY day"
+        start = _range_start(days).isoformat()[:10]
+    with _get_read_pool().connection() as conn:
+        return dict(conn.execute(query, (start,)).fetchall())
+
+def get_alert_counts_by_ip(days: int, limit: int = 10) -> list:
+    """The IPs with the most alerts over the past number of days."""
+    start_day = _range_start(days).isoformat()[:10]
+    with _get_read_pool().connection() as conn:
+        rows = conn.execute('''
+            SELECT ip, SUM(alert_count) AS alerts, SUM(risk_sum) AS risk_sum
+            FROM alert_ip_rollup_daily WHERE day >= ?
+            GROUP BY ip ORDER BY alerts DESC LIMIT ?
+        ''', (start_day, limit)).fetchall()
+    return [dict(row) for row in rows]
+
+# --- Asset inventory persistence ---
+
+def save_asset(ip: str, record: dict, first_seen: str, last_seen: str) -> bool:
+    """
+    Queues an upsert of an auto-discovered host; last_seen only moves forward.
+    Returns False if it was dropped because the writer is behind (db_writer_dropped_total).
+    """
+    return _get_writer().submit_asset((ip, record['owner'], record['purpose'], record['criticality'], first_seen, last_seen))
+
+def get_asset(ip: str):
+    """The persisted host with this exact IP, or None."""
+    with _get_read_pool().connection() as conn:
+        row = conn.execute("SELECT * FROM assets WHERE ip = ?", (ip,)).fetchone()
+    return dict(row) if row else None
+
+def get_assets_by_ip(ips: list) -> dict:
+    """The persisted hosts among ips, as ip -> row. One query per 500 IPs."""
+    found = {}
+    with _get_read_pool().connection() as conn:
+        for start in range(0, len(ips), 500):
+            chunk = ips[start:start + 500]
+            rows = conn.execute(
+                f"SELECT * FROM assets WHERE ip IN ({','.join('?' * len(chunk))})", chunk
+            ).fetchall()
+            found.update((row['ip'], dict(row)) for row in rows)
+    return found
+
+def count_assets() -> int:
+    with _get_read_pool().connection() as conn:
+        return conn.execute("SELECT COUNT(*) FROM assets").fetchone()[0]
+
+def get_assets(offset: int = 0, limit: int = 100) -> list:
+    """Persisted hosts, most recently seen first."""
+    with _get_read_pool().connection() as conn:
+        rows = conn.execute(
+            "SELECT * FROM assets ORDER BY last_seen DESC, ip LIMIT ? OFFSET ?", (limit, offset)
+        ).fetchall()
+    return [dict(row) for row in rows]
@@ -0,0 +1,49 @@
+"""
+Exports the Dense weights of the Keras autoencoder to a compact .npz file.
+
+This is the only step that needs TensorFlow (see requirements-export.txt);
+the backend itself runs the exported weights with NumpyAutoencoder.
+
+    python export_autoencoder.py
+    python export_autoencoder.py --model autoencoder_anomaly_model.h5 --output autoencoder_anomaly_model.npz
+"""
+import argparse
+import os
+
+import numpy as np
+
+from numpy_autoencoder import NumpyAutoencoder
+
+def export(model_path: str, output_path: str, check_rows: int = 1000, tolerance: float = 1e-6):
+    from tensorflow.keras.models import load_model
+
+    model = load_model(model_path, compile=False)
+    layers = []
+    for layer in model.layers:
+        weights = layer.get_weights()
+        if not weights:
+            continue  # Input layers carry no weights
+        if layer.__class__.__name__ != "Dense":
+            raise ValueError(f"Only Dense layers can be exported, found {layer.__class__.__name__}")
+        kernel, bias = weights
+        layers.append((kernel.astype(np.float32), bias.astype(np.float32), layer.get_config()["activation"]))
+
+    engine = NumpyAutoencoder(layers)
+    engine.save(output_path)
+
+    # Compare reconstruction MSE against Keras on random scaled inputs
+    X = np.random.default_rng(0).random((check_rows, model.input_shape[-1]))
+    keras_mse = np.mean(np.power(X - model.predict(X, verbose=0), 2), axis=1)
+    numpy_mse = np.mean(np.power(X - engine.predict(X), 2), axis=1)
+    max_diff = float(np.max(np.abs(keras_mse - numpy_mse)))
+    print(f"Exported {len(layers)} Dense layers to {output_path} (max MSE difference {max_diff:.2e})")
+    if max_diff > tolerance:
+        raise SystemExit(f"Exported model differs from Keras by more than {tolerance}")
+
+if __name__ == "__main__":
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--model", default=os.path.join(base_dir, "autoencoder_anomaly_model.h5"))
+    parser.add_argument("--output", default=os.path.join(base_dir, "autoencoder_anomaly_model.npz"))
+    args = parser.parse_args()
+    export(args.model, args.output)
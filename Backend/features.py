@@ -0,0 +1,70 @@
+import numpy as np
+
+# List of 77 feature names that match the scaler's expectations
+FEATURE_NAMES = [
+    'Protocol', 'Flow Duration', 'Total Fwd Packets', 'Total Backward Packets',
+    'Fwd Packets Length Total', 'Bwd Packets Length Total', 'Fwd Packet Length Max',
+    'Fwd Packet Length Min', 'Fwd Packet Length Mean', 'Fwd Packet Length Std',
+    'Bwd Packet Length Max', 'Bwd Packet Length Min', 'Bwd Packet Length Mean',
+    'Bwd Packet Length Std', 'Flow Bytes/s', 'Flow Packets/s', 'Flow IAT Mean',
+    'Flow IAT Std', 'Flow IAT Max', 'Flow IAT Min', 'Fwd IAT Total', 'Fwd IAT Mean',
+    'Fwd IAT Std', 'Fwd IAT Max', 'Fwd IAT Min', 'Bwd IAT Total', 'Bwd IAT Mean',
+    'Bwd IAT Std', 'Bwd IAT Max', 'Bwd IAT Min', 'Fwd PSH Flags', 'Bwd PSH Flags',
+    'Fwd URG Flags', 'Bwd URG Flags', 'Fwd Header Length', 'Bwd Header Length',
+    'Fwd Packets/s', 'Bwd Packets/s', 'Packet Length Min', 'Packet Length Max',
+    'Packet Length Mean', 'Packet Length Std', 'Packet Length Variance',
+    'FIN Flag Count', 'SYN Flag Count', 'RST Flag Count', 'PSH Flag Count',
+    'ACK Flag Count', 'URG Flag Count', 'CWE Flag Count', 'ECE Flag Count',
+    'Down/Up Ratio', 'Avg Packet Size', 'Avg Fwd Segment Size',
+    'Avg Bwd Segment Size', 'Fwd Avg Bytes/Bulk',
+    'Fwd Avg Packets/Bulk', 'Fwd Avg Bulk Rate', 'Bwd Avg Bytes/Bulk',
+    'Bwd Avg Packets/Bulk', 'Bwd Avg Bulk Rate', 'Subflow Fwd Packets',
+    'Subflow Fwd Bytes', 'Subflow Bwd Packets', 'Subflow Bwd Bytes',
+    'Init Fwd Win Bytes', 'Init Bwd Win Bytes', 'Fwd Act Data Packets',
+    'Fwd Seg Size Min', 'Active Mean', 'Active Std', 'Active Max',
+    'Active Min', 'Idle Mean', 'Idle Std', 'Idle Max', 'Idle Min'
+]
+
+# --- Fixed-layout feature vectors ---
+# A flow's features travel from the generator to the model to the serializer as
+# a 1D float64 array (or a 2D array for a batch) with columns in FEATURE_NAMES
+# order, so no per-flow DataFrame is needed.
+FEATURE_DTYPE = np.float64
+N_FEATURES = len(FEATURE_NAMES)
+FEATURE_INDEX = {name: column for column, name in enumerate(FEATURE_NAMES)}
+
+def vector_from_dict(feature_dict: dict) -> np.ndarray:
+    """Builds a feature vector from a name -> value mapping. Missing features are 0."""
+    return np.array([feature_dict.get(name, 0) for name in FEATURE_NAMES], dtype=FEATURE_DTYPE)
+
+def vector_to_dict(vector: np.ndarray) -> dict:
+    """Serializes a feature vector back into a name -> value mapping."""
+    return dict(zip(FEATURE_NAMES, vector.tolist()))
+
+def as_feature_matrix(features) -> np.ndarray:
+    """
+    Returns features as a 2D (n, 77) array in FEATURE_NAMES order.
+    Accepts a single vector, a 2D array or a DataFrame with the named columns.
+    """
+    if hasattr(features, "columns"):
+        features = features[FEATURE_NAMES].to_numpy(dtype=FEATURE_DTYPE)
+    matrix = np.asarray(features, dtype=FEATURE_DTYPE)
+    if matrix.ndim == 1:
+        matrix = matrix.reshape(1, -1)
+    if matrix.ndim != 2 or matrix.shape[1] != N_FEATURES:
+        raise ValueError(f"Expected {N_FEATURES} features, got shape {matrix.shape}")
+    return matrix
+
+# --- Stored feature vectors ---
+# Alerts keep their features as a packed little-endian float32 BLOB in FEATURE_NAMES order.
+STORED_FEATURE_DTYPE = np.dtype('<f4')
+
+def pack_features(features) -> bytes:
+    """Packs a feature vector, or a name -> value mapping, into the stored BLOB format."""
+    if isinstance(features, dict):
+        features = [features.get(name, 0) for name in FEATURE_NAMES]
+    return np.asarray(features, dtype=STORED_FEATURE_DTYPE).tobytes()
+
+def unpack_features(blob: bytes) -> np.ndarray:
+    """Returns a read-only float32 view over a stored BLOB, without copying it."""
+    return np.frombuffer(blob, dtype=STORED_FEATURE_DTYPE)
@@ -0,0 +1,102 @@
+import threading
+from collections import OrderedDict
+
+import geoip2.database
+import geoip2.errors
+import maxminddb
+
+# Cache marker for "not cached yet"; None is a cached negative result
+_MISSING = object()
+
+class GeoEnricher:
+    """
+    GeoIP lookups behind a bounded LRU cache.
+    Results are cached as compact (latitude, longitude, city, country) tuples and
+    misses (AddressNotFoundError, invalid addresses) are cached as None, so repeat
+    sources never walk the MaxMind tree twice. With prefix24=True IPv4 addresses are
+    cached per /24 network, trading some precision for a much higher hit rate.
+    """
+    def __init__(self, db_path: str = 'GeoLite2-City.mmdb', cache_size: int = 65536, prefix24: bool = False):
+        self.cache_size = cache_size
+        self.prefix24 = prefix24
+        self.hits = 0
+        self.misses = 0
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        try:
+            # Memory-mapped: pages are shared between processes and loaded on demand
+            self.reader = geoip2.database.Reader(db_path, mode=maxminddb.MODE_MMAP)
+        except FileNotFoundError:
+            print(f"{db_path} not found. Map functionality will be limited.")
+            self.reader = None
+
+    @property
+    def available(self) -> bool:
+        return self.reader is not None
+
+    def _cache_key(self, ip: str) -> str:
+        if self.prefix24 and ip.count('.') == 3:
+            return ip.rsplit('.', 1)[0]
+        return ip
+
+    def _lookup_uncached(self, ip: str):
+        try:
+            response = self.reader.city(ip)
+        except (geoip2.errors.AddressNotFoundError, ValueError):
+            # IP not found in the database (e.g., private IP) or not an IP at all
+            return None
+        return (response.location.latitude, response.location.longitude,
+                response.city.name, response.country.name)
+
+    def _get(self, ip: str):
+        key = self._cache_key(ip)
+        with self._lock:
+            entry = self._cache.get(key, _MISSING)
+            if entry is not _MISSING:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return entry
+            self.misses += 1
+        entry = self._lookup_uncached(ip)
+        with self._lock:
+            self._cache[key] = entry
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return entry
+
+    @staticmethod
+    def _as_location(entry):
+        if entry is None:
+            return None
+        latitude, longitude, city, country = entry
+        return {'latitude': latitude, 'longitude': longitude, 'city': city, 'country': country}
+
+    def lookup(self, ip: str):
+        """Returns the location dict for an IP, or None if unknown or no database is loaded."""
+        if self.reader is None:
+            return None
+        return self._as_location(self._get(ip))
+
+    def lookup_many(self, ips) -> list:
+        """Looks up a batch of IPs, resolving each distinct cache key only once."""
+        if self.reader is None:
+            return [None] * len(ips)
+        resolved = {}
+        locations = []
+        for ip in ips:
+            key = self._cache_key(ip)
+            if key not in resolved:
+                resolved[key] = self._as_location(self._get(ip))
+            locations.append(resolved[key])
+        return locations
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "available": self.available,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "cached_entries": len(self._cache),
+            "cache_size": self.cache_size,
+        }
@@ -0,0 +1,138 @@
+"""
+Decoding of flows pushed in by collectors, for POST /api/ingest and /ws/ingest.
+
+Two layouts are accepted, each turned into (log_dict, feature_vector) pairs like
+generate_log() returns:
+- NDJSON (application/x-ndjson): one flow per line, e.g.
+      {"ip": "10.0.0.5", "timestamp": "2024-05-01T10:00:00", "features": {"Protocol": 6, ...}}
+  "features" is a name -> value object or a list in FEATURE_NAMES order. Without a
+  "features" key, the FEATURE_NAMES keys of the line itself are the features.
+- Columnar (application/json, or application/msgpack when msgpack is installed),
+  the same layout as the batched stream frames:
+      {"columns": {"ip": [...], "timestamp": [...], ...}, "features": [[...], ...]}
+  "features" holds one list per flow in FEATURE_NAMES order (or in "feature_names"
+  order, if given).
+
+Every flow needs an "ip" and all 77 features, which must be finite. "timestamp" is
+optional (ISO 8601, defaults to now) and is normalized to local time, like the
+generator's. Any other fields are kept as metadata. A batch with a bad flow is
+rejected as a whole with a ValueError naming the flow.
+"""
+import ipaddress
+import json
+from datetime import datetime
+
+import numpy as np
+
+from features import FEATURE_DTYPE, FEATURE_NAMES, N_FEATURES
+
+try:
+    import msgpack
+except ImportError:  # Optional dependency; only needed for application/msgpack bodies
+    msgpack = None
+
+NDJSON_TYPES = ("application/x-ndjson", "application/jsonl", "application/ndjson")
+JSON_TYPE = "application/json"
+MSGPACK_TYPE = "application/msgpack"
+
+def decode(body, content_type: str) -> list:
+    """Decodes a request body or WebSocket frame into (log_dict, feature_vector) pairs."""
+    media_type = (content_type or JSON_TYPE).split(";")[0].strip().lower()
+    if media_type in NDJSON_TYPES:
+        return parse_ndjson(body)
+    if media_type == MSGPACK_TYPE:
+        if msgpack is None:
+            raise ValueError("msgpack bodies need the msgpack package on the server")
+        return parse_columnar(msgpack.unpackb(body, raw=False))
+    if media_type == JSON_TYPE:
+        return parse_columnar(json.loads(body))
+    raise ValueError(f"Unsupported content type: {media_type}")
+
+def parse_ndjson(body) -> list:
+    if isinstance(body, bytes):
+        body = body.decode()
+    metadata, rows = [], []
+    for line_number, line in enumerate(body.splitlines(), start=1):
+        if not line.strip():
+            continue
+        try:
+            flow = json.loads(line)
+            if not isinstance(flow, dict):
+                raise ValueError("expected a JSON object")
+            features = flow.pop("features", None)
+            if features is None:
+                features = {name: flow.pop(name) for name in FEATURE_NAMES if name in flow}
+            rows.append(_feature_row(features))
+            metadata.append(flow)
+        except (KeyError, TypeError, ValueError) as e:
+            raise ValueError(f"Line {line_number}: {_describe(e)}")
+    try:
+        matrix = np.array(rows, dtype=FEATURE_DTYPE).reshape(len(rows), N_FEATURES)
+    except (TypeError, ValueError) as e:
+        raise ValueError(f"features: {e}")
+    return _flows(metadata, matrix)
+
+def parse_columnar(frame) -> list:
+    if not isinstance(frame, dict) or "features" not in frame:
+        raise ValueError('Expected an object with "columns" and "features"')
+    try:
+        matrix = np.array(frame["features"], dtype=FEATURE_DTYPE)
+    except (TypeError, ValueError) as e:
+        raise ValueError(f"features: {e}")
+    count = len(matrix)
+    names = frame.get("feature_names")
+    if count and (matrix.ndim != 2 or matrix.shape[1] != (len(names) if names else N_FEATURES)):
+        raise ValueError(f"features: expected {count} rows of {N_FEATURES} values, got shape {matrix.shape}")
+    if names and count:
+        missing = [name for name in FEATURE_NAMES if name not in names]
+        if missing:
+            raise ValueError(f"feature_names is missing {len(missing)} features, e.g. {missing[:5]}")
+        matrix = matrix[:, [names.index(name) for name in FEATURE_NAMES]]
+    matrix = matrix.reshape(count, N_FEATURES)
+
+    columns = frame.get("columns") or {}
+    for name, values in columns.items():
+        if not isinstance(values, list) or len(values) != count:
+            raise ValueError(f"Column {name} needs one value per flow ({count})")
+    metadata = [{name: values[row] for name, values in columns.items()} for row in range(count)]
+    return _flows(metadata, matrix)
+
+def _feature_row(features) -> list:
+    if isinstance(features, dict):
+        return [features[name] for name in FEATURE_NAMES]
+    if len(features) != N_FEATURES:
+        raise ValueError(f"expected {N_FEATURES} feature values, got {len(features)}")
+    return list(features)
+
+def _flows(metadata: list, matrix: np.ndarray) -> list:
+    """Validates the metadata and pairs each flow with its row of the matrix."""
+    finite = np.isfinite(matrix).all(axis=1)
+    if not finite.all():
+        bad = int(np.flatnonzero(~finite)[0])
+        raise ValueError(f"Flow {bad + 1}: non-finite feature value in {_first_non_finite(matrix[bad])}")
+    now = datetime.now().isoformat()
+    for number, log_dict in enumerate(metadata, start=1):
+        try:
+            ip = log_dict.get("ip")
+            if not isinstance(ip, str):
+                raise ValueError("missing ip")
+            ipaddress.ip_address(ip)
+            timestamp = log_dict.get("timestamp")
+            log_dict["timestamp"] = _local_timestamp(timestamp) if timestamp else now
+        except (TypeError, ValueError) as e:
+            raise ValueError(f"Flow {number}: {e}")
+    return list(zip(metadata, matrix))
+
+def _local_timestamp(timestamp: str) -> str:
+    parsed = datetime.fromisoformat(timestamp)
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone().replace(tzinfo=None)
+    return parsed.isoformat()
+
+def _first_non_finite(row: np.ndarray) -> str:
+    return FEATURE_NAMES[int(np.flatnonzero(~np.isfinite(row))[0])]
+
+def _describe(error: Exception) -> str:
+    if isinstance(error, KeyError):
+        return f"missing feature {error.args[0]}"
+    return str(error)
@@ -0,0 +1,63 @@
+import hashlib
+import json
+import threading
+import time
+
+class KpiCache:
+    """
+    In-process cache of serialized /api/kpis responses, keyed by range_days.
+    An entry is reused while it is younger than ttl_seconds and no alerts were
+    committed since it was built (database.data_version() is unchanged).
+    Entries younger than stale_seconds are reused even after new commits, which
+    bounds recomputation during alert storms.
+    """
+    def __init__(self, ttl_seconds: float = 10.0, stale_seconds: float = 1.0):
+        self.ttl_seconds = ttl_seconds
+        self.stale_seconds = stale_seconds
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+        self._entries = {}  # key -> (data version, created at, body bytes, etag)
+        self._lock = threading.Lock()
+
+    def get(self, key, version: int):
+        """Returns (body, etag) if a usable entry exists, else None. Counts hits and misses."""
+        entry = self._entries.get(key)
+        if entry is not None:
+            entry_version, created, body, etag = entry
+            age = time.monotonic() - created
+            if age < self.stale_seconds or (entry_version == version and age < self.ttl_seconds):
+                self.hits += 1
+                return body, etag
+        self.misses += 1
+        return None
+
+    def is_not_modified(self, etag: str, if_none_match: str) -> bool:
+        """True if the client already has this response (its If-None-Match is the ETag). Counts 304s."""
+        if if_none_match != etag:
+            return False
+        self.not_modified += 1
+        return True
+
+    def put(self, key, version: int, response: dict):
+        """Serializes a freshly computed response and stores it. Returns (body, etag)."""
+        body = json.dumps(response).encode()
+        # The ETag depends on the content only, so a rebuilt but unchanged response still matches
+        etag = '"' + hashlib.blake2b(body, digest_size=8).hexdigest() + '"'
+        with self._lock:
+            self._entries[key] = (version, time.monotonic(), body, etag)
+        return body, etag
+
+    def invalidate(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "not_modified": self.not_modified,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": len(self._entries),
+        }
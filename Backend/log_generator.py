@@ -1,79 +1,85 @@
+import os
 import random
 from datetime import datetime
 import numpy as np
-import pandas as pd
-import geoip2.database
 
-# List of 77 feature names that match the scaler's expectations
-FEATURE_NAMES = [
-    'Protocol', 'Flow Duration', 'Total Fwd Packets', 'Total Backward Packets',
-    'Fwd Packets Length Total', 'Bwd Packets Length Total', 'Fwd Packet Length Max',
-    'Fwd Packet Length Min', 'Fwd Packet Length Mean', 'Fwd Packet Length Std',
-    'Bwd Packet Length Max', 'Bwd Packet Length Min', 'Bwd Packet Length Mean',
-    'Bwd Packet Length Std', 'Flow Bytes/s', 'Flow Packets/s', 'Flow IAT Mean',
-    'Flow IAT Std', 'Flow IAT Max', 'Flow IAT Min', 'Fwd IAT Total', 'Fwd IAT Mean',
-    'Fwd IAT Std', 'Fwd IAT Max', 'Fwd IAT Min', 'Bwd IAT Total', 'Bwd IAT Mean',
-    'Bwd IAT Std', 'Bwd IAT Max', 'Bwd IAT Min', 'Fwd PSH Flags', 'Bwd PSH Flags',
-    'Fwd URG Flags', 'Bwd URG Flags', 'Fwd Header Length', 'Bwd Header Length',
-    'Fwd Packets/s', 'Bwd Packets/s', 'Packet Length Min', 'Packet Length Max',
-    'Packet Length Mean', 'Packet Length Std', 'Packet Length Variance',
-    'FIN Flag Count', 'SYN Flag Count', 'RST Flag Count', 'PSH Flag Count',
-    'ACK Flag Count', 'URG Flag Count', 'CWE Flag Count', 'ECE Flag Count',
-    'Down/Up Ratio', 'Avg Packet Size', 'Avg Fwd Segment Size',
-    'Avg Bwd Segment Size', 'Fwd Avg Bytes/Bulk',
-    'Fwd Avg Packets/Bulk', 'Fwd Avg Bulk Rate', 'Bwd Avg Bytes/Bulk',
-    'Bwd Avg Packets/Bulk', 'Bwd Avg Bulk Rate', 'Subflow Fwd Packets',
-    'Subflow Fwd Bytes', 'Subflow Bwd Packets', 'Subflow Bwd Bytes',
-    'Init Fwd Win Bytes', 'Init Bwd Win Bytes', 'Fwd Act Data Packets',
-    'Fwd Seg Size Min', 'Active Mean', 'Active Std', 'Active Max',
-    'Active Min', 'Idle Mean', 'Idle Std', 'Idle Max', 'Idle Min'
-]
+from features import FEATURE_DTYPE, FEATURE_NAMES, N_FEATURES
+from geo_enrichment import GeoEnricher
+
+class Dist:
+    """
+    A feature value distribution. Calling it draws one value with `random`,
+    which is what generate_log does; generate_batch reads kind/params instead
+    and samples whole columns at once with NumPy.
+    """
+    def __init__(self, kind, *params):
+        self.kind = kind
+        self.params = params
+
+    def __call__(self):
+        if self.kind == "int":
+            return random.randint(*self.params)
+        if self.kind == "uniform":
+            return random.uniform(*self.params)
+        return random.choice(self.params[0])
+
+def rand_int(low, high):
+    """Integer drawn uniformly from [low, high], like random.randint."""
+    return Dist("int", low, high)
+
+def rand_uniform(low, high):
+    """Float drawn uniformly from [low, high], like random.uniform."""
+    return Dist("uniform", low, high)
+
+def rand_choice(options):
+    """One of the given options, like random.choice."""
+    return Dist("choice", list(options))
 
 # Templates for feature values
 BENIGN_TEMPLATE = {
     'Protocol': 6, # TCP
-    'Flow Duration': lambda: random.randint(50000, 200000),
+    'Flow Duration': rand_int(50000, 200000),
     'Total Fwd Packets': 2,
     'Total Backward Packets': 2,
-    'Fwd Packets Length Total': lambda: random.randint(50, 200),
-    'Bwd Packets Length Total': lambda: random.randint(100, 3000),
-    'Fwd Packet Length Max': lambda: random.randint(50, 200),
+    'Fwd Packets Length Total': rand_int(50, 200),
+    'Bwd Packets Length Total': rand_int(100, 3000),
+    'Fwd Packet Length Max': rand_int(50, 200),
     'Fwd Packet Length Min': 0,
-    'Fwd Packet Length Mean': lambda: random.uniform(25, 100),
-    'Fwd Packet Length Std': lambda: random.uniform(0, 50),
-    'Bwd Packet Length Max': lambda: random.randint(50, 1500),
+    'Fwd Packet Length Mean': rand_uniform(25, 100),
+    'Fwd Packet Length Std': rand_uniform(0, 50),
+    'Bwd Packet Length Max': rand_int(50, 1500),
     'Bwd Packet Length Min': 0,
-    'Bwd Packet Length Mean': lambda: random.uniform(50, 750),
-    'Bwd Packet Length Std': lambda: random.uniform(0, 300),
-    'Flow Bytes/s': lambda: random.uniform(1000, 5000),
-    'Flow Packets/s': lambda: random.uniform(10, 40),
-    'Flow IAT Mean': lambda: random.uniform(10000, 50000),
-    'Flow IAT Std': lambda: random.uniform(0, 20000),
-    'Flow IAT Max': lambda: random.randint(30000, 100000),
-    'Flow IAT Min': lambda: random.randint(1000, 10000),
-    'Fwd IAT Total': lambda: random.randint(20000, 100000),
-    'Fwd IAT Mean': lambda: random.uniform(10000, 50000),
-    'Fwd IAT Std': lambda: random.uniform(0, 20000),
-    'Fwd IAT Max': lambda: random.randint(10000, 50000),
-    'Fwd IAT Min': lambda: random.randint(1000, 10000),
-    'Bwd IAT Total': lambda: random.randint(20000, 100000),
-    'Bwd IAT Mean': lambda: random.uniform(10000, 50000),
-    'Bwd IAT Std': lambda: random.uniform(0, 20000),
-    'Bwd IAT Max': lambda: random.randint(10000, 50000),
-    'Bwd IAT Min': lambda: random.randint(1000, 10000),
+    'Bwd Packet Length Mean': rand_uniform(50, 750),
+    'Bwd Packet Length Std': rand_uniform(0, 300),
+    'Flow Bytes/s': rand_uniform(1000, 5000),
+    'Flow Packets/s': rand_uniform(10, 40),
+    'Flow IAT Mean': rand_uniform(10000, 50000),
+    'Flow IAT Std': rand_uniform(0, 20000),
+    'Flow IAT Max': rand_int(30000, 100000),
+    'Flow IAT Min': rand_int(1000, 10000),
+    'Fwd IAT Total': rand_int(20000, 100000),
+    'Fwd IAT Mean': rand_uniform(10000, 50000),
+    'Fwd IAT Std': rand_uniform(0, 20000),
+    'Fwd IAT Max': rand_int(10000, 50000),
+    'Fwd IAT Min': rand_int(1000, 10000),
+    'Bwd IAT Total': rand_int(20000, 100000),
+    'Bwd IAT Mean': rand_uniform(10000, 50000),
+    'Bwd IAT Std': rand_uniform(0, 20000),
+    'Bwd IAT Max': rand_int(10000, 50000),
+    'Bwd IAT Min': rand_int(1000, 10000),
     'Fwd PSH Flags': 1,
     'Bwd PSH Flags': 0,
     'Fwd URG Flags': 0,
     'Bwd URG Flags': 0,
     'Fwd Header Length': 40,
     'Bwd Header Length': 40,
-    'Fwd Packets/s': lambda: random.uniform(5, 20),
-    'Bwd Packets/s': lambda: random.uniform(5, 20),
+    'Fwd Packets/s': rand_uniform(5, 20),
+    'Bwd Packets/s': rand_uniform(5, 20),
     'Packet Length Min': 0,
-    'Packet Length Max': lambda: random.randint(50, 1500),
-    'Packet Length Mean': lambda: random.uniform(50, 500),
-    'Packet Length Std': lambda: random.uniform(0, 200),
-    'Packet Length Variance': lambda: random.uniform(0, 40000),
+    'Packet Length Max': rand_int(50, 1500),
+    'Packet Length Mean': rand_uniform(50, 500),
+    'Packet Length Std': rand_uniform(0, 200),
+    'Packet Length Variance': rand_uniform(0, 40000),
     'FIN Flag Count': 0,
     'SYN Flag Count': 0,
     'RST Flag Count': 0,
@@ -83,9 +89,9 @@ BENIGN_TEMPLATE = {
     'CWE Flag Count': 0,
     'ECE Flag Count': 0,
     'Down/Up Ratio': 1.0,
-    'Avg Packet Size': lambda: random.uniform(50, 600),
-    'Avg Fwd Segment Size': lambda: random.uniform(25, 100),
-    'Avg Bwd Segment Size': lambda: random.uniform(50, 750),
+    'Avg Packet Size': rand_uniform(50, 600),
+    'Avg Fwd Segment Size': rand_uniform(25, 100),
+    'Avg Bwd Segment Size': rand_uniform(50, 750),
     'Fwd Avg Bytes/Bulk': 0,
     'Fwd Avg Packets/Bulk': 0,
     'Fwd Avg Bulk Rate': 0,
@@ -93,9 +99,9 @@ BENIGN_TEMPLATE = {
     'Bwd Avg Packets/Bulk': 0,
     'Bwd Avg Bulk Rate': 0,
     'Subflow Fwd Packets': 2,
-    'Subflow Fwd Bytes': lambda: random.randint(50, 200),
+    'Subflow Fwd Bytes': rand_int(50, 200),
     'Subflow Bwd Packets': 2,
-    'Subflow Bwd Bytes': lambda: random.randint(100, 3000),
+    'Subflow Bwd Bytes': rand_int(100, 3000),
     'Init Fwd Win Bytes': 8192,
     'Init Bwd Win Bytes': 8192,
     'Fwd Act Data Packets': 1,
@@ -111,47 +117,47 @@ BENIGN_TEMPLATE = {
 }
 
 MALICIOUS_TEMPLATE = {
-    'Protocol': lambda: random.choice([6, 17]),  # TCP or UDP
-    'Flow Duration': lambda: random.randint(1000000, 5000000),
-    'Total Fwd Packets': lambda: random.randint(10, 50),
-    'Total Backward Packets': lambda: random.randint(2, 10),
-    'Fwd Packets Length Total': lambda: random.randint(0, 50),
+    'Protocol': rand_choice([6, 17]),  # TCP or UDP
+    'Flow Duration': rand_int(1000000, 5000000),
+    'Total Fwd Packets': rand_int(10, 50),
+    'Total Backward Packets': rand_int(2, 10),
+    'Fwd Packets Length Total': rand_int(0, 50),
     'Bwd Packets Length Total': 0,
-    'Fwd Packet Length Max': lambda: random.randint(0, 50),
+    'Fwd Packet Length Max': rand_int(0, 50),
     'Fwd Packet Length Min': 0,
-    'Fwd Packet Length Mean': lambda: random.uniform(0, 25),
+    'Fwd Packet Length Mean': rand_uniform(0, 25),
     'Fwd Packet Length Std': 0.0,
     'Bwd Packet Length Max': 0,
     'Bwd Packet Length Min': 0,
     'Bwd Packet Length Mean': 0.0,
     'Bwd Packet Length Std': 0.0,
-    'Flow Bytes/s': lambda: random.uniform(1, 100),
-    'Flow Packets/s': lambda: random.uniform(1000, 10000),
-    'Flow IAT Mean': lambda: random.uniform(1000, 10000),
-    'Flow IAT Std': lambda: random.uniform(0, 5000),
-    'Flow IAT Max': lambda: random.randint(10000, 50000),
-    'Flow IAT Min': lambda: random.randint(100, 1000),
-    'Fwd IAT Total': lambda: random.randint(500000, 2000000),
-    'Fwd IAT Mean': lambda: random.uniform(10000, 100000),
-    'Fwd IAT Std': lambda: random.uniform(0, 50000),
-    'Fwd IAT Max': lambda: random.randint(50000, 200000),
-    'Fwd IAT Min': lambda: random.randint(100, 1000),
-    'Bwd IAT Total': lambda: random.randint(10000, 100000),
-    'Bwd IAT Mean': lambda: random.uniform(5000, 50000),
-    'Bwd IAT Std': lambda: random.uniform(0, 20000),
-    'Bwd IAT Max': lambda: random.randint(5000, 50000),
-    'Bwd IAT Min': lambda: random.randint(100, 1000),
+    'Flow Bytes/s': rand_uniform(1, 100),
+    'Flow Packets/s': rand_uniform(1000, 10000),
+    'Flow IAT Mean': rand_uniform(1000, 10000),
+    'Flow IAT Std': rand_uniform(0, 5000),
+    'Flow IAT Max': rand_int(10000, 50000),
+    'Flow IAT Min': rand_int(100, 1000),
+    'Fwd IAT Total': rand_int(500000, 2000000),
+    'Fwd IAT Mean': rand_uniform(10000, 100000),
+    'Fwd IAT Std': rand_uniform(0, 50000),
+    'Fwd IAT Max': rand_int(50000, 200000),
+    'Fwd IAT Min': rand_int(100, 1000),
+    'Bwd IAT Total': rand_int(10000, 100000),
+    'Bwd IAT Mean': rand_uniform(5000, 50000),
+    'Bwd IAT Std': rand_uniform(0, 20000),
+    'Bwd IAT Max': rand_int(5000, 50000),
+    'Bwd IAT Min': rand_int(100, 1000),
     'Fwd PSH Flags': 0,
     'Bwd PSH Flags': 0,
     'Fwd URG Flags': 0,
     'Bwd URG Flags': 0,
-    'Fwd Header Length': lambda: random.randint(40, 200),
-    'Bwd Header Length': lambda: random.randint(20, 40),
-    'Fwd Packets/s': lambda: random.uniform(500, 2000),
-    'Bwd Packets/s': lambda: random.uniform(10, 50),
+    'Fwd Header Length': rand_int(40, 200),
+    'Bwd Header Length': rand_int(20, 40),
+    'Fwd Packets/s': rand_uniform(500, 2000),
+    'Bwd Packets/s': rand_uniform(10, 50),
     'Packet Length Min': 0,
-    'Packet Length Max': lambda: random.randint(0, 50),
-    'Packet Length Mean': lambda: random.uniform(0, 25),
+    'Packet Length Max': rand_int(0, 50),
+    'Packet Length Mean': rand_uniform(0, 25),
     'Packet Length Std': 0.0,
     'Packet Length Variance': 0.0,
     'FIN Flag Count': 0,
@@ -162,9 +168,9 @@ MALICIOUS_TEMPLATE = {
     'URG Flag Count': 0,
     'CWE Flag Count': 0,
     'ECE Flag Count': 0,
-    'Down/Up Ratio': lambda: random.uniform(0, 0.5),
-    'Avg Packet Size': lambda: random.uniform(0, 50),
-    'Avg Fwd Segment Size': lambda: random.uniform(0, 25),
+    'Down/Up Ratio': rand_uniform(0, 0.5),
+    'Avg Packet Size': rand_uniform(0, 50),
+    'Avg Fwd Segment Size': rand_uniform(0, 25),
     'Avg Bwd Segment Size': 0.0,
     'Fwd Avg Bytes/Bulk': 0,
     'Fwd Avg Packets/Bulk': 0,
@@ -172,13 +178,13 @@ MALICIOUS_TEMPLATE = {
     'Bwd Avg Bytes/Bulk': 0,
     'Bwd Avg Packets/Bulk': 0,
     'Bwd Avg Bulk Rate': 0,
-    'Subflow Fwd Packets': lambda: random.randint(10, 50),
-    'Subflow Fwd Bytes': lambda: random.randint(0, 50),
-    'Subflow Bwd Packets': lambda: random.randint(2, 10),
+    'Subflow Fwd Packets': rand_int(10, 50),
+    'Subflow Fwd Bytes': rand_int(0, 50),
+    'Subflow Bwd Packets': rand_int(2, 10),
     'Subflow Bwd Bytes': 0,
     'Init Fwd Win Bytes': 256,
     'Init Bwd Win Bytes': -1,
-    'Fwd Act Data Packets': lambda: random.randint(5, 20),
+    'Fwd Act Data Packets': rand_int(5, 20),
     'Fwd Seg Size Min': 20,
     'Active Mean': 0.0,
     'Active Std': 0.0,
@@ -196,12 +202,12 @@ MALICIOUS_TEMPLATES = {
     "PORT_SCAN": {
         "log_info": {"path": "/.env", "user_agent": "Nmap Scanner"},
         "features": {
-            'Flow Duration': lambda: random.randint(500000, 2000000),
-            'Total Fwd Packets': lambda: random.randint(5, 20),
+            'Flow Duration': rand_int(500000, 2000000),
+            'Total Fwd Packets': rand_int(5, 20),
             'Total Backward Packets': 0,
             'Fwd Packets Length Total': 0,
-            'Flow Packets/s': lambda: random.uniform(100, 1000),
-            'Fwd Packets/s': lambda: random.uniform(100, 1000),
+            'Flow Packets/s': rand_uniform(100, 1000),
+            'Fwd Packets/s': rand_uniform(100, 1000),
             'FIN Flag Count': 0,
             'SYN Flag Count': 1, # The key indicator for a SYN scan
             'RST Flag Count': 0,
@@ -215,14 +221,14 @@ MALICIOUS_TEMPLATES = {
     "XSS_ATTACK": {
         "log_info": {"path": "/search?q=<script>alert('XSS')</script>", "user_agent": "Mozilla/5.0"},
         "features": {
-            'Fwd Packet Length Max': lambda: random.uniform(350, 700),
-            'Fwd Packet Length Mean': lambda: random.uniform(100, 250),
-            'Packet Length Max': lambda: random.uniform(350, 700),
-            'Packet Length Mean': lambda: random.uniform(80, 200),
-            'Avg Packet Size': lambda: random.uniform(80, 220),
-            'Avg Fwd Segment Size': lambda: random.uniform(100, 250),
-            'Flow IAT Mean': lambda: random.uniform(10000, 50000),
-            'Flow Duration': lambda: random.randint(40000, 200000),
+            'Fwd Packet Length Max': rand_uniform(350, 700),
+            'Fwd Packet Length Mean': rand_uniform(100, 250),
+            'Packet Length Max': rand_uniform(350, 700),
+            'Packet Length Mean': rand_uniform(80, 200),
+            'Avg Packet Size': rand_uniform(80, 220),
+            'Avg Fwd Segment Size': rand_uniform(100, 250),
+            'Flow IAT Mean': rand_uniform(10000, 50000),
+            'Flow Duration': rand_int(40000, 200000),
             'Fwd PSH Flags': 1,
             'PSH Flag Count': 1,
             'ACK Flag Count': 1,
@@ -248,10 +254,10 @@ MALICIOUS_TEMPLATES = {
     "STATISTICAL_ANOMALY": {
         "log_info": {"path": "/api/v2/metrics", "user_agent": "Internal-Scanner/1.0"},
         "features": {
-            'Flow Duration': lambda: random.randint(1, 100),
-            'Total Fwd Packets': lambda: random.randint(1000, 5000),
-            'Flow Packets/s': lambda: random.uniform(100000, 900000), # Extremely high value
-            'Fwd Packets/s': lambda: random.uniform(100000, 900000),   # Extremely high value
+            'Flow Duration': rand_int(1, 100),
+            'Total Fwd Packets': rand_int(1000, 5000),
+            'Flow Packets/s': rand_uniform(100000, 900000), # Extremely high value
+            'Fwd Packets/s': rand_uniform(100000, 900000),   # Extremely high value
             'Init Fwd Win Bytes': 0,
         }
     }
@@ -260,17 +266,25 @@ MALICIOUS_TEMPLATES = {
 
 # --- Initialize GeoIP Reader ---
 # This should be outside the function so it's only loaded once.
-try:
-    geoip_reader = geoip2.database.Reader('GeoLite2-City.mmdb')
-except FileNotFoundError:
-    print("GeoLite2-City.mmdb not found. Map functionality will be limited.")
-    geoip_reader = None
+geo_enricher = GeoEnricher(
+    'GeoLite2-City.mmdb',
+    cache_size=int(os.getenv("GEOIP_CACHE_SIZE", "65536")),
+    prefix24=os.getenv("GEOIP_CACHE_PREFIX24", "0") == "1",
+)
+geoip_reader = geo_enricher.reader
+
+# Columns that are never jittered
+NO_JITTER_FEATURES = ['Total Fwd Packets', 'Fwd Packets Length Total']
+
+def lookup_location(ip: str):
+    """Returns the GeoIP location dict for an IP, or None if it is not in the database."""
+    return geo_enricher.lookup(ip)
 
 def generate_log():
     """
     Generates a tuple containing:
     1. A human-readable log dictionary for the frontend.
-    2. A pandas DataFrame with 77 features for the ML model.
+    2. A feature vector (float64, FEATURE_NAMES order) for the ML model.
     """
     is_malicious = random.random() < 0.01  # 10% chance of being malicious
 
@@ -286,17 +300,7 @@ def generate_log():
 
     # Add GeoIP data if the reader is available
     if geoip_reader:
-        try:
-            response = geoip_reader.city(log_dict['ip'])
-            log_dict['location'] = {
-                'latitude': response.location.latitude,
-                'longitude': response.location.longitude,
-                'city': response.city.name,
-                'country': response.country.name
-            }
-        except geoip2.errors.AddressNotFoundError:
-            # IP not found in the database (e.g., private IP), skip adding location
-            log_dict['location'] = None
+        log_dict['location'] = lookup_location(log_dict['ip'])
 
     if is_malicious:
         # --- UPDATED: Randomly select an attack type ---
@@ -319,20 +323,122 @@ def generate_log():
         })
         base_template = BENIGN_TEMPLATE
 
-    # --- 2. Generate the corresponding feature DataFrame ---
-    feature_dict = {}
-    for name in FEATURE_NAMES:
+    # --- 2. Generate the corresponding feature vector ---
+    feature_vector = np.empty(N_FEATURES, dtype=FEATURE_DTYPE)
+    for column, name in enumerate(FEATURE_NAMES):
         value = base_template.get(name, 0)
-        # If the value is a callable (lambda), evaluate it
+        # If the value is a distribution, draw a value from it
         if callable(value):
             value = value()
         # Add jitter to non-zero numerical values
-        if isinstance(value, (int, float)) and value > 0 and name not in ['Total Fwd Packets', 'Fwd Packets Length Total']:
+        if isinstance(value, (int, float)) and value > 0 and name not in NO_JITTER_FEATURES:
             jitter = value * 0.1
             value = random.uniform(value - jitter, value + jitter)
-        feature_dict[name] = value
+        feature_vector[column] = value
+
+    return log_dict, feature_vector
+
+# --- Vectorized batch generation ---
+# Each template is compiled once into per-column arrays so a batch can be
+# sampled column-wise with NumPy instead of row by row.
+
+BENIGN_PATHS = ['api/v1/users', 'assets/img.png', 'search/blog', '']
+HTTP_METHODS = ["GET", "POST", "PUT", "DELETE"]
+BROWSER_USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
 
-    # Create DataFrame with correct column names
-    feature_df = pd.DataFrame([feature_dict], columns=FEATURE_NAMES)
+class CompiledTemplate:
+    """Per-column distribution parameters for one feature template, in FEATURE_NAMES order."""
+    def __init__(self, template: dict):
+        self.constants = np.zeros(N_FEATURES, dtype=FEATURE_DTYPE)
+        self.int_columns, self.int_low, self.int_high = [], [], []
+        self.uniform_columns, self.uniform_low, self.uniform_high = [], [], []
+        self.choice_columns = []  # (column, options)
+        for column, name in enumerate(FEATURE_NAMES):
+            value = template.get(name, 0)
+            if not isinstance(value, Dist):
+                self.constants[column] = value
+            elif value.kind == "int":
+                self.int_columns.append(column)
+                self.int_low.append(value.params[0])
+                self.int_high.append(value.params[1] + 1)  # randint includes the upper bound
+            elif value.kind == "uniform":
+                self.uniform_columns.append(column)
+                self.uniform_low.append(value.params[0])
+                self.uniform_high.append(value.params[1])
+            else:
+                self.choice_columns.append((column, np.asarray(value.params[0], dtype=float)))
+        self.int_columns = np.asarray(self.int_columns, dtype=np.intp)
+        self.uniform_columns = np.asarray(self.uniform_columns, dtype=np.intp)
+
+    def sample(self, n: int, rng: np.random.Generator) -> np.ndarray:
+        """Draws n feature rows from the template, including jitter."""
+        values = np.tile(self.constants, (n, 1))
+        if len(self.int_columns):
+            values[:, self.int_columns] = rng.integers(self.int_low, self.int_high, size=(n, len(self.int_columns)))
+        if len(self.uniform_columns):
+            values[:, self.uniform_columns] = rng.uniform(self.uniform_low, self.uniform_high,
+                                                          size=(n, len(self.uniform_columns)))
+        for column, options in self.choice_columns:
+            values[:, column] = rng.choice(options, size=n)
+        # Same +/-10% jitter on positive values as generate_log
+        jitter = (values > 0) & JITTER_COLUMNS
+        values[jitter] *= rng.uniform(0.9, 1.1, size=int(jitter.sum()))
+        return values
+
+JITTER_COLUMNS = np.array([name not in NO_JITTER_FEATURES for name in FEATURE_NAMES])
+COMPILED_BENIGN = CompiledTemplate(BENIGN_TEMPLATE)
+COMPILED_ATTACKS = {
+    attack_type: CompiledTemplate({**BENIGN_TEMPLATE, **attack_template["features"]})
+    for attack_type, attack_template in MALICIOUS_TEMPLATES.items()
+}
+
+def generate_batch(n: int, malicious_ratio: float = 0.01, seed: int = None):
+    """
+    Generates n flows at once. Returns a tuple containing, like generate_log:
+    1. A list of n human-readable log dictionaries, one per row.
+    2. A float64 array of shape (n, 77) with columns in FEATURE_NAMES order.
+    """
+    rng = np.random.default_rng(seed)
+    features = np.empty((n, N_FEATURES), dtype=FEATURE_DTYPE)
+
+    # Pick benign vs. attack per row, then sample each template's rows in one go
+    attack_types = list(COMPILED_ATTACKS)
+    template_ids = np.where(rng.random(n) < malicious_ratio, rng.integers(0, len(attack_types), size=n), -1)
+    templates = [(-1, COMPILED_BENIGN)] + list(enumerate(COMPILED_ATTACKS.values()))
+    for template_id, compiled in templates:
+        rows = np.flatnonzero(template_ids == template_id)
+        if len(rows):
+            features[rows] = compiled.sample(len(rows), rng)
+
+    octets = rng.integers([1, 0, 0, 0], [224, 256, 256, 256], size=(n, 4))
+    methods = rng.integers(0, len(HTTP_METHODS), size=n)
+    benign_paths = rng.integers(0, len(BENIGN_PATHS), size=n)
+    benign_statuses = rng.choice([200, 201, 304], size=n)
+    attack_statuses = rng.choice([200, 201, 304, 404, 500], size=n)
+    timestamp = datetime.now().isoformat()
+
+    metadata = []
+    for row in range(n):
+        log_dict = {
+            "timestamp": timestamp,
+            "ip": "{}.{}.{}.{}".format(*octets[row]),
+            "method": HTTP_METHODS[methods[row]],
+        }
+        template_id = template_ids[row]
+        if template_id < 0:
+            log_dict["path"] = f"/{BENIGN_PATHS[benign_paths[row]]}"
+            log_dict["status"] = int(benign_statuses[row])
+            log_dict["user_agent"] = BROWSER_USER_AGENT
+        else:
+            attack_type = attack_types[template_id]
+            log_dict["status"] = int(attack_statuses[row])
+            log_dict.update(MALICIOUS_TEMPLATES[attack_type]["log_info"])
+            log_dict["attack_type_simulated"] = attack_type
+        metadata.append(log_dict)
+
+    # Resolve locations in bulk so repeated sources are looked up once
+    if geoip_reader:
+        for log_dict, location in zip(metadata, geo_enricher.lookup_many([log_dict['ip'] for log_dict in metadata])):
+            log_dict['location'] = location
 
-    return log_dict, feature_df
\ No newline at end of file
+    return metadata, features
@@ -1,20 +1,29 @@
 import asyncio
+import base64
 import json
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect
+import os
+import time
+from fastapi import FastAPI, HTTPException, Query, Request, Response, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
-from typing import List
-import pandas as pd
+from typing import Dict, List
+import numpy as np
 
 from pydantic import BaseModel
-from log_generator import generate_log
-from ml_model import model_instance
-from collections import Counter
+from log_generator import generate_log, geo_enricher
+from features import vector_to_dict
+from ml_model import PREDICTION_ERRORS, model_instance
+from scoring_pool import ScoringPool
 import database
+from kpi_cache import KpiCache
+from alert_aggregator import AlertAggregator
+from asset_store import AssetStore
+import metrics
+from stream_protocol import Sampler, Subscription, batch_frame, encode, split_features
+from sharding import ShardRouter, make_broker
+import ingest
 from datetime import datetime, timedelta
 
-# --- NEW: In-memory store for historical alerts ---
-HISTORICAL_ALERTS = []
-
 # --- NEW: Mock Asset Inventory Database ---
 ASSET_INVENTORY = {
     "8.90.36.189": {"owner": "Finance Dept", "purpose": "Payroll Server", "criticality": "High"},
@@ -24,6 +33,114 @@ ASSET_INVENTORY = {
     # Add more simulated assets that match IPs your generator might create
 }
 
+# Address ranges with a known owner; hosts inside them inherit the range's criticality.
+# The most specific range wins.
+ASSET_RANGES = {
+    "10.0.0.0/8": {"owner": "IT Operations", "purpose": "Internal Network", "criticality": "Medium"},
+    "10.10.0.0/16": {"owner": "Finance Dept", "purpose": "Finance Subnet", "criticality": "High"},
+    "192.168.0.0/16": {"owner": "IT Operations", "purpose": "Office LAN", "criticality": "Low"},
+}
+
+# Auto-discovered hosts are stored in SQLite; only the most recently seen stay in memory
+ASSET_MAX_DISCOVERED = int(os.getenv("ASSET_MAX_DISCOVERED", "50000"))
+# How often the last_seen of hosts still in memory is written to SQLite
+ASSET_FLUSH_INTERVAL_S = float(os.getenv("ASSET_FLUSH_INTERVAL_S", "10"))
+asset_store = AssetStore(ASSET_INVENTORY, ASSET_RANGES, max_discovered=ASSET_MAX_DISCOVERED)
+
+# --- Scoring pipeline settings ---
+# Flows are queued by the generator and scored in micro-batches of up to
+# SCORING_BATCH_SIZE rows, waiting at most SCORING_BATCH_WAIT_MS for a batch to fill.
+GENERATION_INTERVAL_S = float(os.getenv("GENERATION_INTERVAL_S", "1"))
+SCORING_BATCH_SIZE = int(os.getenv("SCORING_BATCH_SIZE", "256"))
+SCORING_BATCH_WAIT_MS = int(os.getenv("SCORING_BATCH_WAIT_MS", "50"))
+FLOW_QUEUE_SIZE = int(os.getenv("FLOW_QUEUE_SIZE", "10000"))
+
+# Inference runs in a worker pool so the event loop keeps serving sockets and APIs.
+# SCORING_EXECUTOR is "thread" (shared models) or "process" (models preloaded per worker).
+SCORING_EXECUTOR = os.getenv("SCORING_EXECUTOR", "thread")
+SCORING_WORKERS = int(os.getenv("SCORING_WORKERS", "2"))
+SCORING_MAX_IN_FLIGHT = int(os.getenv("SCORING_MAX_IN_FLIGHT", "4"))
+
+# Created on startup so it is bound to the server's event loop
+flow_queue: asyncio.Queue = None
+
+# --- Flow sources ---
+# Every source feeds the same bounded flow queue: "generator" (simulated traffic),
+# "http" (bulk POST /api/ingest) and "websocket" (/ws/ingest with credit-based flow control).
+# Set e.g. FLOW_SOURCES=http,websocket to score only what collectors push in.
+FLOW_SOURCE_NAMES = ("generator", "http", "websocket")
+FLOW_SOURCES = {source.strip() for source in os.getenv("FLOW_SOURCES", "generator,http,websocket").split(",")
+                if source.strip()}
+if FLOW_SOURCES - set(FLOW_SOURCE_NAMES):
+    raise ValueError(f"Unknown flow sources: {', '.join(sorted(FLOW_SOURCES - set(FLOW_SOURCE_NAMES)))}")
+# Seconds a collector is told to wait when the flow queue has no room for its batch
+INGEST_RETRY_AFTER_S = int(os.getenv("INGEST_RETRY_AFTER_S", "1"))
+# Flows a /ws/ingest client may have outstanding before it has to wait for more credit
+INGEST_WS_CREDITS = int(os.getenv("INGEST_WS_CREDITS", "1000"))
+INGEST_WS_FORMATS = {"ndjson": "application/x-ndjson", "json": ingest.JSON_TYPE, "msgpack": ingest.MSGPACK_TYPE}
+scoring_pool = ScoringPool(model_instance, mode=SCORING_EXECUTOR, workers=SCORING_WORKERS,
+                           max_in_flight=SCORING_MAX_IN_FLIGHT)
+
+# With SHARDS > 0, flows are hash-partitioned by source IP across that many shard workers,
+# each with its own models, alert windows and discovered hosts (see sharding.py), instead of
+# the scoring pool. SHARD_BROKER is "ipc" (one process per shard) or "memory" (threads).
+SHARDS = int(os.getenv("SHARDS", "0"))
+SHARD_BROKER = os.getenv("SHARD_BROKER", "ipc")
+SHARD_QUEUE_SIZE = int(os.getenv("SHARD_QUEUE_SIZE", "64"))  # Batches waiting per shard
+shard_router: ShardRouter = None  # Created on startup when SHARDS > 0
+
+# Dashboards poll /api/kpis; responses are cached per range_days until new alerts are committed
+KPI_CACHE_TTL_S = float(os.getenv("KPI_CACHE_TTL_S", "10"))
+KPI_CACHE_STALE_S = float(os.getenv("KPI_CACHE_STALE_S", "1"))
+kpi_cache = KpiCache(ttl_seconds=KPI_CACHE_TTL_S, stale_seconds=KPI_CACHE_STALE_S)
+# range_days is a cache key, so it is bounded: at most the retention period (a year when alerts are kept forever)
+KPI_MAX_RANGE_DAYS = database.ALERT_RETENTION_DAYS or 366
+
+# Alerts from the same (ip, reason) are collapsed into windows: the first one is stored
+# and broadcast, the rest are rolled up into periodic updates. Rolled-up alerts get no rows of
+# their own but still count in the KPI rollups and alerts_total. Set ALERT_AGGREGATION=0 to disable.
+ALERT_AGGREGATION = os.getenv("ALERT_AGGREGATION", "1") == "1"
+ALERT_WINDOW_SETTINGS = {
+    "update_interval_s": float(os.getenv("ALERT_WINDOW_UPDATE_S", "5")),
+    "idle_timeout_s": float(os.getenv("ALERT_WINDOW_IDLE_S", "30")),
+    "max_windows": int(os.getenv("ALERT_WINDOW_MAX", "10000")),
+}
+# When sharded, every shard keeps the windows of its own IPs instead
+alert_aggregator = AlertAggregator(**ALERT_WINDOW_SETTINGS) if ALERT_AGGREGATION and not SHARDS else None
+
+def alert_aggregation_stats() -> dict:
+    """Open alert windows and suppressed alerts, summed over the shards when sharded."""
+    stats = {"open_windows": 0, "suppressed_alerts": 0}
+    if alert_aggregator:
+        stats.update(alert_aggregator.stats())
+    elif shard_router:
+        for shard_stats in shard_router.stats()["per_shard"].values():
+            for key in stats:
+                stats[key] += shard_stats.get(key, 0)
+    return stats
+
+# --- Metrics, served in the Prometheus text format by /metrics ---
+GENERATION_SECONDS = metrics.Histogram("flow_generation_seconds", "Time to generate one flow")
+FLOWS_SCORED = metrics.Counter("flows_scored_total", "Flows scored and delivered")
+ALERTS = metrics.Counter("alerts_total", "Alerts detected, including those rolled up into alert windows, by reason",
+                         ("reason",))
+BROADCAST_SECONDS = metrics.Histogram("ws_broadcast_seconds", "Time to queue one message for every client",
+                                      ("stream",))
+WS_CLIENTS = metrics.Gauge("ws_connected_clients", "Connected WebSocket clients", ("stream",))
+WS_DROPPED = metrics.Counter("ws_dropped_messages_total", "Messages dropped for slow WebSocket clients",
+                             ("stream",))
+FLOW_QUEUE_DEPTH = metrics.Gauge("flow_queue_depth", "Flows waiting to be batched for scoring")
+FLOW_QUEUE_DEPTH.set_function(lambda: flow_queue.qsize() if flow_queue else 0)
+INGESTED = metrics.Counter("ingest_flows_total", "Flows accepted from collectors", ("source",))
+INGEST_REJECTED = metrics.Counter("ingest_rejected_total", "Ingest batches rejected, by reason",
+                                  ("source", "reason"))
+SCORING_IN_FLIGHT = metrics.Gauge("scoring_batches_in_flight", "Batches submitted for scoring but not yet delivered")
+SCORING_IN_FLIGHT.set_function(scoring_pool.in_flight)
+ALERT_WINDOWS_OPEN = metrics.Gauge("alert_windows_open", "Open alert aggregation windows")
+ALERT_WINDOWS_OPEN.set_function(lambda: alert_aggregation_stats()["open_windows"])
+ALERTS_SUPPRESSED = metrics.Counter("alerts_suppressed_total", "Alerts rolled up into an open alert window")
+ALERTS_SUPPRESSED.set_function(lambda: alert_aggregation_stats()["suppressed_alerts"])
+
 app = FastAPI()
 
 # CORS middleware
@@ -48,42 +165,92 @@ async def report_ip(payload: ReportPayload):
     return {"message": f"IP address {payload.ip} reported successfully. Thank you!"}
 
 
+@app.get("/healthz")
+async def healthz():
+    """Liveness: the server is up, with the per-model load state for context."""
+    return {"status": "ok", **model_instance.status()}
+
+@app.get("/readyz")
+async def readyz(response: Response):
+    """Readiness: 200 once flows can be scored (possibly degraded), 503 before that."""
+    status = model_instance.status()
+    if not status["ready"]:
+        response.status_code = 503
+    return status
+
+@app.get("/api/scoring/stats")
+async def get_scoring_stats():
+    """Scoring mode, cascade order, measured detector costs and per-stage skip counters."""
+    return model_instance.scoring_report()
+
+@app.get("/api/geoip/stats")
+async def get_geoip_stats():
+    """GeoIP cache hit rate and size."""
+    return geo_enricher.stats()
+
+@app.get("/api/shards/stats")
+async def get_shard_stats():
+    """Per-shard flow, alert, window and asset counts, as last reported by each shard."""
+    if not shard_router:
+        return {"shards": 0}
+    return shard_router.stats()
+
+@app.get("/api/alerts/aggregation/stats")
+async def get_alert_aggregation_stats():
+    """Open alert windows and alerts rolled up into them, in all modes."""
+    return {"enabled": ALERT_AGGREGATION, **alert_aggregation_stats()}
+
+@app.get("/metrics")
+async def get_metrics():
+    return Response(content=metrics.REGISTRY.render(), media_type=metrics.CONTENT_TYPE)
+
 @app.get("/api/reported_ips")
 async def get_reported_ips_endpoint():
     return database.get_reported_ips()
 
 @app.get("/api/kpis")
-async def get_kpis(range_days: int = 1): # Default to 1 day (24h)
-    
-    alerts = database.get_alerts_in_range(days=range_days)
-    
-    # 1. Alerts by Type (Reason)
-    alerts_by_type = Counter(alert['reason'] for alert in alerts)
-    
-    # 2. Alerts by Asset Criticality
-    alerts_by_criticality = Counter()
-    for alert in alerts:
-        asset = ASSET_INVENTORY.get(alert['ip'])
-        if asset:
-            alerts_by_criticality[asset['criticality']] += 1
-        else:
-            alerts_by_criticality['Unknown'] += 1
-            
-    # 3. Alerts over time (by day for multi-day, by hour for 24h)
+async def get_kpis(request: Request, range_days: int = Query(1, ge=1, le=KPI_MAX_RANGE_DAYS)): # Default to 1 day (24h)
+    version = database.data_version()
+    cached = kpi_cache.get(range_days, version)
+    if cached is None:
+        # Query off the event loop; the rollup reads are synchronous
+        cached = kpi_cache.put(range_days, version, await asyncio.to_thread(compute_kpis, range_days))
+    body, etag = cached
+
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if kpi_cache.is_not_modified(etag, request.headers.get("if-none-match")):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+@app.get("/api/kpis/cache_stats")
+async def get_kpi_cache_stats():
+    return kpi_cache.stats()
+
+def compute_kpis(range_days: int) -> dict:
+    # Served from the rollup tables the alert writer keeps up to date, so the
+    # cost does not grow with the number of stored alerts.
+    summary = database.get_alert_summary(days=range_days)
+    total_alerts = summary["total_alerts"]
+
+    # Alerts over time (by day for multi-day, by hour for 24h)
     if range_days == 1:
         time_format = '%H:00'
         time_delta_unit = 'hours'
         num_units = 24
+        # 24 distinct hours come back, so no two share an 'HH:00' key; summed all the same
+        timeline = {}
+        for hour, count in database.get_alert_timeline(range_days, bucket="hour").items():
+            timeline[f"{hour[11:13]}:00"] = timeline.get(f"{hour[11:13]}:00", 0) + count
     else:
         time_format = '%Y-%m-%d'
         time_delta_unit = 'days'
         num_units = range_days
+        timeline = database.get_alert_timeline(range_days, bucket="day")
 
     alerts_over_time = { (datetime.now() - timedelta(**{time_delta_unit: i})).strftime(time_format): 0 for i in range(num_units) }
-    for alert in alerts:
-        hour_key = datetime.fromisoformat(alert['timestamp']).strftime(time_format)
-        if hour_key in alerts_over_time:
-            alerts_over_time[hour_key] += 1
+    for time_key, count in timeline.items():
+        if time_key in alerts_over_time:
+            alerts_over_time[time_key] += count
             
     alerts_over_time_list = sorted(
         [{"time": key, "alerts": value} for key, value in alerts_over_time.items()],
@@ -91,93 +258,530 @@ async def get_kpis(range_days: int = 1): # Default to 1 day (24h)
     )
 
     return {
-        "total_alerts": len(alerts),
-        "average_risk_score": sum(a['risk_score'] for a in alerts) / len(alerts) if alerts else 0,
-        "alerts_by_type": [{"name": name, "value": value} for name, value in alerts_by_type.items()],
-        "alerts_by_criticality": [{"name": name, "value": value} for name, value in alerts_by_criticality.items()],
-        "alerts_over_time": alerts_over_time_list
+        "total_alerts": total_alerts,
+        "average_risk_score": summary["risk_sum"] / total_alerts if total_alerts else 0,
+        "alerts_by_type": [{"name": name, "value": value} for name, value in summary["by_reason"].items()],
+        "alerts_by_criticality": [{"name": name, "value": value} for name, value in summary["by_criticality"].items()],
+        "alerts_over_time": alerts_over_time_list,
+        # Whole days, from the per-IP daily rollup
+        "top_ips": database.get_alert_counts_by_ip(range_days),
     }
 
 @app.get("/api/assets")
-async def get_assets():
-    return ASSET_INVENTORY
+async def get_assets(offset: int = 0, limit: int = 1000):
+    # Same {ip: record} shape as before, one page at a time; the total is in X-Total-Count
+    limit = max(1, min(limit, 5000))
+    offset = max(0, offset)
+    page, total = await asyncio.to_thread(lambda: (asset_store.page(offset, limit), asset_store.total()))
+    return Response(content=json.dumps(page), media_type="application/json",
+                    headers={"X-Total-Count": str(total)})
+
+@app.get("/api/assets/stats")
+async def get_asset_stats():
+    return asset_store.stats()
+
+def _encode_cursor(cursor) -> str:
+    return base64.urlsafe_b64encode(json.dumps(cursor).encode()).decode() if cursor else None
+
+def _decode_cursor(cursor: str):
+    try:
+        timestamp, alert_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return str(timestamp), int(alert_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+@app.get("/api/alerts")
+async def get_alerts(limit: int = 100, cursor: str = None, ip: str = None, reason: str = None,
+                     min_risk: int = None, start: str = None, end: str = None, fields: str = None,
+                     format: str = "json"):
+    """
+    Alert history, newest first. Pass next_cursor back as cursor for the next page.
+    fields is a comma-separated subset of database.ALERT_FIELDS; "features" is left out by default.
+    format=ndjson streams every matching alert (one JSON object per line) for exports.
+    """
+    if format not in ("json", "ndjson"):
+        raise HTTPException(status_code=400, detail=f"Unknown format: {format}")
+    selected = tuple(field.strip() for field in fields.split(",") if field.strip()) if fields \
+        else database.DEFAULT_ALERT_FIELDS
+    unknown = set(selected) - set(database.ALERT_FIELDS)
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(sorted(unknown))}")
+    filters = {"cursor": _decode_cursor(cursor) if cursor else None, "ip": ip, "reason": reason,
+               "min_risk": min_risk, "start": start, "end": end, "fields": selected}
+
+    if format == "ndjson":
+        # Plain generator: Starlette runs it in a thread pool, one chunk query at a time
+        lines = (json.dumps(alert) + "\n" for alert in database.iter_alerts(**filters))
+        return StreamingResponse(lines, media_type="application/x-ndjson")
+
+    limit = max(1, min(limit, 1000))
+    alerts, next_cursor = await asyncio.to_thread(database.query_alerts, limit, **filters)
+    return {"alerts": alerts, "next_cursor": _encode_cursor(next_cursor)}
+
+def decode_flows(body, content_type: str) -> list:
+    """Decodes ingested flows (see ingest.py) and adds GeoIP locations, like the generator does."""
+    flows = ingest.decode(body, content_type)
+    unlocated = [log_dict for log_dict, _ in flows if "location" not in log_dict]
+    if unlocated and geo_enricher.reader:
+        for log_dict, location in zip(unlocated, geo_enricher.lookup_many([log_dict["ip"] for log_dict in unlocated])):
+            log_dict["location"] = location
+    return flows
+
+def scorer_ready() -> bool:
+    """Whether flows queued now are scored by loaded models (the shards' own, when sharded)."""
+    return shard_router.is_ready() if shard_router else model_instance.is_ready()
+
+def _retry_later(retry_detail: str, status_code: int = 429, reason: str = "queue_full"):
+    INGEST_REJECTED.labels("http", reason).inc()
+    return HTTPException(status_code=status_code, detail=retry_detail,
+                         headers={"Retry-After": str(INGEST_RETRY_AFTER_S)})
+
+@app.post("/api/ingest", status_code=202)
+async def ingest_flows(request: Request):
+    """
+    Bulk flow ingestion: NDJSON or a columnar batch (see ingest.py for the layouts).
+    A batch is queued whole or not at all. When the flow queue has no room for it the
+    answer is 429 with Retry-After, and the collector sends it again later. Until the
+    models are loaded the answer is 503 with Retry-After.
+    """
+    if "http" not in FLOW_SOURCES:
+        raise HTTPException(status_code=404, detail="HTTP ingestion is disabled")
+    if not scorer_ready():
+        raise _retry_later("Models are still loading", status_code=503, reason="not_ready")
+    if flow_queue.full():
+        raise _retry_later("Flow queue is full")
+    body = await request.body()
+    try:
+        # Parsing a large batch takes a while, so keep it off the event loop
+        flows = await asyncio.to_thread(decode_flows, body, request.headers.get("content-type"))
+    except ValueError as e:
+        INGEST_REJECTED.labels("http", "invalid").inc()
+        raise HTTPException(status_code=400, detail=str(e))
+    if len(flows) > flow_queue.maxsize:
+        INGEST_REJECTED.labels("http", "too_large").inc()
+        raise HTTPException(status_code=413, detail=f"Batches are limited to {flow_queue.maxsize} flows")
+    if flow_queue.maxsize - flow_queue.qsize() < len(flows):
+        raise _retry_later(f"Flow queue has no room for {len(flows)} flows")
+    for flow in flows:
+        flow_queue.put_nowait(flow)
+    INGESTED.labels("http").inc(len(flows))
+    return {"accepted": len(flows)}
 
 class ConnectionManager:
-    """Manages active WebSocket connections."""
-    def __init__(self):
+    """
+    Manages active WebSocket connections.
+    Each connection gets a bounded send queue drained by its own writer task, so
+    broadcast() never waits on a slow client. When a queue is full the overflow
+    policy decides what happens: "drop_oldest" discards the oldest queued message,
+    "coalesce" discards the whole backlog in favour of the newest message, and
+    "disconnect" closes the lagging connection. Connections whose send fails are evicted.
+    Connections with a Subscription (see stream_protocol) get batched, filtered frames
+    from flush() instead of one frame per message. Subscriptions with a max_rate are
+    sampled as messages arrive, and get summary frames with exact counts.
+    The name labels the manager's metrics and batch frames.
+    """
+    OVERFLOW_POLICIES = ("drop_oldest", "coalesce", "disconnect")
+
+    def __init__(self, queue_size: int = 256, overflow_policy: str = "drop_oldest", name: str = None):
+        if overflow_policy not in self.OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy: {overflow_policy}")
+        self.queue_size = queue_size
+        self.overflow_policy = overflow_policy
         self.active_connections: List[WebSocket] = []
+        self.send_queues: Dict[WebSocket, asyncio.Queue] = {}
+        self.writer_tasks: Dict[WebSocket, asyncio.Task] = {}
+        self.dropped_messages = 0
+        self.name = name
+        self.subscriptions: Dict[WebSocket, Subscription] = {}
+        self.groups: Dict[tuple, tuple] = {}  # Subscription key -> (subscription, connections)
+        self.samplers: Dict[tuple, Sampler] = {}  # Subscription key -> sampler, for rate-limited groups
+        self.pending_batch: List[dict] = []  # Messages for unsampled subscriptions, sent on the next flush()
+        self._last_summary = time.monotonic()
+        self._broadcast_seconds = None
+        if name:
+            self._broadcast_seconds = BROADCAST_SECONDS.labels(name)
+            WS_CLIENTS.set_function(lambda: len(self.active_connections), name)
+            WS_DROPPED.set_function(lambda: self.dropped_messages, name)
 
-    async def connect(self, websocket: WebSocket):
+    async def connect(self, websocket: WebSocket, subscription: Subscription = None):
         await websocket.accept()
+        queue = asyncio.Queue(maxsize=self.queue_size)
         self.active_connections.append(websocket)
+        self.send_queues[websocket] = queue
+        self.writer_tasks[websocket] = asyncio.create_task(self._send_loop(websocket, queue))
+        if subscription:
+            self.subscriptions[websocket] = subscription
+            self.groups.setdefault(subscription.key, (subscription, []))[1].append(websocket)
+            if subscription.max_rate and subscription.key not in self.samplers:
+                self.samplers[subscription.key] = Sampler(subscription, WS_BATCH_INTERVAL_MS / 1000, time.monotonic())
+            self._enqueue(websocket, subscription.hello(self.name))
 
     def disconnect(self, websocket: WebSocket):
-        self.active_connections.remove(websocket)
+        # May be called both by the endpoint and by an eviction, so tolerate repeats
+        if websocket in self.active_connections:
+            self.active_connections.remove(websocket)
+        self.send_queues.pop(websocket, None)
+        subscription = self.subscriptions.pop(websocket, None)
+        if subscription:
+            connections = self.groups[subscription.key][1]
+            connections.remove(websocket)
+            if not connections:
+                del self.groups[subscription.key]
+                self.samplers.pop(subscription.key, None)
+        writer = self.writer_tasks.pop(websocket, None)
+        if writer and writer is not asyncio.current_task():
+            writer.cancel()
 
-    async def broadcast(self, message: str):
-        for connection in self.active_connections:
-            try:
-                await connection.send_text(message)
-            except Exception as e:
-                print(f"Error broadcasting to connection: {e}")
+    async def broadcast(self, message, priority: bool = False):
+        """
+        Queues a message for every legacy connection, serializing it once, and
+        keeps a copy of dict messages for the subscribed connections' next batch.
+        Priority messages (e.g. malicious flows) are never sampled away.
+        """
+        started = time.perf_counter()
+        if self.subscriptions and isinstance(message, dict):
+            # Copies are kept because callers may keep mutating the payload
+            if len(self.samplers) < len(self.groups):
+                self.pending_batch.append(dict(message))
+            for sampler in self.samplers.values():
+                if sampler.subscription.matches(message):
+                    sampler.offer(message, priority)
+        if len(self.subscriptions) < len(self.active_connections):
+            if not isinstance(message, str):
+                message = json.dumps(message)
+            for connection in list(self.active_connections):
+                if connection not in self.subscriptions:
+                    self._enqueue(connection, message)
+        if self._broadcast_seconds:
+            self._broadcast_seconds.observe(time.perf_counter() - started)
+
+    def flush(self):
+        """
+        Sends the messages broadcast since the last flush as one frame per subscription
+        group, plus a summary frame per sampled group every WS_SAMPLE_SUMMARY_S.
+        """
+        batch, self.pending_batch = self.pending_batch, []
+        now = time.monotonic()
+        send_summaries = now - self._last_summary >= WS_SAMPLE_SUMMARY_S
+        if send_summaries:
+            self._last_summary = now
+        rows = {}  # id(message) -> (fields, feature values), split only for messages that are sent
+
+        for key, (subscription, connections) in list(self.groups.items()):
+            sampler = self.samplers.get(key)
+            if sampler:
+                selected = sampler.drain(now)
+            else:
+                selected = [message for message in batch if subscription.matches(message)]
+            if selected:
+                for message in selected:
+                    if id(message) not in rows:
+                        rows[id(message)] = split_features(message)
+                frame = batch_frame(self.name, [rows[id(message)] for message in selected])
+                if sampler:
+                    frame["sampled"] = True
+                self._send_to_group(connections, encode(subscription.format, frame))
+            if sampler and send_summaries:
+                self._send_to_group(connections, encode(subscription.format, sampler.summary(self.name, now)))
+
+    def _send_to_group(self, connections: List[WebSocket], frame):
+        for connection in list(connections):
+            self._enqueue(connection, frame)
+
+    def _enqueue(self, connection: WebSocket, message):
+        queue = self.send_queues.get(connection)
+        if queue is None:
+            return
+        if queue.full():
+            if self.overflow_policy == "disconnect":
+                self.dropped_messages += queue.qsize() + 1
+                print("Disconnecting slow WebSocket client")
+                self.disconnect(connection)
+                asyncio.create_task(self._close(connection))
+                return
+            if self.overflow_policy == "coalesce":
+                while not queue.empty():
+                    queue.get_nowait()
+                    self.dropped_messages += 1
+            else:
+                queue.get_nowait()
+                self.dropped_messages += 1
+        queue.put_nowait(message)
+
+    async def _send_loop(self, connection: WebSocket, queue: asyncio.Queue):
+        try:
+            while True:
+                message = await queue.get()
+                if isinstance(message, bytes):
+                    await connection.send_bytes(message)
+                else:
+                    await connection.send_text(message)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Error broadcasting to connection: {e}")
+            self.disconnect(connection)
+
+    @staticmethod
+    async def _close(connection: WebSocket):
+        try:
+            await connection.close(code=1013)  # Try again later
+        except Exception:
+            pass
 
 # Create managers for both raw and processed alert streams
-raw_manager = ConnectionManager()
-processed_manager = ConnectionManager()
+WS_SEND_QUEUE_SIZE = int(os.getenv("WS_SEND_QUEUE_SIZE", "256"))
+WS_OVERFLOW_POLICY = os.getenv("WS_OVERFLOW_POLICY", "drop_oldest")
+raw_manager = ConnectionManager(WS_SEND_QUEUE_SIZE, WS_OVERFLOW_POLICY, name="raw")
+processed_manager = ConnectionManager(WS_SEND_QUEUE_SIZE, WS_OVERFLOW_POLICY, name="processed")
+# Clients using the batched protocol get one frame per tick
+WS_BATCH_INTERVAL_MS = int(os.getenv("WS_BATCH_INTERVAL_MS", "250"))
+# Rate-limited (max_rate) clients get exact flow counts this often
+WS_SAMPLE_SUMMARY_S = float(os.getenv("WS_SAMPLE_SUMMARY_S", "1"))
+
+async def log_generation_task():
+    """Generate logs and queue the flows for scoring (the "generator" flow source)."""
+    while True:
+        try:
+            started = time.perf_counter()
+            log_dict, feature_vector = generate_log()
+            GENERATION_SECONDS.observe(time.perf_counter() - started)
+
+            # Blocks when the scoring stage falls behind, so the queue stays bounded
+            await flow_queue.put((log_dict, feature_vector))
+
+            await asyncio.sleep(GENERATION_INTERVAL_S)
+        except Exception as e:
+            print(f"Error in log generation task: {e}")
+
+async def collect_batch(queue: asyncio.Queue, max_rows: int, max_wait_ms: int) -> list:
+    """Waits for one item, then keeps collecting until max_rows items or max_wait_ms have passed."""
+    loop = asyncio.get_running_loop()
+    batch = [await queue.get()]
+    deadline = loop.time() + max_wait_ms / 1000
+    while len(batch) < max_rows:
+        try:
+            batch.append(queue.get_nowait())
+            continue
+        except asyncio.QueueEmpty:
+            pass
+        remaining = deadline - loop.time()
+        if remaining <= 0:
+            break
+        try:
+            batch.append(await asyncio.wait_for(queue.get(), remaining))
+        except asyncio.TimeoutError:
+            break
+    return batch
 
 async def log_processing_task():
-    """Generate, classify, and broadcast logs via WebSockets."""
+    """Collect queued logs into micro-batches and hand them to the scoring pool."""
     while True:
         try:
-            log_dict, feature_df = generate_log()
+            batch = await collect_batch(flow_queue, SCORING_BATCH_SIZE, SCORING_BATCH_WAIT_MS)
+
+            if shard_router:
+                # Waits while a target shard's queue is full. Shards discover the hosts of their own IPs.
+                await shard_router.submit(batch)
+                continue
 
             # --- NEW: Asset Auto-Discovery Logic ---
-            # Check if the IP from the new log exists in our inventory.
-            # If not, add it with default "unassigned" values.
-            ip_address = log_dict.get("ip")
-            if ip_address and ip_address not in ASSET_INVENTORY:
-                ASSET_INVENTORY[ip_address] = {
-                    "owner": "Unassigned",
-                    "purpose": "Auto-Discovered Host",
-                    "criticality": "Low"
-                }
-
-            # Combine metadata and feature data into a single payload
-            feature_data_dict = feature_df.iloc[0].to_dict()
-            payload = log_dict
-            payload['features'] = feature_data_dict
-
-            # Broadcast the full payload to all connected raw clients
-            await raw_manager.broadcast(json.dumps(payload))
-            
-            # Get the detailed prediction result from the model
-            prediction_result = model_instance.is_malicious(feature_df)
-            
-            # Check the boolean flag from the result dictionary
-            if prediction_result["is_malicious"]:
-                # Add risk score, reason, and playbook to the payload
-                payload['risk_score'] = prediction_result['risk_score']
-                payload['reason'] = prediction_result['reason']
-                payload['playbook'] = prediction_result['playbook']
-                
-                # --- UPDATED: Store alert in the database ---
-                database.add_alert(payload)
-                
-                # Broadcast the enriched payload to processed clients
-                await processed_manager.broadcast(json.dumps(payload))
-            
-            await asyncio.sleep(1)
+            # Unknown IPs are recorded as "unassigned" hosts (or inherit their range's criticality)
+            for log_dict, _ in batch:
+                ip_address = log_dict.get("ip")
+                if ip_address:
+                    asset_store.discover(ip_address, log_dict.get("timestamp"))
+
+            feature_matrix = np.vstack([feature_vector for _, feature_vector in batch])
+            # Waits while the pool already has SCORING_MAX_IN_FLIGHT batches
+            await scoring_pool.submit(batch, feature_matrix)
         except Exception as e:
             print(f"Error in log processing task: {e}")
 
+async def result_delivery_task():
+    """Store and broadcast scored logs in the order their batches were submitted."""
+    async for batch, prediction_results in scoring_pool.results():
+        FLOWS_SCORED.inc(len(batch))
+        try:
+            await load_assets([log_dict['ip'] for (log_dict, _), result in zip(batch, prediction_results)
+                               if result["is_malicious"]])
+        except Exception as e:
+            print(f"Error loading assets: {e}")
+
+        # One bad flow must not cost the rest of the batch their storage and broadcast
+        for (log_dict, feature_vector), prediction_result in zip(batch, prediction_results):
+            try:
+                # Combine metadata and feature data into a single payload
+                feature_data_dict = vector_to_dict(feature_vector)
+                payload = log_dict
+                payload['features'] = feature_data_dict
+
+                # Broadcast the full payload to all connected raw clients
+                await raw_manager.broadcast(payload, priority=prediction_result["is_malicious"])
+
+                # Check the boolean flag from the result dictionary
+                if prediction_result["is_malicious"]:
+                    # Add risk score, reason, and playbook to the payload
+                    payload['risk_score'] = prediction_result['risk_score']
+                    payload['reason'] = prediction_result['reason']
+                    payload['playbook'] = prediction_result['playbook']
+
+                    # Repeats of an open (ip, reason) window are only counted
+                    if alert_aggregator and alert_aggregator.observe(payload) is None:
+                        continue
+
+                    # Criticality is resolved now and kept in the KPI rollups
+                    await deliver_alert(payload, asset_store.criticality(payload['ip'], load=False))
+            except Exception as e:
+                print(f"Error in result delivery task: {e}")
+
+async def load_assets(ips: list):
+    """Reads hosts evicted from the asset LRU back from SQLite, in one query on a thread."""
+    missing = asset_store.missing(ips)
+    if missing:
+        asset_store.remember(await asyncio.to_thread(database.get_assets_by_ip, missing))
+
+async def deliver_alert(payload: dict, criticality: str):
+    # --- UPDATED: Store alert in the database ---
+    # Never block the event loop: when the writer is behind, wait for room on a thread
+    if not database.add_alert(payload, criticality=criticality, block=False):
+        await asyncio.to_thread(database.add_alert, payload, criticality)
+    ALERTS.labels(payload['reason']).inc()
+
+    # Broadcast the enriched payload to processed clients
+    await processed_manager.broadcast(payload)
+
+async def deliver_window_event(event: dict, criticality: str):
+    """Counts the alerts a window update or summary rolled up, then broadcasts it."""
+    rolled_up = event['aggregate']['rolled_up']
+    if rolled_up:
+        # Only the window's first alert has a row; the rest still count in the KPIs
+        rolled_up_risk_sum = event['aggregate']['rolled_up_risk_sum']
+        if not database.add_rolled_up_alerts(event, rolled_up, rolled_up_risk_sum, criticality, block=False):
+            await asyncio.to_thread(database.add_rolled_up_alerts, event, rolled_up, rolled_up_risk_sum, criticality)
+        ALERTS.labels(event['reason']).inc(rolled_up)
+    await processed_manager.broadcast(event)
+
+async def shard_delivery_task():
+    """Merge stage: store and broadcast what the shards scored, in arrival order."""
+    async for result in shard_router.results():
+        FLOWS_SCORED.inc(len(result["flows"]))
+        try:
+            if result["errors"]:
+                PREDICTION_ERRORS.inc(result["errors"])
+            for row in result["assets"]:
+                database.save_asset(*row)
+        except Exception as e:
+            print(f"Error in shard delivery task: {e}")
+        # Like result_delivery_task, one bad flow must not cost the rest of the message
+        for payload, is_malicious, alert, criticality in result["flows"]:
+            try:
+                await raw_manager.broadcast(payload, priority=is_malicious)
+                if alert is not None:
+                    await deliver_alert(alert, criticality)
+            except Exception as e:
+                print(f"Error in shard delivery task: {e}")
+        # Rolled-up updates and closing summaries of the shard's alert windows
+        for event, criticality in result["events"]:
+            try:
+                await deliver_window_event(event, criticality)
+            except Exception as e:
+                print(f"Error in shard delivery task: {e}")
+
+async def stream_batch_task():
+    """Flush batched frames to subscribed WebSocket clients once per tick."""
+    while True:
+        await asyncio.sleep(WS_BATCH_INTERVAL_MS / 1000)
+        try:
+            raw_manager.flush()
+            processed_manager.flush()
+        except Exception as e:
+            print(f"Error in stream batch task: {e}")
+
+async def alert_window_task():
+    """Broadcast rolled-up updates and closing summaries for open alert windows."""
+    while True:
+        await asyncio.sleep(1)
+        try:
+            events = alert_aggregator.tick()
+            await load_assets([event['ip'] for event in events])
+            for event in events:
+                await deliver_window_event(event, asset_store.criticality(event['ip'], load=False))
+        except Exception as e:
+            print(f"Error in alert window task: {e}")
+
+async def alert_retention_task():
+    """Drop expired alert partitions once an hour, if ALERT_RETENTION_DAYS is set (init_db also does it on startup)."""
+    while True:
+        await asyncio.sleep(3600)
+        try:
+            database.prune_alerts()
+        except Exception as e:
+            print(f"Error in alert retention task: {e}")
+
+async def asset_flush_task():
+    """Write the last_seen of active hosts to SQLite, so /api/assets stays current."""
+    while True:
+        await asyncio.sleep(ASSET_FLUSH_INTERVAL_S)
+        try:
+            asset_store.flush()
+        except Exception as e:
+            print(f"Error in asset flush task: {e}")
+
 @app.on_event("startup")
 async def startup_event():
+    global flow_queue, shard_router
     database.init_db()  # Initialize the database on server start
+    # Flows are scored with whichever models are ready. Shard processes load their own,
+    # these serve /readyz and /api/scoring/stats (and the shards with SHARD_BROKER=memory).
+    model_instance.load_in_background()
+    flow_queue = asyncio.Queue(maxsize=FLOW_QUEUE_SIZE)
+    if SHARDS:
+        shard_router = ShardRouter(make_broker(SHARD_BROKER, SHARDS, SHARD_QUEUE_SIZE), SHARDS, {
+            "assets": ASSET_INVENTORY,
+            "ranges": ASSET_RANGES,
+            "max_discovered": max(1, ASSET_MAX_DISCOVERED // SHARDS),
+            "flush_interval_s": ASSET_FLUSH_INTERVAL_S,
+            "aggregation": ALERT_WINDOW_SETTINGS if ALERT_AGGREGATION else None,
+        })
+        shard_router.start()
+        asyncio.create_task(shard_delivery_task())
+    else:
+        scoring_pool.start()
+        asyncio.create_task(result_delivery_task())
+    if "generator" in FLOW_SOURCES:
+        asyncio.create_task(log_generation_task())
     asyncio.create_task(log_processing_task())
+    asyncio.create_task(stream_batch_task())
+    if alert_aggregator:
+        asyncio.create_task(alert_window_task())
+    asyncio.create_task(alert_retention_task())
+    if not SHARDS:
+        asyncio.create_task(asset_flush_task())
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    scoring_pool.shutdown()
+    asset_store.flush()
+    if shard_router:
+        shard_router.shutdown()
+    database.close()  # Commits any alerts still queued for the writer
+
+async def _subscription(websocket: WebSocket):
+    """The batched-protocol subscription from the query string, None for legacy clients, False if rejected."""
+    try:
+        return Subscription.from_query(websocket.query_params)
+    except ValueError as e:
+        print(f"Rejected WebSocket subscription: {e}")
+        await websocket.close(code=1008)  # Policy violation
+        return False
 
 @app.websocket("/ws/raw")
 async def websocket_raw_alerts(websocket: WebSocket):
-    await raw_manager.connect(websocket)
+    subscription = await _subscription(websocket)
+    if subscription is False:
+        return
+    await raw_manager.connect(websocket, subscription)
     print("Raw client connected")
     try:
         while True:
@@ -188,11 +792,62 @@ async def websocket_raw_alerts(websocket: WebSocket):
 
 @app.websocket("/ws/processed")
 async def websocket_processed_alerts(websocket: WebSocket):
-    await processed_manager.connect(websocket)
+    subscription = await _subscription(websocket)
+    if subscription is False:
+        return
+    await processed_manager.connect(websocket, subscription)
     print("Processed client connected")
     try:
         while True:
             await websocket.receive_text()
     except WebSocketDisconnect:
         processed_manager.disconnect(websocket)
-        print("Processed client disconnected")
\ No newline at end of file
+        print("Processed client disconnected")
+
+@app.websocket("/ws/ingest")
+async def websocket_ingest(websocket: WebSocket):
+    """
+    Streaming ingestion with credit-based flow control. ?format= picks the frame layout:
+    "ndjson" (default, text), "json" (columnar, text) or "msgpack" (columnar, binary).
+    The server grants credits in {"type": "credit", "credits": n} frames, INGEST_WS_CREDITS
+    once the models are loaded and then the size of each frame once its flows are queued. A client may
+    only send as many flows as it holds credits for; while the flow queue is full no
+    credit comes back, so the client has to wait.
+    """
+    content_type = INGEST_WS_FORMATS.get(websocket.query_params.get("format", "ndjson"))
+    if "websocket" not in FLOW_SOURCES or content_type is None:
+        await websocket.close(code=1008)  # Policy violation
+        return
+    await websocket.accept()
+    print("Ingest client connected")
+    try:
+        # No credits, so no flows, until they can be scored
+        while not scorer_ready():
+            await asyncio.sleep(INGEST_RETRY_AFTER_S)
+        credits = INGEST_WS_CREDITS
+        await websocket.send_json({"type": "credit", "credits": credits})
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                break
+            body = message.get("bytes") if message.get("bytes") is not None else message.get("text")
+            try:
+                flows = await asyncio.to_thread(decode_flows, body, content_type)
+            except ValueError as e:
+                INGEST_REJECTED.labels("websocket", "invalid").inc()
+                await websocket.send_json({"type": "error", "detail": str(e)})
+                continue
+            if len(flows) > credits:
+                INGEST_REJECTED.labels("websocket", "no_credit").inc()
+                await websocket.send_json({"type": "error", "detail": f"Sent {len(flows)} flows with {credits} credits"})
+                await websocket.close(code=1008)
+                break
+            credits -= len(flows)
+            for flow in flows:
+                await flow_queue.put(flow)  # Waits for room; the credit is only returned afterwards
+            INGESTED.labels("websocket").inc(len(flows))
+            credits += len(flows)
+            await websocket.send_json({"type": "credit", "credits": len(flows)})
+    except WebSocketDisconnect:
+        pass
+    print("Ingest client disconnected")
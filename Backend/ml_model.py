@@ -1,8 +1,14 @@
 import joblib
 import numpy as np
-import pandas as pd
-from tensorflow.keras.models import load_model
 import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+from features import FEATURE_INDEX, FEATURE_NAMES, as_feature_matrix
+from numpy_autoencoder import NumpyAutoencoder
+from tree_ensemble import CompiledTreeEnsemble
 
 # --- NEW: Remediation Playbooks ---
 # Maps a detection reason to a list of actionable steps for an incident responder.
@@ -34,121 +40,393 @@ REMEDIATION_PLAYBOOKS = {
     ]
 }
 
+# Detectors in scoring order: model attribute -> (reason, contribution to the risk score)
+DETECTORS = {
+    "lgb_main": ("General Malicious Pattern (LGBM)", 40),
+    "lgb_specialist": ("Potential XSS Attack (Specialist LGBM)", 70), # Higher weight for specialist model
+    "iso_forest": ("Anomalous Traffic (Isolation Forest)", 30),
+    "one_class_svm": ("Anomalous Traffic (One-Class SVM)", 30),
+    "autoencoder": ("Structural Anomaly (Autoencoder)", 50),
+}
+
+# Tree detectors that compile_trees.py can turn into CompiledTreeEnsemble arrays
+TREE_DETECTORS = ("lgb_main", "lgb_specialist", "iso_forest")
+
+# Falling back to a pickle imports its library; one loader thread at a time does that
+_PICKLE_FALLBACK_LOCK = threading.Lock()
+
+# Risk scores are capped at this value
+RISK_SCORE_CAP = 100
+
+SCORING_MODES = ("full", "cascade")
+
+# Recorded in the process that scores; with SCORING_EXECUTOR=process that is the worker, not the server
+DETECTOR_SECONDS = metrics.Histogram("detector_batch_seconds", "Time spent in one detector per scored batch",
+                                     ("detector",))
+PREDICTION_ERRORS = metrics.Counter("prediction_errors_total", "Batches that failed to score")
+
 class AnomalyModel:
     def __init__(self, 
                  lgb_main_path="lgb_main_smote_weighted.pkl",
                  lgb_specialist_path="lgb_specialist_Web_Attack_-_XSS.pkl",
                  iso_forest_path="isolation_forest.pkl",
                  one_class_svm_path="one_class_svm.pkl",
-                 autoencoder_path="autoencoder_anomaly_model.h5",
+                 autoencoder_path="autoencoder_anomaly_model.npz",
                  scaler_path="scaler.pkl",
                  label_encoder_path="label_encoder.pkl",
-                 autoencoder_threshold=0.0001):  # Placeholder, adjust after computing
+                 autoencoder_threshold=0.0001,  # Placeholder, adjust after computing
+                 scoring_mode="full",
+                 cascade_screen=True,
+                 screen_cost_fraction=0.25,
+                 compiled_trees=("iso_forest",)):
+        """
+            Only records where the artifacts live. Call load() or load_in_background()
+            to read them; until then every model attribute is None.
+
+            scoring_mode "full" runs every detector on every flow (use it for audits).
+            "cascade" runs detectors cheapest first and stops scoring a flow once its
+            risk score reaches the cap. With cascade_screen, detectors costing at most
+            screen_cost_fraction of the most expensive one act as a screen: only flows
+            they flag are passed on to the expensive detectors.
+
+            compiled_trees names the tree detectors to evaluate from their compiled
+            arrays (see compile_trees.py) rather than their pickles.
+        """
+        if scoring_mode not in SCORING_MODES:
+            raise ValueError(f"Unknown scoring mode: {scoring_mode}")
+        unknown = set(compiled_trees) - set(TREE_DETECTORS)
+        if unknown:
+            raise ValueError(f"Not a tree detector: {', '.join(sorted(unknown))}")
+        self.compiled_trees = tuple(compiled_trees)
+        tree_loader = {name: load_tree_model if name in self.compiled_trees else joblib.load for name in TREE_DETECTORS}
         base_dir = os.path.dirname(os.path.abspath(__file__))
+        # Weights for the autoencoder are exported from the Keras .h5 model by export_autoencoder.py
+        self.artifacts = {
+            "lgb_main": (os.path.join(base_dir, lgb_main_path), tree_loader["lgb_main"]),
+            "lgb_specialist": (os.path.join(base_dir, lgb_specialist_path), tree_loader["lgb_specialist"]),
+            "iso_forest": (os.path.join(base_dir, iso_forest_path), tree_loader["iso_forest"]),
+            "one_class_svm": (os.path.join(base_dir, one_class_svm_path), joblib.load),
+            "autoencoder": (os.path.join(base_dir, autoencoder_path), NumpyAutoencoder.load),
+            "scaler": (os.path.join(base_dir, scaler_path), joblib.load),
+            "label_encoder": (os.path.join(base_dir, label_encoder_path), joblib.load),
+        }
+        self.autoencoder_threshold = autoencoder_threshold
+        self.scoring_mode = scoring_mode
+        self.cascade_screen = cascade_screen
+        self.screen_cost_fraction = screen_cost_fraction
+        # Seconds per row for each detector; calibrated after loading, then tracked during cascades
+        self.detector_costs = {name: None for name in DETECTORS}
+        self.cascade_stats = {name: {"rows_scored": 0, "rows_skipped": 0} for name in DETECTORS}
+        self.cascade_stats["screened_out"] = 0
+        self.cascade_stats["short_circuited"] = 0
+        self._stats_lock = threading.Lock()
+        self.benign_label = None
+        self.feature_order = None  # Column permutation into the scaler's order, if it differs
+        self.minmax = None  # (scale, offset, clip range) when the scaler is a MinMaxScaler
+        self.load_state = {name: {"state": "pending", "seconds": None, "error": None} for name in self.artifacts}
+        for name in self.artifacts:
+            setattr(self, name, None)
+
+    def _load_artifact(self, name: str):
+        path, loader = self.artifacts[name]
+        state = self.load_state[name]
+        state["state"] = "loading"
+        started = time.perf_counter()
         try:
-            self.lgb_main = joblib.load(os.path.join(base_dir, lgb_main_path))
-            self.lgb_specialist = joblib.load(os.path.join(base_dir, lgb_specialist_path))
-            self.iso_forest = joblib.load(os.path.join(base_dir, iso_forest_path))
-            self.one_class_svm = joblib.load(os.path.join(base_dir, one_class_svm_path))
-            self.autoencoder = load_model(os.path.join(base_dir, autoencoder_path), compile=False)
-            self.scaler = joblib.load(os.path.join(base_dir, scaler_path))
-            self.label_encoder = joblib.load(os.path.join(base_dir, label_encoder_path))
-            self.autoencoder_threshold = autoencoder_threshold
-            print("Successfully loaded all models and preprocessors.")
+            artifact = loader(path)
+            if name == "label_encoder":
+                self.benign_label = artifact.transform(['Benign'])[0]
+            elif name == "scaler":
+                self._prepare_scaler(artifact)
+            setattr(self, name, artifact)
+            state["state"] = "ready"
         except Exception as e:
-            print(f"Error loading model files: {e}")
-            self.lgb_main = None
-            self.lgb_specialist = None
-            self.iso_forest = None
-            self.one_class_svm = None
-            self.autoencoder = None
-            self.scaler = None
-            self.label_encoder = None
-
-    def is_malicious(self, feature_df: pd.DataFrame) -> dict:
+            print(f"Error loading model file {path}: {e}")
+            state["state"] = "failed"
+            state["error"] = str(e)
+        state["seconds"] = round(time.perf_counter() - started, 3)
+
+    def load(self, max_workers: int = None) -> bool:
+        """Loads all artifacts concurrently and blocks until done. Returns True if all loaded."""
+        # Import the libraries the pickles reference before fanning out: first-time
+        # imports racing across loader threads can deadlock on the module locks.
+        # Compiled tree detectors do not need theirs.
+        import sklearn.preprocessing, sklearn.svm  # noqa: F401
+        if {"lgb_main", "lgb_specialist"} - set(self.compiled_trees):
+            import lightgbm  # noqa: F401
+        if "iso_forest" not in self.compiled_trees:
+            import sklearn.ensemble  # noqa: F401
+        with ThreadPoolExecutor(max_workers=max_workers or len(self.artifacts),
+                                thread_name_prefix="model-loader") as executor:
+            list(executor.map(self._load_artifact, self.artifacts))
+        failed = [name for name, state in self.load_state.items() if state["state"] == "failed"]
+        if failed:
+            print(f"Models failed to load: {', '.join(failed)}")
+        else:
+            print("Successfully loaded all models and preprocessors.")
+        self.calibrate_costs()
+        return not failed
+
+    def calibrate_costs(self, rows: int = 256):
+        """Times each loaded detector on synthetic scaled rows to seed the cascade order."""
+        X = np.random.default_rng(0).random((rows, len(FEATURE_NAMES)))
+        for name in DETECTORS:
+            if self._detector_ready(name):
+                started = time.perf_counter()
+                getattr(self, f"_flag_{name}")(X)
+                self.detector_costs[name] = (time.perf_counter() - started) / rows
+
+    def load_in_background(self) -> threading.Thread:
+        """Starts load() on a daemon thread so startup does not wait for the artifacts."""
+        thread = threading.Thread(target=self.load, name="model-loader", daemon=True)
+        thread.start()
+        return thread
+
+    def _prepare_scaler(self, scaler):
+        """
+            Validates the scaler's columns against FEATURE_NAMES once, at load time,
+            so scoring only has to check the matrix shape.
+        """
+        expected = list(getattr(scaler, "feature_names_in_", FEATURE_NAMES))
+        if sorted(expected) != sorted(FEATURE_NAMES):
+            raise ValueError("Feature names do not match scaler's expectations")
+        if expected != FEATURE_NAMES:
+            self.feature_order = np.array([FEATURE_INDEX[name] for name in expected])
+        # MinMaxScaler is a per-column affine map; applying it directly skips
+        # sklearn's per-call input validation.
+        if hasattr(scaler, "data_min_"):
+            clip_range = scaler.feature_range if scaler.clip else None
+            self.minmax = (scaler.scale_, scaler.min_, clip_range)
+
+    def _scale(self, X: np.ndarray) -> np.ndarray:
+        """Scales a FEATURE_NAMES-ordered matrix into the columns the models were trained on."""
+        if self.feature_order is not None:
+            X = X[:, self.feature_order]
+        if self.minmax is None:
+            return self.scaler.transform(X)
+        scale, offset, clip_range = self.minmax
+        X_scaled = X * scale
+        X_scaled += offset
+        if clip_range is not None:
+            np.clip(X_scaled, clip_range[0], clip_range[1], out=X_scaled)
+        return X_scaled
+
+    def is_ready(self) -> bool:
+        """Flows can be scored once the scaler and at least one detector are loaded."""
+        return self.scaler is not None and any(self._detector_ready(name) for name in DETECTORS)
+
+    def _detector_ready(self, name: str) -> bool:
+        if name == "lgb_main":
+            return self.lgb_main is not None and self.benign_label is not None
+        return getattr(self, name) is not None
+
+    def status(self) -> dict:
+        """Per-artifact load state and timings, plus the overall readiness."""
+        return {
+            "ready": self.is_ready(),
+            "degraded": any(state["state"] != "ready" for state in self.load_state.values()),
+            "models": {name: dict(state) for name, state in self.load_state.items()},
+        }
+
+    def is_malicious(self, features) -> dict:
         """
-            Predicts if a feature DataFrame is malicious using all models.
+            Predicts if a single flow's feature vector is malicious using all models.
             Returns a dictionary with the prediction, risk score, and reason.
         """
-        if any(model is None for model in [self.lgb_main, self.lgb_specialist, 
-                                         self.iso_forest, self.one_class_svm, 
-                                         self.autoencoder, self.scaler, self.label_encoder]):
-            print("One or more models failed to load.")
-            return {"is_malicious": False, "risk_score": 0, "reason": "Models not loaded"}
+        return self.is_malicious_batch(features)[0]
 
-        try:
-            # Validate feature count and names
-            expected_features = 77
-            if feature_df.shape[1] != expected_features:
-                raise ValueError(f"Expected {expected_features} features, got {feature_df.shape[1]}")
-            if not all(col in feature_df.columns for col in self.scaler.feature_names_in_):
-                raise ValueError("Feature names do not match scaler's expectations")
+    def is_malicious_batch(self, features, mode: str = None) -> list:
+        """
+            Predicts a whole batch of flows with one call per model.
+            Accepts an (n, 77) array in FEATURE_NAMES order, a single feature vector,
+            or a DataFrame with the named columns. mode overrides the scoring mode
+            ("full" or "cascade") for this call.
+            Returns one result dictionary per row, in input order.
+        """
+        n_rows = 1 if np.ndim(features) == 1 else len(features)
+        if n_rows == 0:
+            return []
 
-            # Scale features
-            X_scaled = self.scaler.transform(feature_df)
+        if not self.is_ready():
+            return [{"is_malicious": False, "risk_score": 0, "reason": "Models not loaded"} for _ in range(n_rows)]
 
-            reasons = []
-            risk_score = 0
+        try:
+            # Column names were validated against the scaler at load time
+            X_scaled = self._scale(as_feature_matrix(features))
 
             # --- Model Predictions ---
-            # Each model contributes to the risk score and adds a reason if it flags the traffic.
-
-            # Predict with LightGBM main (multiclass)
-            y_pred_prob = self.lgb_main.predict(X_scaled)
-            y_pred_labels = np.argmax(y_pred_prob, axis=1)
-            benign_label = self.label_encoder.transform(['Benign'])[0]
-            if y_pred_labels[0] != benign_label:
-                reasons.append("General Malicious Pattern (LGBM)")
-                risk_score += 40
-
-            # Predict with LightGBM specialist (Web Attack - XSS)
-            y_pred_spec = self.lgb_specialist.predict(X_scaled)
-            if y_pred_spec[0] > 0.5:
-                reasons.append("Potential XSS Attack (Specialist LGBM)")
-                risk_score += 70 # Higher weight for specialist model
-
-            # Predict with Isolation Forest
-            if self.iso_forest.predict(X_scaled)[0] == -1:
-                reasons.append("Anomalous Traffic (Isolation Forest)")
-                risk_score += 30
-
-            # Predict with One-Class SVM
-            if self.one_class_svm.predict(X_scaled)[0] == -1:
-                reasons.append("Anomalous Traffic (One-Class SVM)")
-                risk_score += 30
-
-            # Predict with Autoencoder
-            reconstructions = self.autoencoder.predict(X_scaled, verbose=0)
-            mse = np.mean(np.power(X_scaled - reconstructions, 2), axis=1)
-            if mse[0] > self.autoencoder_threshold:
-                reasons.append("Structural Anomaly (Autoencoder)")
-                risk_score += 50
+            # Each model yields a boolean mask over the batch; every flagged row gets the
+            # model's reason and its contribution to the risk score.
+            # Models that are still loading (or failed to load) are skipped.
+            if (mode or self.scoring_mode) == "cascade":
+                flags = self._cascade(X_scaled)
+            else:
+                flags = []
+                for name, (reason, weight) in DETECTORS.items():
+                    if self._detector_ready(name):
+                        flags.append((reason, weight, self._run_detector(name, X_scaled)))
 
             # --- Final Decision ---
-            is_malicious_flag = len(reasons) > 0
-            
-            if not is_malicious_flag:
-                return {"is_malicious": False, "risk_score": 0, "reason": "Benign", "playbook": []}
-
-            # Combine reasons and look up playbooks
-            final_reason = ", ".join(reasons)
-            playbook = []
-            for reason in reasons:
-                if reason in REMEDIATION_PLAYBOOKS:
-                    playbook.extend(REMEDIATION_PLAYBOOKS[reason])
-
-            return {
-                "is_malicious": True,
-                "risk_score": min(risk_score, 100),
-                "reason": final_reason,
-                "playbook": list(dict.fromkeys(playbook)) # Get unique playbook steps
-            }
+            results = []
+            for row in range(n_rows):
+                reasons = [reason for reason, _, mask in flags if mask[row]]
+                risk_score = sum(weight for _, weight, mask in flags if mask[row])
+                results.append(_build_result(reasons, risk_score))
+            return results
         except Exception as e:
             print(f"Error during prediction: {e}")
-            return {"is_malicious": False, "risk_score": 0, "reason": f"Prediction Error: {e}", "playbook": []}
+            PREDICTION_ERRORS.inc()
+            return [{"is_malicious": False, "risk_score": 0, "reason": f"Prediction Error: {e}", "playbook": []}
+                    for _ in range(n_rows)]
+
+    # --- Cascade scoring ---
+
+    def cascade_order(self) -> tuple:
+        """Returns (screen detectors, remaining detectors), each ordered cheapest first."""
+        ready = [name for name in DETECTORS if self._detector_ready(name)]
+        # Detectors not yet timed sort last
+        ready.sort(key=lambda name: self.detector_costs[name] if self.detector_costs[name] is not None else float("inf"))
+        if not self.cascade_screen:
+            return [], ready
+        known_costs = [self.detector_costs[name] for name in ready if self.detector_costs[name] is not None]
+        if not known_costs:
+            return [], ready
+        limit = max(known_costs) * self.screen_cost_fraction
+        screen = [name for name in ready
+                  if self.detector_costs[name] is not None and self.detector_costs[name] <= limit]
+        return screen, [name for name in ready if name not in screen]
+
+    def _cascade(self, X_scaled):
+        """
+            Runs detectors cheapest first on the rows that are still undecided.
+            A row drops out once its risk score reaches the cap, and, with the screen
+            enabled, after the screen stage unless a screen detector flagged it.
+            Returns the same (reason, weight, mask) list as the full ensemble.
+        """
+        n_rows = len(X_scaled)
+        screen, remaining = self.cascade_order()
+        risk_scores = np.zeros(n_rows, dtype=int)
+        active = np.ones(n_rows, dtype=bool)
+        screen_hits = np.zeros(n_rows, dtype=bool)
+        masks = {}
+        screened_out = 0
+        for stage, name in enumerate(screen + remaining):
+            if screen and stage == len(screen):
+                # Cheap screen: only flagged rows go on to the expensive detectors
+                screened_out = int(np.count_nonzero(active & ~screen_hits))
+                active &= screen_hits
+            rows = np.flatnonzero(active)
+            mask = np.zeros(n_rows, dtype=bool)
+            if len(rows):
+                started = time.perf_counter()
+                mask[rows] = self._run_detector(name, X_scaled[rows])
+                cost = (time.perf_counter() - started) / len(rows)
+                previous = self.detector_costs[name]
+                self.detector_costs[name] = cost if previous is None else 0.9 * previous + 0.1 * cost
+            masks[name] = mask
+            with self._stats_lock:
+                self.cascade_stats[name]["rows_scored"] += len(rows)
+                self.cascade_stats[name]["rows_skipped"] += n_rows - len(rows)
+            if name in screen:
+                screen_hits |= mask
+            risk_scores += DETECTORS[name][1] * mask
+            active &= risk_scores < RISK_SCORE_CAP
+
+        with self._stats_lock:
+            self.cascade_stats["screened_out"] += screened_out
+            self.cascade_stats["short_circuited"] += int(np.count_nonzero(risk_scores >= RISK_SCORE_CAP))
+        # Report reasons in the usual detector order, whatever order they ran in
+        return [(reason, weight, masks[name]) for name, (reason, weight) in DETECTORS.items() if name in masks]
+
+    def scoring_report(self) -> dict:
+        """Scoring mode, cascade order, measured per-row costs and per-stage skip counters."""
+        screen, remaining = self.cascade_order()
+        with self._stats_lock:
+            stats = {name: dict(value) if isinstance(value, dict) else value
+                     for name, value in self.cascade_stats.items()}
+        return {
+            "mode": self.scoring_mode,
+            "screen": screen,
+            "order": screen + remaining,
+            "cost_us_per_row": {name: round(cost * 1e6, 2) for name, cost in self.detector_costs.items()
+                                if cost is not None},
+            "stages": stats,
+        }
+
+    # --- Model Predictions ---
+    # One method per detector, each returning a boolean mask of flagged rows.
+
+    def _run_detector(self, name: str, X_scaled):
+        started = time.perf_counter()
+        mask = getattr(self, f"_flag_{name}")(X_scaled)
+        DETECTOR_SECONDS.labels(name).observe(time.perf_counter() - started)
+        return mask
+
+    def _flag_lgb_main(self, X_scaled):
+        # LightGBM main (multiclass)
+        y_pred_labels = np.argmax(self.lgb_main.predict(X_scaled), axis=1)
+        return y_pred_labels != self.benign_label
+
+    def _flag_lgb_specialist(self, X_scaled):
+        # LightGBM specialist (Web Attack - XSS)
+        return self.lgb_specialist.predict(X_scaled) > 0.5
+
+    def _flag_iso_forest(self, X_scaled):
+        return self.iso_forest.predict(X_scaled) == -1
+
+    def _flag_one_class_svm(self, X_scaled):
+        return self.one_class_svm.predict(X_scaled) == -1
+
+    def _flag_autoencoder(self, X_scaled):
+        reconstructions = self.autoencoder.predict(X_scaled)
+        mse = np.mean(np.power(X_scaled - reconstructions, 2), axis=1)
+        return mse > self.autoencoder_threshold
+
+def load_tree_model(path: str):
+    """
+        Loads the compiled arrays of a pickled tree model, memory-mapped. Falls back to
+        the pickle while they are missing or were compiled from a different pickle.
+    """
+    directory = CompiledTreeEnsemble.path_for(path)
+    if os.path.isdir(directory):
+        ensemble = CompiledTreeEnsemble.load(directory)
+        if not os.path.exists(path) or ensemble.compiled_from(path):
+            return ensemble
+        print(f"{directory} is out of date with {path}; loading the pickle. Rerun compile_trees.py.")
+    with _PICKLE_FALLBACK_LOCK:
+        return joblib.load(path)
+
+def _build_result(reasons: list, risk_score: int) -> dict:
+    """Turns the reasons raised for a single flow into the prediction dictionary."""
+    if not reasons:
+        return {"is_malicious": False, "risk_score": 0, "reason": "Benign", "playbook": []}
+
+    # Combine reasons and look up playbooks
+    final_reason = ", ".join(reasons)
+    playbook = []
+    for reason in reasons:
+        if reason in REMEDIATION_PLAYBOOKS:
+            playbook.extend(REMEDIATION_PLAYBOOKS[reason])
+
+    return {
+        "is_malicious": True,
+        "risk_score": min(risk_score, RISK_SCORE_CAP),
+        "reason": final_reason,
+        "playbook": list(dict.fromkeys(playbook)) # Get unique playbook steps
+    }
 
-# Create a single instance of the model
+# Create a single instance of the model. Artifacts are not read here: the server
+# calls load_in_background() on startup and each scoring worker calls load().
 # TODO: Compute threshold dynamically or load from training
 # We increase the threshold to a more realistic value to avoid false positives.
 # A value of 0.1 is a better starting point than 0.0001.
-model_instance = AnomalyModel(autoencoder_threshold=0.01)
\ No newline at end of file
+# SCORING_MODE=cascade trades complete reason lists for lower CPU per flow.
+# COMPILED_TREES lists the tree detectors scored from their compiled arrays ("none" for
+# none). The IsolationForest is much faster compiled; LightGBM's own predict() beats
+# the array kernel, so compile the boosters only to drop LightGBM or share their memory.
+COMPILED_TREES = os.getenv("COMPILED_TREES", "iso_forest")
+model_instance = AnomalyModel(autoencoder_threshold=0.01,
+                              scoring_mode=os.getenv("SCORING_MODE", "full"),
+                              cascade_screen=os.getenv("CASCADE_SCREEN", "1") == "1",
+                              compiled_trees=[name.strip() for name in COMPILED_TREES.split(",")
+                                              if name.strip() and name.strip() != "none"])
\ No newline at end of file
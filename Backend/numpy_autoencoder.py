@@ -0,0 +1,47 @@
+import numpy as np
+
+# Activations supported by the exported Dense layers
+ACTIVATIONS = {
+    "linear": lambda x: x,
+    "relu": lambda x: np.maximum(x, 0),
+    "sigmoid": lambda x: 1 / (1 + np.exp(-x)),
+    "tanh": np.tanh,
+}
+
+class NumpyAutoencoder:
+    """
+        Pure-NumPy forward pass for the dense autoencoder.
+        The weights are exported once from the Keras .h5 model with export_autoencoder.py,
+        so TensorFlow is not needed at inference time.
+    """
+    def __init__(self, layers):
+        # layers: list of (kernel, bias, activation name), applied in order
+        for _, _, activation in layers:
+            if activation not in ACTIVATIONS:
+                raise ValueError(f"Unsupported activation: {activation}")
+        self.layers = layers
+
+    @classmethod
+    def load(cls, path: str) -> "NumpyAutoencoder":
+        """Loads weights written by export_autoencoder.py."""
+        with np.load(path) as data:
+            activations = [str(a) for a in data["activations"]]
+            layers = [
+                (data[f"kernel_{i}"], data[f"bias_{i}"], activation)
+                for i, activation in enumerate(activations)
+            ]
+        return cls(layers)
+
+    def save(self, path: str):
+        arrays = {"activations": np.array([activation for _, _, activation in self.layers])}
+        for i, (kernel, bias, _) in enumerate(self.layers):
+            arrays[f"kernel_{i}"] = kernel
+            arrays[f"bias_{i}"] = bias
+        np.savez(path, **arrays)
+
+    def predict(self, X) -> np.ndarray:
+        """Returns the reconstruction of X, computed in float32 like the Keras model."""
+        output = np.asarray(X, dtype=np.float32)
+        for kernel, bias, activation in self.layers:
+            output = ACTIVATIONS[activation](output @ kernel + bias)
+        return output
@@ -0,0 +1,191 @@
+"""
+Scores a CSV or Parquet file of flows offline with the full model ensemble.
+
+The input needs the 77 FEATURE_NAMES columns (CIC-IDS style; surrounding spaces in
+header names are ignored). It is read in fixed-size chunks, which are scored in
+parallel by worker processes that each load the models once. For every input row,
+the output CSV gets the row number, is_malicious, risk_score and reason. Memory stays
+bounded by chunk_size * max_in_flight rows.
+
+Progress is checkpointed after every chunk written. After an interruption, run the
+same command with --resume to continue from the last finished chunk.
+
+    python score_flows.py flows.csv --output scores.csv
+    python score_flows.py flows.parquet --output scores.csv --chunk-size 100000 --workers 8 --resume
+
+Parquet input needs pyarrow (pip install pyarrow).
+"""
+import argparse
+import csv
+import json
+import multiprocessing
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+import pandas as pd
+
+from features import FEATURE_DTYPE, FEATURE_NAMES
+from scoring_pool import _init_worker, _score_in_worker
+
+OUTPUT_COLUMNS = ["row", "is_malicious", "risk_score", "reason"]
+SKIPPED_RESULT = {"is_malicious": False, "risk_score": 0, "reason": "Skipped: non-finite features"}
+
+# --- Input ---
+
+def _column_map(columns) -> dict:
+    """Maps each FEATURE_NAMES entry to the input's column name, ignoring surrounding spaces."""
+    stripped = {str(column).strip(): column for column in columns}
+    missing = [name for name in FEATURE_NAMES if name not in stripped]
+    if missing:
+        raise SystemExit(f"Input is missing {len(missing)} feature columns, e.g. {missing[:5]}")
+    return {name: stripped[name] for name in FEATURE_NAMES}
+
+def read_chunks(path: str, chunk_size: int, skip_rows: int = 0):
+    """Yields DataFrames of up to chunk_size rows with exactly the FEATURE_NAMES columns, in order."""
+    if path.lower().endswith((".parquet", ".pq")):
+        try:
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise SystemExit("Reading Parquet needs pyarrow: pip install pyarrow")
+        parquet_file = pq.ParquetFile(path)
+        columns = _column_map(parquet_file.schema_arrow.names)
+        skipped = 0
+        for batch in parquet_file.iter_batches(batch_size=chunk_size, columns=list(columns.values())):
+            if skipped < skip_rows:
+                skipped += batch.num_rows  # Chunks line up because batch_size is unchanged
+                continue
+            yield batch.to_pandas().rename(columns={v: k for k, v in columns.items()})[FEATURE_NAMES]
+    else:
+        columns = _column_map(pd.read_csv(path, nrows=0).columns)
+        reader = pd.read_csv(path, usecols=list(columns.values()), chunksize=chunk_size,
+                             skiprows=range(1, skip_rows + 1))
+        for chunk in reader:
+            yield chunk.rename(columns={v: k for k, v in columns.items()})[FEATURE_NAMES]
+
+def count_rows(path: str):
+    """Total rows for Parquet input (from the footer), None for CSV."""
+    if path.lower().endswith((".parquet", ".pq")):
+        try:
+            import pyarrow.parquet as pq
+        except ImportError:
+            return None
+        return pq.ParquetFile(path).metadata.num_rows
+    return None
+
+# --- Scoring ---
+
+def score_chunk(feature_matrix: np.ndarray) -> list:
+    """
+    Runs in a worker process. Every detector scores every row, whatever SCORING_MODE
+    says. Rows with NaN or infinite values, which training dropped, are not scored
+    and get SKIPPED_RESULT.
+    """
+    finite = np.isfinite(feature_matrix).all(axis=1)
+    if finite.all():
+        return _score_in_worker(feature_matrix, mode="full")
+    results = [SKIPPED_RESULT] * len(feature_matrix)
+    if finite.any():
+        for row, result in zip(np.flatnonzero(finite), _score_in_worker(feature_matrix[finite], mode="full")):
+            results[row] = result
+    return results
+
+# --- Checkpoint ---
+
+def load_checkpoint(path: str) -> dict:
+    with open(path) as f:
+        return json.load(f)
+
+def save_checkpoint(path: str, state: dict):
+    # Write then rename, so a crash never leaves a half-written checkpoint
+    with open(path + ".tmp", "w") as f:
+        json.dump(state, f)
+    os.replace(path + ".tmp", path)
+
+def run(input_path: str, output_path: str, chunk_size: int, workers: int, max_in_flight: int, resume: bool):
+    checkpoint_path = output_path + ".checkpoint"
+    state = {"input": os.path.abspath(input_path), "chunk_size": chunk_size,
+             "chunks_done": 0, "rows_done": 0, "flagged": 0, "output_bytes": 0}
+    if resume and os.path.exists(checkpoint_path):
+        saved = load_checkpoint(checkpoint_path)
+        if saved["input"] != state["input"] or saved["chunk_size"] != chunk_size:
+            raise SystemExit("Checkpoint was made for a different input or chunk size")
+        state = saved
+        written = os.path.getsize(output_path) if os.path.exists(output_path) else None
+        if written is None or written < state["output_bytes"]:
+            raise SystemExit(f"{output_path} is missing or shorter than the checkpoint says "
+                             f"({state['output_bytes']:,} bytes); delete {checkpoint_path} to start over")
+        print(f"Resuming after chunk {state['chunks_done']} ({state['rows_done']:,} rows)")
+
+    # Drop anything written after the last checkpoint
+    output = open(output_path, "r+" if state["output_bytes"] else "w", newline="")
+    output.truncate(state["output_bytes"])
+    output.seek(state["output_bytes"])
+    writer = csv.writer(output)
+    if not state["output_bytes"]:
+        writer.writerow(OUTPUT_COLUMNS)
+
+    total_rows = count_rows(input_path)
+    started = time.monotonic()
+    rows_this_run = 0
+
+    def write(first_row: int, results: list):
+        nonlocal rows_this_run
+        for offset, result in enumerate(results):
+            writer.writerow([first_row + offset, int(result["is_malicious"]), result["risk_score"], result["reason"]])
+        output.flush()
+        state["chunks_done"] += 1
+        state["rows_done"] += len(results)
+        state["flagged"] += sum(1 for result in results if result["is_malicious"])
+        state["output_bytes"] = output.tell()
+        save_checkpoint(checkpoint_path, state)
+
+        rows_this_run += len(results)
+        rate = rows_this_run / max(time.monotonic() - started, 1e-9)
+        progress = f"{state['rows_done']:,}"
+        if total_rows:
+            progress += f"/{total_rows:,} ({state['rows_done'] / total_rows:.1%}, " \
+                        f"ETA {(total_rows - state['rows_done']) / rate:,.0f}s)"
+        print(f"Chunk {state['chunks_done']}: {progress} rows, {rate:,.0f} rows/s, {state['flagged']:,} flagged")
+
+    # Chunks are written in input order; at most max_in_flight are read ahead of the writer
+    pending = deque()
+    next_row = state["rows_done"]
+    # Every worker needs the whole ensemble; one that cannot load it aborts the run
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                             initializer=_init_worker, initargs=(True,)) as executor:
+        for chunk in read_chunks(input_path, chunk_size, skip_rows=state["rows_done"]):
+            if len(pending) >= max_in_flight:
+                write(*_result(pending.popleft()))
+            matrix = chunk.to_numpy(dtype=FEATURE_DTYPE)
+            pending.append((next_row, executor.submit(score_chunk, matrix)))
+            next_row += len(matrix)
+        while pending:
+            write(*_result(pending.popleft()))
+    output.close()
+
+    elapsed = time.monotonic() - started
+    print(f"Scored {state['rows_done']:,} rows ({state['flagged']:,} flagged) into {output_path} in {elapsed:,.1f}s")
+    os.remove(checkpoint_path)
+
+def _result(entry):
+    first_row, future = entry
+    try:
+        return first_row, future.result()
+    except BrokenProcessPool:
+        raise SystemExit("A scoring worker failed to load the models (see its error above); "
+                         "rerun with --resume once they are in place")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("input", help="CSV or Parquet file with the FEATURE_NAMES columns")
+    parser.add_argument("--output", required=True, help="CSV file to write per-row results to")
+    parser.add_argument("--chunk-size", type=int, default=50_000)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--max-in-flight", type=int, default=None, help="Chunks read ahead (default: 2 per worker)")
+    parser.add_argument("--resume", action="store_true", help="Continue from the last finished chunk")
+    args = parser.parse_args()
+    run(args.input, args.output, args.chunk_size, args.workers, args.max_in_flight or 2 * args.workers, args.resume)
@@ -0,0 +1,107 @@
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from ml_model import PREDICTION_ERRORS
+
+# --- Per-process model handle for the process pool ---
+# Each worker process loads its own AnomalyModel once, in the pool initializer.
+_worker_model = None
+
+def _init_worker(require_all: bool = False):
+    """
+        Loads the models once per worker process. Raises, which breaks the pool, if no
+        detector could be loaded, or with require_all if any artifact failed to load.
+    """
+    global _worker_model
+    from ml_model import model_instance
+    loaded = model_instance.load()
+    if not model_instance.is_ready() or (require_all and not loaded):
+        failed = [name for name, state in model_instance.load_state.items() if state["state"] == "failed"]
+        raise RuntimeError(f"Scoring worker could not load its models: {', '.join(failed)}")
+    _worker_model = model_instance
+
+def _score_in_worker(feature_matrix, mode: str = None):
+    """Scores a batch with the worker's preloaded model; mode overrides its scoring mode."""
+    return _worker_model.is_malicious_batch(feature_matrix, mode=mode)
+
+
+class ScoringPool:
+    """
+        Runs model inference off the asyncio event loop.
+        mode="thread" shares the already loaded model across a thread pool,
+        mode="process" starts worker processes that each preload their own models.
+        At most max_in_flight batches are scored at once, and results are
+        delivered in the order the batches were submitted.
+    """
+    def __init__(self, model, mode: str = "thread", workers: int = 2, max_in_flight: int = 4):
+        if mode not in ("thread", "process"):
+            raise ValueError(f"Unknown scoring executor mode: {mode}")
+        self.model = model
+        self.mode = mode
+        self.workers = workers
+        self.max_in_flight = max_in_flight
+        self._executor = None
+        self._slots = None
+        self._pending = None
+        self._in_flight = 0
+
+    def start(self):
+        """Creates the executor. Must be called from the running event loop."""
+        if self.mode == "process":
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+            )
+        else:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="scoring")
+        self._slots = asyncio.Semaphore(self.max_in_flight)
+        self._pending = asyncio.Queue()
+
+    async def submit(self, context, feature_matrix):
+        """
+            Dispatches a batch for scoring. Waits while max_in_flight batches are
+            already being scored, which pushes back on the batching stage.
+            The context is handed back untouched alongside the results.
+        """
+        await self._slots.acquire()
+        self._in_flight += 1
+        loop = asyncio.get_running_loop()
+        try:
+            if self.mode == "process":
+                future = loop.run_in_executor(self._executor, _score_in_worker, feature_matrix)
+            else:
+                future = loop.run_in_executor(self._executor, self.model.is_malicious_batch, feature_matrix)
+        except Exception:
+            # E.g. BrokenProcessPool: the batch never reaches results(), so give its slot back here
+            self._in_flight -= 1
+            self._slots.release()
+            PREDICTION_ERRORS.inc()
+            raise
+        await self._pending.put((context, future))
+
+    async def results(self):
+        """Yields (context, results) pairs in submission order."""
+        while True:
+            context, future = await self._pending.get()
+            try:
+                results = await future
+            except Exception as e:
+                print(f"Error in scoring worker: {e}")
+                PREDICTION_ERRORS.inc()
+                results = [{"is_malicious": False, "risk_score": 0, "reason": f"Prediction Error: {e}", "playbook": []}
+                           for _ in context]
+            finally:
+                self._in_flight -= 1
+                self._slots.release()
+            yield context, results
+
+    def in_flight(self) -> int:
+        """Number of batches submitted but not yet delivered."""
+        return self._in_flight
+
+    def shutdown(self):
+        if self._executor:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
@@ -0,0 +1,309 @@
+"""
+Horizontally sharded detection: flows are partitioned by source IP across N shard workers.
+
+    ingest (submit) --flows.<n>--> shard worker n --results--> merge (results)
+
+Each shard worker has its own AnomalyModel, AlertAggregator and AssetStore, so per-IP
+state (alert windows, discovered hosts) never has to be shared: every flow of an IP
+goes to the same shard, in order. The merge stage, in the server process, feeds the
+WebSocket managers and the database writer with what the shards send back.
+
+Messages travel through a Broker:
+- IpcBroker (default) runs each shard in its own process and connects them with
+  multiprocessing queues.
+- InMemoryBroker runs the shards as threads in the server process, sharing its models.
+  It is a stand-in for tests and single-core hosts.
+A network broker (e.g. Redis streams or Kafka topics) implements the same four methods,
+with start_worker() left to whatever launches run_shard() on the other hosts.
+"""
+import abc
+import asyncio
+import multiprocessing
+import queue
+import threading
+import time
+import zlib
+
+import numpy as np
+
+import metrics
+from alert_aggregator import AlertAggregator
+from asset_store import AssetStore
+from features import vector_to_dict
+
+RESULTS_TOPIC = "results"
+STOP = "__stop__"  # Published to a flows topic to stop its shard
+
+SHARD_FLOWS = metrics.Counter("shard_flows_total", "Flows scored, by shard", ("shard",))
+
+def shard_for(ip: str, shards: int) -> int:
+    """Stable across processes and hosts, unlike hash(), which is salted per process."""
+    return zlib.crc32(ip.encode()) % shards if ip else 0
+
+def flows_topic(shard_id: int) -> str:
+    return f"flows.{shard_id}"
+
+# --- Brokers ---
+
+class Broker(abc.ABC):
+    """
+    Carries flow batches to the shards and their results back.
+    publish() blocks while the topic is full (or up to timeout seconds, then raises
+    queue.Full), which pushes back on the sender.
+    consume() returns None if nothing arrived within timeout seconds.
+    in_process is True when the workers run inside the server process.
+    """
+    in_process = False
+
+    @abc.abstractmethod
+    def publish(self, topic: str, message, timeout: float = None):
+        ...
+
+    @abc.abstractmethod
+    def consume(self, topic: str, timeout: float):
+        ...
+
+    @abc.abstractmethod
+    def start_worker(self, target, args: tuple):
+        ...
+
+    def close(self):
+        pass
+
+
+class IpcBroker(Broker):
+    """One bounded multiprocessing queue per topic; shard workers are spawned processes."""
+    def __init__(self, shards: int, queue_size: int = 64):
+        context = multiprocessing.get_context("spawn")
+        self._context = context
+        self.queues = {flows_topic(shard_id): context.Queue(maxsize=queue_size) for shard_id in range(shards)}
+        self.queues[RESULTS_TOPIC] = context.Queue(maxsize=queue_size * shards)
+        self._processes = []
+
+    def __getstate__(self):
+        # Workers only need the queues
+        return {"queues": self.queues}
+
+    def __setstate__(self, state):
+        self.queues = state["queues"]
+        self._context = None
+        self._processes = []
+
+    def publish(self, topic: str, message, timeout: float = None):
+        self.queues[topic].put(message, timeout=timeout)
+
+    def consume(self, topic: str, timeout: float):
+        try:
+            return self.queues[topic].get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def start_worker(self, target, args: tuple):
+        process = self._context.Process(target=target, args=args, name=f"shard-{args[0]}", daemon=True)
+        process.start()
+        self._processes.append(process)
+
+    def close(self):
+        for process in self._processes:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+        self._processes = []
+
+
+class InMemoryBroker(Broker):
+    """Bounded queue.Queue topics; shard workers are threads sharing the server's models."""
+    in_process = True
+
+    def __init__(self, queue_size: int = 64):
+        self.queue_size = queue_size
+        self.queues = {}
+        self._lock = threading.Lock()
+
+    def _queue(self, topic: str) -> queue.Queue:
+        with self._lock:
+            return self.queues.setdefault(topic, queue.Queue(maxsize=self.queue_size))
+
+    def publish(self, topic: str, message, timeout: float = None):
+        self._queue(topic).put(message, timeout=timeout)
+
+    def consume(self, topic: str, timeout: float):
+        try:
+            return self._queue(topic).get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def start_worker(self, target, args: tuple):
+        threading.Thread(target=target, args=args, name=f"shard-{args[0]}", daemon=True).start()
+
+BROKERS = ("ipc", "memory")
+
+def make_broker(kind: str, shards: int, queue_size: int = 64) -> Broker:
+    if kind == "ipc":
+        return IpcBroker(shards, queue_size)
+    if kind == "memory":
+        return InMemoryBroker(queue_size)
+    raise ValueError(f"Unknown shard broker: {kind}")
+
+# --- Shard worker ---
+
+class Shard:
+    """
+    Scores one shard's flows and keeps its per-IP state.
+    config holds "assets", "ranges", "max_discovered", "flush_interval_s" for the AssetStore and
+    "aggregation" (AlertAggregator keyword arguments, or None to disable it).
+    """
+    def __init__(self, shard_id: int, model, config: dict):
+        self.shard_id = shard_id
+        self.model = model
+        aggregation = config.get("aggregation")
+        self.aggregator = AlertAggregator(**aggregation) if aggregation is not None else None
+        self._asset_rows = []  # Discovered hosts to persist, handed to the merge stage
+        self.assets = AssetStore(config.get("assets", {}), config.get("ranges"), config.get("max_discovered", 50000),
+                                 persist=lambda *row: self._asset_rows.append(row))
+        self.flows = 0
+        self.alerts = 0
+        self._last_tick = self._last_asset_flush = time.monotonic()
+        self.asset_flush_interval_s = config.get("flush_interval_s", 10.0)
+        self._reported_ready = None  # Readiness last sent to the merge stage
+
+    def process(self, batch: list, now: float = None):
+        """
+        Scores a batch of (log_dict, feature_vector) and returns a result message, or
+        None if there is nothing to report. A change of readiness (stats "ready") is
+        always reported. Message "flows" entries are
+        (payload, is_malicious, alert to store and broadcast or None, criticality),
+        "events" entries are (alert window update or summary, criticality).
+        """
+        now = time.monotonic() if now is None else now
+        flows, errors = [], 0
+        if batch:
+            try:
+                predictions = self.model.is_malicious_batch(np.vstack([vector for _, vector in batch]))
+            except Exception as e:
+                print(f"Error in shard {self.shard_id}: {e}")
+                errors = 1
+                predictions = [{"is_malicious": False, "risk_score": 0, "reason": f"Prediction Error: {e}",
+                                "playbook": []} for _ in batch]
+            for (log_dict, feature_vector), prediction in zip(batch, predictions):
+                ip = log_dict.get("ip")
+                if ip:
+                    self.assets.discover(ip, log_dict.get("timestamp"))
+                payload = log_dict
+                payload['features'] = vector_to_dict(feature_vector)
+                alert = criticality = None
+                if prediction["is_malicious"]:
+                    alert = dict(payload, risk_score=prediction['risk_score'], reason=prediction['reason'],
+                                 playbook=prediction['playbook'])
+                    # Repeats of an open (ip, reason) window are only counted
+                    if self.aggregator and self.aggregator.observe(alert, now) is None:
+                        alert = None
+                    else:
+                        criticality = self.assets.criticality(ip)
+                        self.alerts += 1
+                flows.append((payload, prediction["is_malicious"], alert, criticality))
+            self.flows += len(batch)
+
+        if now - self._last_asset_flush >= self.asset_flush_interval_s:
+            self.assets.flush()  # Rows land in _asset_rows, for the merge stage to save
+            self._last_asset_flush = now
+        events = []
+        if self.aggregator and now - self._last_tick >= 1:
+            events = [(event, self.assets.criticality(event['ip'])) for event in self.aggregator.tick(now)]
+            self._last_tick = now
+        ready = self.model.is_ready()
+        if not (flows or events or self._asset_rows or errors or ready != self._reported_ready):
+            return None
+        self._reported_ready = ready
+        assets, self._asset_rows = self._asset_rows, []
+        return {"shard": self.shard_id, "flows": flows, "events": events, "assets": assets,
+                "errors": errors, "stats": self.stats()}
+
+    def stats(self) -> dict:
+        stats = {"ready": self.model.is_ready(), "flows": self.flows, "alerts": self.alerts, **self.assets.stats()}
+        if self.aggregator:
+            stats.update(self.aggregator.stats())
+        return stats
+
+def run_shard(shard_id: int, broker: Broker, config: dict):
+    """Worker loop for one shard, until STOP arrives on its flows topic."""
+    from ml_model import model_instance
+    if not broker.in_process:
+        model_instance.load()  # A worker process loads its own models
+    shard = Shard(shard_id, model_instance, config)
+    topic = flows_topic(shard_id)
+    while True:
+        # Wake up at least once a second so alert windows are ticked without traffic
+        batch = broker.consume(topic, timeout=1.0)
+        if batch == STOP:
+            return
+        result = shard.process(batch or [])
+        if result:
+            broker.publish(RESULTS_TOPIC, result)
+
+# --- Ingest and merge, in the server process ---
+
+class ShardRouter:
+    """
+    submit() splits a batch by source IP and publishes each part to its shard.
+    results() yields the shards' result messages as they arrive. Order is kept per
+    shard (and so per IP), not across shards.
+    """
+    def __init__(self, broker: Broker, shards: int, config: dict, max_pending_results: int = 64):
+        if shards < 1:
+            raise ValueError(f"Need at least one shard, got {shards}")
+        self.broker = broker
+        self.shards = shards
+        self.config = config
+        self.max_pending_results = max_pending_results
+        self.shard_stats = {shard_id: {} for shard_id in range(shards)}
+        self._results = None
+        self._closed = False
+        self._flow_counters = [SHARD_FLOWS.labels(str(shard_id)) for shard_id in range(shards)]
+
+    def start(self):
+        """Starts the shard workers and the results reader. Must be called from the running event loop."""
+        for shard_id in range(self.shards):
+            self.broker.start_worker(run_shard, (shard_id, self.broker, self.config))
+        self._results = asyncio.Queue(maxsize=self.max_pending_results)
+        threading.Thread(target=self._read_results, args=(asyncio.get_running_loop(),),
+                         name="shard-results", daemon=True).start()
+
+    def _read_results(self, loop):
+        while not self._closed:
+            message = self.broker.consume(RESULTS_TOPIC, timeout=0.5)
+            if message is not None:
+                # Blocks while the merge stage is behind, so backpressure reaches the shards
+                asyncio.run_coroutine_threadsafe(self._results.put(message), loop).result()
+
+    async def submit(self, batch: list):
+        parts = {}
+        for item in batch:
+            parts.setdefault(shard_for(item[0].get("ip"), self.shards), []).append(item)
+        for shard_id, part in parts.items():
+            # Blocks (off the event loop) while that shard's queue is full
+            await asyncio.to_thread(self.broker.publish, flows_topic(shard_id), part)
+
+    async def results(self):
+        while True:
+            message = await self._results.get()
+            self.shard_stats[message["shard"]] = message["stats"]
+            self._flow_counters[message["shard"]].inc(len(message["flows"]))
+            yield message
+
+    def is_ready(self) -> bool:
+        """True once every shard has reported that its models are loaded."""
+        return all(stats.get("ready") for stats in self.shard_stats.values())
+
+    def stats(self) -> dict:
+        return {"shards": self.shards, "broker": type(self.broker).__name__,
+                "per_shard": {str(shard_id): stats for shard_id, stats in self.shard_stats.items()}}
+
+    def shutdown(self):
+        self._closed = True
+        for shard_id in range(self.shards):
+            try:
+                self.broker.publish(flows_topic(shard_id), STOP, timeout=1)
+            except queue.Full:
+                pass  # Still busy; IpcBroker.close() terminates it
+        self.broker.close()
@@ -0,0 +1,177 @@
+"""
+Opt-in batched wire format for the WebSocket streams.
+
+A client opts in at connect time with query parameters, e.g.
+    /ws/processed?format=msgpack&min_risk=70&reason=XSS&country=Germany
+- format:   "json" or "msgpack" (msgpack falls back to json if the package is not installed)
+- min_risk: only messages with at least this risk score
+- reason:   only messages whose reason contains one of these (repeatable)
+- ip:       only messages for these IPs (repeatable)
+- country:  only messages whose GeoIP country is one of these (repeatable)
+- max_rate: at most this many messages per second; priority (malicious) messages always
+            pass and the rest are reservoir-sampled, with "summary" frames giving exact counts
+
+After the handshake the client receives a "hello" frame with the chosen format and
+the feature names. Then it gets one "batch" frame per tick with the messages that
+passed its filters, laid out column by column: a "columns" object with one array per
+field, and a "features" array holding one list of values per message in feature_names
+order. Clients with identical subscriptions share a single encoded frame.
+Clients without these parameters keep the one-JSON-message-per-frame protocol.
+"""
+import json
+import random
+
+from features import FEATURE_NAMES
+
+try:
+    import msgpack
+except ImportError:  # Optional dependency; msgpack subscribers get JSON instead
+    msgpack = None
+
+FORMATS = ("json", "msgpack")
+
+class Subscription:
+    """One client's encoding and filters. Equal subscriptions have equal keys."""
+    def __init__(self, format: str = "json", min_risk: float = None, reasons=(), ips=(), countries=(),
+                 max_rate: float = None):
+        if format not in FORMATS:
+            raise ValueError(f"Unknown stream format: {format}")
+        if max_rate is not None and max_rate <= 0:
+            raise ValueError(f"max_rate must be positive, got {max_rate}")
+        if format == "msgpack" and msgpack is None:
+            format = "json"
+        self.format = format
+        self.min_risk = min_risk
+        self.reasons = tuple(sorted(set(reasons)))
+        self.ips = frozenset(ips)
+        self.countries = frozenset(countries)
+        self.max_rate = max_rate
+        self.key = (self.format, self.min_risk, self.reasons, tuple(sorted(self.ips)), tuple(sorted(self.countries)),
+                    self.max_rate)
+
+    @classmethod
+    def from_query(cls, params):
+        """Builds a subscription from the connection's query parameters, or None for the legacy protocol."""
+        if "format" not in params:
+            return None
+        min_risk = params.get("min_risk")
+        max_rate = params.get("max_rate")
+        return cls(
+            format=params["format"],
+            min_risk=float(min_risk) if min_risk not in (None, "") else None,
+            reasons=params.getlist("reason"),
+            ips=params.getlist("ip"),
+            countries=params.getlist("country"),
+            max_rate=float(max_rate) if max_rate not in (None, "") else None,
+        )
+
+    def matches(self, message: dict) -> bool:
+        if self.min_risk is not None and message.get('risk_score', 0) < self.min_risk:
+            return False
+        if self.reasons:
+            reason = message.get('reason') or ""
+            if not any(wanted in reason for wanted in self.reasons):
+                return False
+        if self.ips and message.get('ip') not in self.ips:
+            return False
+        if self.countries:
+            location = message.get('location')
+            if not location or location.get('country') not in self.countries:
+                return False
+        return True
+
+    def hello(self, stream: str):
+        return encode(self.format, {
+            "type": "hello",
+            "stream": stream,
+            "format": self.format,
+            "feature_names": FEATURE_NAMES,
+            "filters": {
+                "min_risk": self.min_risk,
+                "reason": list(self.reasons),
+                "ip": sorted(self.ips),
+                "country": sorted(self.countries),
+                "max_rate": self.max_rate,
+            },
+        })
+
+
+class Sampler:
+    """
+    Holds back one rate-limited subscription group's messages between flushes.
+    Priority messages always pass. The others are reservoir-sampled (Algorithm R)
+    as they arrive, so at most max_rate per second are kept and copied. Credit for
+    unused capacity carries over for up to one second.
+    Exact counts of everything offered are reported through summary().
+    """
+    def __init__(self, subscription: Subscription, interval_s: float, now: float):
+        self.subscription = subscription
+        self.rate = subscription.max_rate
+        self.credit = min(self.rate * interval_s, self.rate)
+        self.capacity = int(self.credit)
+        self.priority = []
+        self.reservoir = []
+        self.seen = 0  # Non-priority messages offered since the last drain
+        self.last_drain = now
+        self.summary_started = now
+        self.counts = {"flows": 0, "priority": 0, "sent": 0}
+
+    def offer(self, message: dict, priority: bool = False):
+        self.counts["flows"] += 1
+        if priority:
+            self.counts["priority"] += 1
+            self.priority.append(dict(message))
+            return
+        self.seen += 1
+        if len(self.reservoir) < self.capacity:
+            self.reservoir.append(dict(message))
+        else:
+            slot = random.randrange(self.seen)
+            if slot < self.capacity:
+                self.reservoir[slot] = dict(message)
+
+    def drain(self, now: float) -> list:
+        """Returns the messages to send for this tick and sizes the reservoir for the next one."""
+        messages = self.priority + self.reservoir
+        self.credit = min(self.credit - len(self.reservoir) + self.rate * (now - self.last_drain), self.rate)
+        self.capacity = max(0, int(self.credit))
+        self.priority, self.reservoir, self.seen = [], [], 0
+        self.last_drain = now
+        self.counts["sent"] += len(messages)
+        return messages
+
+    def summary(self, stream: str, now: float) -> dict:
+        """Exact counts since the previous summary; the counters restart afterwards."""
+        frame = {"type": "summary", "stream": stream, "interval_s": round(now - self.summary_started, 3),
+                 **self.counts}
+        self.counts = {"flows": 0, "priority": 0, "sent": 0}
+        self.summary_started = now
+        return frame
+
+
+def split_features(message: dict) -> tuple:
+    """Returns (fields without the features, feature values in FEATURE_NAMES order or None)."""
+    features = message.get('features')
+    fields = {key: value for key, value in message.items() if key != 'features'}
+    if features is None:
+        return fields, None
+    return fields, [features.get(name) for name in FEATURE_NAMES]
+
+def batch_frame(stream: str, rows: list) -> dict:
+    """Lays out (fields, feature values) rows column by column. Missing fields are None."""
+    names = {}
+    for fields, _ in rows:
+        for name in fields:
+            names.setdefault(name, None)
+    return {
+        "type": "batch",
+        "stream": stream,
+        "count": len(rows),
+        "columns": {name: [fields.get(name) for fields, _ in rows] for name in names},
+        "features": [features for _, features in rows],
+    }
+
+def encode(format: str, frame: dict):
+    if format == "msgpack":
+        return msgpack.packb(frame, use_bin_type=True)
+    return json.dumps(frame, separators=(",", ":"))
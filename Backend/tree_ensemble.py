@@ -0,0 +1,133 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+
+# How leaf values are turned into predictions
+OUTPUTS = ("multiclass", "binary", "regression", "isolation_forest")
+
+# LightGBM's handling of missing values at a split
+MISSING_NONE, MISSING_ZERO, MISSING_NAN = 0, 1, 2
+ZERO_THRESHOLD = 1e-35  # LightGBM's kZeroThreshold
+
+ARRAYS = ("feature", "threshold", "children", "value", "roots", "tree_depth", "missing_type", "default_left")
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+class CompiledTreeEnsemble:
+    """
+        Array-based evaluator for tree ensembles compiled by compile_trees.py, so
+        LightGBM and scikit-learn are not needed at inference time.
+
+        All trees share one set of node arrays. Node i sends a row to
+        children[2 * i] when x[feature[i]] <= threshold[i] and to children[2 * i + 1]
+        otherwise. Leaves point back to themselves and hold value[i]. roots[t] is the
+        root of tree t and tree_depth[t] the depth of its deepest leaf.
+        meta["output"] says how the leaf values of a row become the library's predict() output.
+
+        apply() moves all rows through all trees one level per step, without branching.
+        Trees are walked deepest first, so each step only touches the trees that are
+        still deep enough to need it.
+
+        The arrays are .npy files that load memory-mapped: worker processes share
+        one copy through the page cache.
+    """
+    def __init__(self, arrays: dict, meta: dict):
+        if meta["output"] not in OUTPUTS:
+            raise ValueError(f"Unsupported ensemble output: {meta['output']}")
+        for name in ARRAYS:
+            setattr(self, name, np.asarray(arrays[name]))  # Plain ndarray views, also over memmaps
+        self.meta = meta
+        self.n_features = meta["n_features"]
+        # Deepest trees first; step k advances the first active_trees[k] of them
+        self.order = np.argsort(-self.tree_depth, kind="stable")
+        self.inverse_order = np.argsort(self.order)
+        self.order_roots = self.roots[self.order].astype(np.intp)
+        self.active_trees = [int(np.count_nonzero(self.tree_depth > step)) for step in range(self.tree_depth.max(initial=0))]
+        self.input_dtype = np.dtype(meta["input_dtype"])
+        self.missing_rules = bool(np.any(self.missing_type != MISSING_NONE))
+
+    @staticmethod
+    def path_for(model_path: str) -> str:
+        """Where a pickled model's compiled arrays live: 'isolation_forest.pkl' -> 'isolation_forest.trees'"""
+        return os.path.splitext(model_path)[0] + ".trees"
+
+    @classmethod
+    def load(cls, directory: str, mmap: bool = True) -> "CompiledTreeEnsemble":
+        with open(os.path.join(directory, "meta.json")) as f:
+            meta = json.load(f)
+        arrays = {name: np.load(os.path.join(directory, f"{name}.npy"), mmap_mode="r" if mmap else None)
+                  for name in ARRAYS}
+        return cls(arrays, meta)
+
+    def compiled_from(self, model_path: str) -> bool:
+        """True if these arrays were compiled from the pickle at model_path as it is now."""
+        return self.meta.get("source_sha256") == file_sha256(model_path)
+
+    def save(self, directory: str):
+        os.makedirs(directory, exist_ok=True)
+        for name in ARRAYS:
+            np.save(os.path.join(directory, f"{name}.npy"), getattr(self, name))
+        with open(os.path.join(directory, "meta.json"), "w") as f:
+            json.dump(self.meta, f, indent=1)
+
+    def apply(self, X) -> np.ndarray:
+        """Returns the leaf node reached in every tree, as an (n_trees, n_rows) array."""
+        X = np.ascontiguousarray(X, dtype=self.input_dtype)
+        if X.ndim != 2 or X.shape[1] != self.n_features:
+            raise ValueError(f"Expected {self.n_features} features, got shape {X.shape}")
+        if self.meta["nan_as_zero"] and not self.missing_rules and np.isnan(X).any():
+            X = np.where(np.isnan(X), 0.0, X)
+        flat = X.ravel()
+        row_offsets = np.arange(len(X), dtype=np.intp) * self.n_features
+        nodes = np.repeat(self.order_roots[:, None], len(X), axis=1)
+        for active in self.active_trees:
+            walking = nodes[:active]
+            values = flat[self.feature[walking] + row_offsets]
+            if self.missing_rules:
+                go_right = self._missing_direction(walking, values)
+            else:
+                go_right = ~(values <= self.threshold[walking])  # NaN goes right, as in both libraries
+            nodes[:active] = self.children[2 * walking + go_right]
+        return nodes[self.inverse_order]
+
+    def _missing_direction(self, nodes, values):
+        """LightGBM's missing-value rules: NaN counts as 0 unless the split has a default direction for it."""
+        missing_type = self.missing_type[nodes]
+        is_nan = np.isnan(values)
+        values = np.where(is_nan & (missing_type != MISSING_NAN), 0.0, values)
+        missing = ((missing_type == MISSING_ZERO) & (np.abs(values) <= ZERO_THRESHOLD)) | \
+                  ((missing_type == MISSING_NAN) & is_nan)
+        return np.where(missing, ~self.default_left[nodes], ~(values <= self.threshold[nodes]))
+
+    def raw_score(self, X) -> np.ndarray:
+        """Per-row sum of the leaf values, (n_rows, n_classes) for multiclass models."""
+        leaf_values = self.value[self.apply(X)]
+        n_classes = self.meta["n_classes"]
+        # Summing over the leading axis adds the trees one after the other, in the
+        # same order as the libraries do, so the sums match them exactly
+        if n_classes > 1:
+            return leaf_values.reshape(-1, n_classes, leaf_values.shape[1]).sum(axis=0).T
+        return leaf_values.sum(axis=0)
+
+    def predict(self, X) -> np.ndarray:
+        """Same output as the original model's predict(): probabilities, values or +1/-1 labels."""
+        raw = self.raw_score(X)
+        output = self.meta["output"]
+        if output == "multiclass":
+            exp = np.exp(raw - raw.max(axis=1, keepdims=True))
+            return exp / exp.sum(axis=1, keepdims=True)
+        if output == "binary":
+            return 1.0 / (1.0 + np.exp(-self.meta["sigmoid"] * raw))
+        if output == "isolation_forest":
+            # score_samples() is -2^(-mean path length / c(max_samples)); outliers score below offset_
+            denominator = self.meta["denominator"]
+            scores = 2 ** -np.divide(raw, denominator, out=np.ones_like(raw), where=denominator != 0)
+            return np.where(-scores - self.meta["offset"] < 0, -1, 1)
+        return raw
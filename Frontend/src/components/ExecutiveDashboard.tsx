@@ -91,6 +91,27 @@ const ExecutiveDashboard = () => {
             </LineChart>
           </ResponsiveContainer>
         </div>
+        <div className="bg-slate-800/50 p-6 rounded-xl border border-slate-700">
+          <h3 className="text-lg font-semibold text-white mb-4">Top Source IPs</h3>
+          <table className="w-full text-left text-sm">
+            <thead>
+              <tr className="text-slate-400">
+                <th className="py-2">IP Address</th>
+                <th className="py-2">Alerts</th>
+                <th className="py-2">Avg. Risk Score</th>
+              </tr>
+            </thead>
+            <tbody>
+              {(kpis.top_ips || []).map((row: any) => (
+                <tr key={row.ip} className="border-t border-slate-700 text-white">
+                  <td className="py-2 font-mono">{row.ip}</td>
+                  <td className="py-2">{row.alerts}</td>
+                  <td className="py-2 text-orange-400">{Math.round(row.risk_sum / row.alerts)}</td>
+                </tr>
+              ))}
+            </tbody>
+          </table>
+        </div>
       </>
     );
   };